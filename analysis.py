@@ -0,0 +1,377 @@
+"""
+Per-tile analysis layers of a generated level.
+
+Spawning, AI and targeting keep asking the same spatial questions about a
+level: which room or corridor is this tile in, how far is it from a wall,
+is it a chokepoint, can it be reached from here? `analyze` prepares the
+answers, so later queries are plain lookups.
+
+The layers are kept per chunk of the map (the chunks of a ChunkedTileMap, a
+TileMap being a single chunk), so their memory follows the carved area of
+the level rather than its size. The regions and corridors are labeled when
+the level is generated: every chunk on its own, then regions touching across
+chunk borders are joined. The distance to a wall and the chokepoints only
+depend on a tile's surroundings, they are computed for a chunk the first
+time one of its tiles is asked about.
+
+The distance passes work on whole planes packed into big integers, one byte
+per cell, so shifting by 8 bits moves the plane one cell sideways and by a
+row of bytes one cell up or down. Python's integer operations then process
+the whole chunk at C speed.
+
+"""
+from __future__ import print_function
+
+import binascii
+from array import array
+
+from tilemap import (_INVERT, ChunkedTileMap, _copy_rows, add_planes,
+                     array_from_bytes, array_to_bytes, label_regions)
+
+try:  # NumPy is optional, it only speeds up storing the region labels.
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+# Distances to a wall are capped, so that a chunk's distances can be worked
+# out from the tiles within this distance around it.
+MAX_DISTANCE = 32
+
+# Translation tables doubling a 0/1 plane, and keeping the cells that are 1.
+_DOUBLE = bytes(bytearray([0, 2] + [0] * 254))
+_ONE = bytes(bytearray([0, 1] + [0] * 254))
+
+
+def _to_int(plane):
+    """ Pack a row-major byte plane into an integer, first cell on top.
+
+    """
+    if not plane:
+        return 0
+    return int(binascii.hexlify(bytes(plane)), 16)
+
+
+def _to_plane(value, size):
+    """ Unpack an integer made by _to_int into a bytearray of size cells.
+
+    Anything shifted past the first cell is dropped.
+
+    """
+    digits = '{:0{}x}'.format(value, 2 * size)[-2 * size:]
+    return bytearray(binascii.unhexlify(digits))
+
+
+def _edges(width, height):
+    """ Return the left, right, top and bottom edge cells as packed masks.
+
+    """
+    size = width * height
+    left = bytearray(size)
+    right = bytearray(size)
+    left[::width] = b'\x01' * height
+    right[width - 1::width] = b'\x01' * height
+    top = bytearray(b'\x01' * width) + bytearray(size - width)
+    bottom = bytearray(size - width) + bytearray(b'\x01' * width)
+    return _to_int(left), _to_int(right), _to_int(top), _to_int(bottom)
+
+
+def _wall_layers(blocked, width, height):
+    """ Return the distance and chokepoint planes of a blocked plane.
+
+    Everything outside of the plane counts as wall.
+
+    """
+    size = width * height
+    left, right, top, bottom = _edges(width, height)
+    row = 8 * width
+
+    walls = _to_int(blocked)
+    floor = _to_int(blocked.translate(_INVERT))
+
+    # Distance to a wall: every erosion of the floor by a 3x3 square peels
+    # off one more step, so a tile's distance is the number of erosions it
+    # survives. Tiles on the edge touch the outside, which is wall.
+    inner = floor & ~(left | right | top | bottom)
+    total = floor
+    eroded = floor
+    for i in range(MAX_DISTANCE - 1):
+        eroded = eroded & (eroded << 8) & (eroded >> 8)
+        eroded = eroded & (eroded << row) & (eroded >> row) & inner
+        if not eroded:
+            break
+        total += eroded
+    distance = _to_plane(total, size)
+
+    # Chokepoints: floor walled in on the left and right, or above and below.
+    wall_left = (walls >> 8) | left
+    wall_right = (walls << 8) | right
+    wall_up = (walls >> row) | top
+    wall_down = (walls << row) | bottom
+    chokepoints = _to_plane(floor & ((wall_left & wall_right) |
+                                     (wall_up & wall_down)), size)
+    return distance, chokepoints
+
+
+def _byte_labels(labels):
+    """ Return an array('i') of region labels, all below 128, as array('b').
+
+    """
+    if numpy_available:
+        return array_from_bytes('b', numpy.frombuffer(labels, numpy.intc)
+                                .astype(numpy.int8).tobytes())
+    return array('b', labels)
+
+
+def chunk_layout(tiles):
+    """ Return the chunk width and height of a map and its chunks by key.
+
+    Works on TileMap, which is a single chunk, and ChunkedTileMap alike.
+
+    """
+    if isinstance(tiles, ChunkedTileMap):
+        return tiles.chunk_size, tiles.chunk_size, tiles.chunks
+    return tiles.width, tiles.height, {(0, 0): tiles}
+
+
+class ChunkLabels(object):
+    """ The connected regions of the open cells of a map, labeled per chunk.
+
+        labels  - by chunk key, the region of every cell of the chunk among
+                  the chunk's own regions (see label_regions), -1 for closed
+                  cells
+        ids     - by chunk key, the map-wide region of each of those
+        sizes   - the number of cells in each map-wide region
+
+    Cells connect to their four direct neighbours, across chunk borders as
+    well. Chunks without open cells are left out.
+
+    """
+    def __init__(self, chunk_width, chunk_height, planes):
+        """ Label the open cells of `planes`, 0/1 planes by chunk key.
+
+        """
+        self.chunk_width = chunk_width
+        self.chunk_height = chunk_height
+        self.labels = {}
+        local_sizes = {}
+        for key, plane in planes.items():
+            labels, sizes = label_regions(plane, chunk_width)
+            if not sizes:
+                continue
+            # Most chunks hold few regions, one byte per cell is enough.
+            self.labels[key] = _byte_labels(labels) if len(sizes) < 128 \
+                else labels
+            local_sizes[key] = sizes
+
+        # Join the regions touching across chunk borders, with a union-find
+        # over (chunk key, region within the chunk).
+        parents = {}
+
+        def find(node):
+            while node in parents:
+                node = parents[node]
+            return node
+
+        def join(a, b):
+            a, b = find(a), find(b)
+            if a != b:
+                parents[max(a, b)] = min(a, b)
+
+        width, height = chunk_width, chunk_height
+        last_row = (height - 1) * width
+        for (cx, cy), labels in self.labels.items():
+            right = self.labels.get((cx + 1, cy))
+            if right is not None:
+                for i in range(0, height * width, width):
+                    a, b = labels[i + width - 1], right[i]
+                    if a >= 0 and b >= 0:
+                        join(((cx, cy), a), ((cx + 1, cy), b))
+            below = self.labels.get((cx, cy + 1))
+            if below is not None:
+                for x in range(width):
+                    a, b = labels[last_row + x], below[x]
+                    if a >= 0 and b >= 0:
+                        join(((cx, cy), a), ((cx, cy + 1), b))
+
+        # Number the map-wide regions in the order the chunks come, row by
+        # row.
+        self.ids = {}
+        self.sizes = []
+        regions = {}
+        for key in sorted(self.labels, key=lambda key: (key[1], key[0])):
+            ids = []
+            for local, size in enumerate(local_sizes[key]):
+                root = find((key, local))
+                if root not in regions:
+                    regions[root] = len(self.sizes)
+                    self.sizes.append(0)
+                self.sizes[regions[root]] += size
+                ids.append(regions[root])
+            self.ids[key] = ids
+
+    def at(self, key, index):
+        """ Return the map-wide region of a cell of a chunk, or None.
+
+        """
+        labels = self.labels.get(key)
+        if labels is None or labels[index] < 0:
+            return None
+        return self.ids[key][labels[index]]
+
+    def __getstate__(self):
+        # Pickle the label planes as raw bytes rather than lists of ints.
+        state = self.__dict__.copy()
+        state['labels'] = dict((key, (labels.typecode, array_to_bytes(labels)))
+                               for key, labels in self.labels.items())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        labels = state['labels']
+        self.labels = dict((key, array_from_bytes(typecode, data))
+                           for key, (typecode, data) in labels.items())
+
+
+class MapAnalysis(object):
+    """ The analysis layers of a level.
+
+        regions    - ChunkLabels of the walkable tiles, region_sizes holds
+                     the number of tiles in each region
+        corridors  - ChunkLabels of the walkable tiles outside of the rooms'
+                     bounds, every region being a corridor
+
+    Room ids come from the level's RoomIndex, corridor ids count on from the
+    number of rooms. The distance to a wall and the chokepoints of a chunk
+    are computed from the map the first time they are asked for, they are
+    not pickled.
+
+    """
+    def __init__(self, tiles, room_index, regions, corridors):
+        self.tiles = tiles
+        self.room_index = room_index
+        self.width = tiles.width
+        self.height = tiles.height
+        self.regions = regions
+        self.corridors = corridors
+        self.region_sizes = regions.sizes
+        self.room_count = room_index.count
+        self.corridor_count = len(corridors.sizes)
+        # The distance and chokepoint planes of the chunks asked about.
+        self.chunk_walls = {}
+
+    def _locate(self, x, y):
+        """ Return the chunk key and the index within the chunk of a tile.
+
+        """
+        width = self.regions.chunk_width
+        height = self.regions.chunk_height
+        return (x // width, y // height), (y % height) * width + x % width
+
+    def _walls(self, key):
+        """ Return the distance and chokepoint planes of a chunk.
+
+        """
+        walls = self.chunk_walls.get(key)
+        if walls is None:
+            width = self.regions.chunk_width
+            height = self.regions.chunk_height
+            # Tiles up to MAX_DISTANCE away count, outside of the map is
+            # wall already.
+            margin = MAX_DISTANCE if isinstance(self.tiles, ChunkedTileMap) \
+                else 0
+            view = self.tiles.window(key[0] * width - margin,
+                                     key[1] * height - margin,
+                                     width + 2 * margin, height + 2 * margin)
+            walls = _wall_layers(view.blocked, view.width, view.height)
+            if margin:
+                cropped = []
+                for plane in walls:
+                    chunk = bytearray(width * height)
+                    _copy_rows(plane, view.width, margin, margin,
+                               chunk, width, 0, 0, width, height)
+                    cropped.append(chunk)
+                walls = tuple(cropped)
+            self.chunk_walls[key] = walls
+        return walls
+
+    def area_at(self, x, y):
+        """ Return the room or corridor id of the tile, or None.
+
+        """
+        room_id = self.room_index.room_at(x, y)
+        if room_id is not None:
+            return room_id
+        corridor = self.corridor_at(x, y)
+        return None if corridor is None else self.room_count + corridor
+
+    def corridor_at(self, x, y):
+        """ Return the corridor number (0 based) of the tile, or None.
+
+        """
+        return self.corridors.at(*self._locate(x, y))
+
+    def distance_to_wall(self, x, y):
+        """ Return the steps (diagonals included) to the nearest wall.
+
+        Walls are 0 away, distances stop at MAX_DISTANCE.
+
+        """
+        key, index = self._locate(x, y)
+        return self._walls(key)[0][index]
+
+    def is_chokepoint(self, x, y):
+        """ Whether the tile is floor with walls on two opposite sides, as in
+            corridors and doorways.
+
+        """
+        key, index = self._locate(x, y)
+        return self._walls(key)[1][index]
+
+    def region_at(self, x, y):
+        """ Return the connected region of a floor tile, or None for walls.
+
+        """
+        return self.regions.at(*self._locate(x, y))
+
+    def connected(self, a, b):
+        """ Whether a walk leads from tile a to tile b, both (x, y).
+
+        """
+        region = self.region_at(*a)
+        return region is not None and region == self.region_at(*b)
+
+    def unreachable_from(self, x, y):
+        """ Return the regions that can't be reached from the tile.
+
+        """
+        region = self.region_at(x, y)
+        return [r for r in range(len(self.region_sizes)) if r != region]
+
+    def __getstate__(self):
+        # The wall planes are computed again when asked for.
+        state = self.__dict__.copy()
+        state['chunk_walls'] = {}
+        return state
+
+
+def analyze(tiles, room_index):
+    """ Compute the analysis layers of a map and its RoomIndex.
+
+    Works on TileMap and ChunkedTileMap alike.
+
+    """
+    width, height, chunks = chunk_layout(tiles)
+    walkable = {}
+    corridors = {}
+    for (cx, cy), chunk in chunks.items():
+        walkable[(cx, cy)] = chunk.blocked.translate(_INVERT)
+
+        # Corridors are the walkable tiles outside of any room's bounds.
+        occupied = room_index.window(cx * width, cy * height, width, height)
+        corridors[(cx, cy)] = add_planes(
+            walkable[(cx, cy)], occupied.translate(_DOUBLE)).translate(_ONE)
+
+    return MapAnalysis(tiles, room_index,
+                       ChunkLabels(width, height, walkable),
+                       ChunkLabels(width, height, corridors))
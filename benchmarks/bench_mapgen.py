@@ -0,0 +1,288 @@
+"""
+Time the map generation pipeline: make_map, place_objects, the
+connectivity analysis and initialize_fov.
+
+Runs headless, only an off-screen console is created, no SDL window. Every
+map size / room count / generator combination is generated from the same
+fixed seeds each run, so runs are comparable:
+
+    python benchmarks/bench_mapgen.py
+    python benchmarks/bench_mapgen.py --sizes 80x43,500x500 --rooms 30,200
+    python benchmarks/bench_mapgen.py --generators rooms,bsp --prefab-chance 50
+
+Every generated level is also validated: a level with unreachable stairs
+or floor fails the run.
+
+Pass --save-baseline to store the results, later runs then exit with an
+error when a stage got slower, or its peak memory grew more, than the
+baseline allows. Memory is the peak of the Python allocations a stage makes,
+traced with tracemalloc in one more run of it. Without tracemalloc (before
+Python 3.4) the stage runs in a forked process instead and the growth of its
+peak resident size is shown, marked with a '*'. That figure is mostly
+allocator noise, so it is for information only: it is neither saved nor
+compared. Baselines are machine specific, save one on the machine the
+comparisons run on. With
+--check, a run that has no baseline to compare a case against fails too, so
+a CI run can't pass without comparing anything.
+
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import itertools
+import json
+import os
+import struct
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # libtcodpy loads ./libtcod.so
+
+import libtcodpy as libtcod  # noqa: E402
+import main as game  # noqa: E402
+from analysis import analyze  # noqa: E402
+
+try:  # Python 3.4 and later, memory is only compared with it.
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:  # Unix only, memory is not reported without either.
+    import resource
+except ImportError:
+    resource = None
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'mapgen_baseline.json')
+STAGES = ('make_map', 'place_objects', 'connectivity', 'initialize_fov')
+
+# Peak memory growth below this many KB is never a regression, it is within
+# the noise of the garbage collector from run to run.
+MEMORY_SLACK_KB = 256
+
+
+def parse_list(value, convert=str):
+    return [convert(v) for v in value.split(',') if v]
+
+
+def parse_size(value):
+    w, h = value.lower().split('x')
+    return int(w), int(h)
+
+
+def configure(size, rooms, generator, prefab_chance):
+    game.MAP_WIDTH, game.MAP_HEIGHT = size
+    game.MAX_ROOMS = rooms
+    game.MAP_GENERATOR = generator
+    game.PREFAB_CHANCE = prefab_chance
+
+
+def stage_make_map(seeds, level):
+    # Only the generator's own stages, the analysis is timed as connectivity.
+    for seed in seeds:
+        game.LevelBuilder(game.map_stages(seed, level)).finish()
+
+
+def stage_place_objects(levels, seeds, level):
+    for generated, seed in zip(levels, seeds):
+        rng = libtcod.random_new_from_seed(game.level_seed(seed, level))
+        for room in generated.rooms:
+            game.place_objects(room, generated.map, [], rng, level,
+                               reserved=[generated.start])
+        libtcod.random_delete(rng)
+
+
+def stage_connectivity(levels):
+    for generated in levels:
+        analyze(generated.map, generated.room_index)
+
+
+def stage_initialize_fov(levels):
+    for generated in levels:
+        game.enter_level(generated)
+        game.initialize_fov()
+        libtcod.map_delete(game.fov_map)
+
+
+def peak_memory(func):
+    """ Return the peak KB of Python memory func allocates, and whether
+        that can be compared with a baseline.
+
+    Without tracemalloc, the growth of the peak resident size is returned
+    instead, which can't be compared, or None where that can't be measured
+    either.
+
+    """
+    if tracemalloc is None:
+        return resident_growth(func), False
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / 1024.0, True
+
+
+def resident_growth(func):
+    """ Return by how many KB func grows the peak resident size, or None.
+
+    func runs in a forked process, whose peak starts out at its current
+    size, so earlier runs and stages don't hide what it allocates.
+
+    """
+    if resource is None or not hasattr(os, 'fork'):
+        return None
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            gc.collect()
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func()
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_end, struct.pack('q', after - before))
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    data = os.read(read_end, 8)
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    if len(data) != 8:
+        raise RuntimeError('measuring the memory of {} failed'.format(func))
+    # ru_maxrss is in KB on Linux but in bytes on macOS.
+    kb = struct.unpack('q', data)[0]
+    return kb / 1024.0 if sys.platform == 'darwin' else float(kb)
+
+
+def measure(func, repeat):
+    """ Return the best time in ms and the peak memory in KB of func, and
+        whether the memory can be compared, see peak_memory.
+
+    """
+    ms = min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+    kb, comparable = peak_memory(func)
+    return ms, kb, comparable
+
+
+def run_case(seeds, level, repeat):
+    """ Return the stage measurements and the level problems of a case.
+
+    """
+    levels = [game.generate_level(seed, level) for seed in seeds]
+    problems = ['seed {}: {}'.format(seed, problem)
+                for seed, generated in zip(seeds, levels)
+                for problem in generated.problems]
+    return {
+        'make_map': measure(lambda: stage_make_map(seeds, level), repeat),
+        'place_objects': measure(
+            lambda: stage_place_objects(levels, seeds, level), repeat),
+        'connectivity': measure(lambda: stage_connectivity(levels), repeat),
+        'initialize_fov': measure(lambda: stage_initialize_fov(levels),
+                                  repeat),
+    }, problems
+
+
+def regressions(results, baseline, tolerance):
+    """ Yield a line for every stage that got worse than the baseline.
+
+    """
+    for case, stages in sorted(results.items()):
+        for stage, (ms, kb) in sorted(stages.items()):
+            if case not in baseline or stage not in baseline[case]:
+                continue
+            base_ms, base_kb = baseline[case][stage]
+            if ms > base_ms * (1 + tolerance):
+                yield '{} {}: {:.2f}ms, baseline {:.2f}ms'.format(
+                    case, stage, ms, base_ms)
+            if (None not in (kb, base_kb) and
+                    kb > base_kb * (1 + tolerance) + MEMORY_SLACK_KB):
+                yield '{} {}: {:.1f}KB, baseline {:.1f}KB'.format(
+                    case, stage, kb, base_kb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=lambda v: parse_list(v, parse_size),
+                        default=[(80, 43), (200, 200), (500, 500)])
+    parser.add_argument('--rooms', type=lambda v: parse_list(v, int),
+                        default=[30, 100])
+    parser.add_argument('--generators', type=parse_list, default=['rooms'])
+    parser.add_argument('--seeds', type=lambda v: parse_list(v, int),
+                        default=[1, 2, 3])
+    parser.add_argument('--level', type=int, default=1)
+    parser.add_argument('--prefab-chance', type=int,
+                        default=game.PREFAB_CHANCE,
+                        help='percent of rooms that are prefabs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown before failing (0.25 = 25%%)')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true',
+                        help='fail when a case has no baseline')
+    args = parser.parse_args()
+
+    # initialize_fov clears the buffer console and centers on the player.
+    game.con = libtcod.console_new(game.SCREEN_WIDTH, game.SCREEN_HEIGHT)
+    game.player = game.Object(0, 0, '@', 'player', libtcod.white,
+                              blocks=True)
+
+    results = {}
+    invalid = []
+    informational = False
+    print('{:<24}{:>16}{:>12}{:>12}'.format('case', 'stage', 'time',
+                                            'peak'))
+    for size, rooms, generator in itertools.product(args.sizes, args.rooms,
+                                                    args.generators):
+        configure(size, rooms, generator, args.prefab_chance)
+        case = '{}x{}/{}/{}'.format(size[0], size[1], rooms, generator)
+        stages, problems = run_case(args.seeds, args.level, args.repeat)
+        invalid.extend('{} {}'.format(case, p) for p in problems)
+        results[case] = {}
+        for stage in STAGES:
+            ms, kb, comparable = stages[stage]
+            results[case][stage] = (ms, kb if comparable else None)
+            if kb is not None and not comparable:
+                informational = True
+            print('{:<24}{:>16}{:>10.2f}ms{:>12}'.format(
+                  case, stage, ms, '-' if kb is None else
+                  '{:.1f}KB{}'.format(kb, '' if comparable else '*')))
+    libtcod.console_delete(game.con)
+    if informational:
+        print('* peak resident size growth, not saved or compared')
+
+    for line in invalid:
+        print('INVALID LEVEL ' + line)
+    if invalid:
+        return 1
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --save-baseline to store one.'
+              .format(args.baseline))
+        return 1 if args.check else 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    missing = [case for case in sorted(results) if case not in baseline]
+    for case in missing:
+        print('NO BASELINE ' + case)
+    failures = list(regressions(results, baseline, args.tolerance))
+    for line in failures:
+        print('REGRESSION ' + line)
+    return 1 if failures or (args.check and missing) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
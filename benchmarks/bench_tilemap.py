@@ -0,0 +1,122 @@
+"""
+Compare the array-backed `TileMap` against the old list-of-lists of `Tile`
+objects.
+
+Runs headless, no libtcod or SDL window is needed:
+
+    python benchmarks/bench_tilemap.py
+    python benchmarks/bench_tilemap.py --width 400 --height 300
+
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from tilemap import TileMap  # noqa: E402
+
+
+class LegacyTile(object):
+    """ The per-cell Tile object the map used to be built from.
+
+    """
+    def __init__(self, blocked, block_sight=None):
+        self.explored = False
+        self.blocked = blocked
+        self.block_sight = blocked if block_sight is None else block_sight
+
+
+def legacy_map(width, height):
+    return [[LegacyTile(True) for y in range(height)] for x in range(width)]
+
+
+def legacy_carve(tiles, width, height):
+    for x in range(1, width - 1):
+        for y in range(1, height - 1):
+            tiles[x][y].blocked = False
+            tiles[x][y].block_sight = False
+
+
+def legacy_scan(tiles, width, height):
+    # What render_all and initialize_fov did: one lookup per attribute.
+    walls = 0
+    for y in range(height):
+        for x in range(width):
+            if tiles[x][y].block_sight and not tiles[x][y].explored:
+                walls += 1
+    return walls
+
+
+def tilemap_carve(tiles, width, height):
+    tiles.carve_rect(1, 1, width - 2, height - 2)
+
+
+def tilemap_scan(tiles, width, height):
+    block_sight = tiles.block_sight
+    explored = tiles.explored
+    walls = 0
+    for y in range(height):
+        row = y * width
+        for x in range(width):
+            if block_sight[row + x] and not explored[row + x]:
+                walls += 1
+    return walls
+
+
+def legacy_size(tiles):
+    size = sys.getsizeof(tiles)
+    for column in tiles:
+        size += sys.getsizeof(column)
+        for tile in column:
+            size += sys.getsizeof(tile) + sys.getsizeof(tile.__dict__)
+    return size
+
+
+def tilemap_size(tiles):
+    return (sys.getsizeof(tiles) + sys.getsizeof(tiles.__dict__) +
+            sum(sys.getsizeof(getattr(tiles, p)) for p in TileMap.PLANES))
+
+
+def best_of(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--width', type=int, default=80)
+    parser.add_argument('--height', type=int, default=43)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    w, h, repeat = args.width, args.height, args.repeat
+    old = legacy_map(w, h)
+    new = TileMap(w, h)
+
+    rows = [
+        ('build', best_of(lambda: legacy_map(w, h), repeat),
+         best_of(lambda: TileMap(w, h), repeat)),
+        ('carve', best_of(lambda: legacy_carve(old, w, h), repeat),
+         best_of(lambda: tilemap_carve(new, w, h), repeat)),
+        ('scan', best_of(lambda: legacy_scan(old, w, h), repeat),
+         best_of(lambda: tilemap_scan(new, w, h), repeat)),
+    ]
+
+    print('Map size: {}x{} ({} cells)'.format(w, h, w * h))
+    print('{:<8}{:>14}{:>14}{:>10}'.format('stage', 'Tile lists', 'TileMap',
+                                           'speedup'))
+    for name, before, after in rows:
+        print('{:<8}{:>12.3f}ms{:>12.3f}ms{:>9.1f}x'.format(
+              name, before * 1000, after * 1000, before / after))
+
+    before, after = legacy_size(old), tilemap_size(new)
+    print('{:<8}{:>12.1f}KB{:>12.1f}KB{:>9.1f}x'.format(
+          'memory', before / 1024.0, after / 1024.0, float(before) / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Cellular-automata cave layouts.
+
+The cave starts out as random noise and is smoothed a few times with the
+usual "4-5" rule: a cell becomes a wall when at least five of the nine cells
+of its 3x3 block are walls. Every step works on the whole grid at once, with
+NumPy when it is available and through big integer arithmetic otherwise, so
+there is no per-cell Python loop either way.
+
+"""
+from __future__ import print_function
+
+import binascii
+import random
+
+from tilemap import _INVERT, find_regions
+
+try:  # NumPy is optional, the fallback gives the exact same caves.
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+# A cell with at least this many walls in its 3x3 block becomes a wall.
+WALL_THRESHOLD = 5
+
+# Hex digits holding a 3x3 wall count, mapped to 1 (wall) or 0 (floor).
+_HEX_TO_WALL = bytes(bytearray(
+    1 if ord('0') + WALL_THRESHOLD <= i <= ord('9') else 0
+    for i in range(256)))
+_WALL_TO_HEX = bytes(bytearray(b'01' + b'0' * 254))
+
+
+def noise(width, height, seed, wall_chance):
+    """ Return a width x height plane of random walls (1) and floors (0).
+
+    `wall_chance` is the chance in percent of a cell being a wall.
+
+    """
+    size = width * height
+    bits = random.Random(seed).getrandbits(8 * size)
+    raw = binascii.unhexlify('{:0{}x}'.format(bits, 2 * size))
+    threshold = bytes(bytearray(
+        1 if i * 100 < wall_chance * 256 else 0 for i in range(256)))
+    return bytearray(raw.translate(threshold))
+
+
+def _close_border(walls, width, height):
+    walls[:width] = b'\x01' * width
+    walls[-width:] = b'\x01' * width
+    walls[::width] = b'\x01' * height
+    walls[width - 1::width] = b'\x01' * height
+
+
+def _step_numpy(walls, width, height):
+    grid = numpy.frombuffer(bytes(walls), numpy.uint8).reshape(height, width)
+    padded = numpy.pad(grid, 1, 'constant', constant_values=1)
+    count = numpy.zeros((height, width), numpy.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            count += padded[dy:dy + height, dx:dx + width]
+    return bytearray((count >= WALL_THRESHOLD).astype(numpy.uint8).tobytes())
+
+
+def _step_bigint(walls, width, height):
+    # One hex digit per cell: shifting the whole grid by a digit moves it one
+    # cell sideways, by a row of digits one cell up or down. A 3x3 count is
+    # at most 9 so the nine shifted grids add up without carrying. Cells
+    # wrapping around the row ends only land on the border, which is walled
+    # up again afterwards.
+    size = width * height
+    grid = int(bytes(walls.translate(_WALL_TO_HEX)), 16)
+    rows = grid + (grid << (4 * width)) + (grid >> (4 * width))
+    count = rows + (rows << 4) + (rows >> 4)
+    digits = '{:0{}x}'.format(count, size)[-size:]
+    return bytearray(digits.encode('ascii').translate(_HEX_TO_WALL))
+
+
+def cave_walls(width, height, seed, wall_chance=45, steps=4):
+    """ Grow a cave and return its walls as a row-major 0/1 plane.
+
+    The map border is always wall. Only the largest connected open area is
+    kept, everything else is filled in, so all of the floor is reachable.
+
+    """
+    walls = noise(width, height, seed, wall_chance)
+    _close_border(walls, width, height)
+    step = _step_numpy if numpy_available else _step_bigint
+    for i in range(steps):
+        walls = step(walls, width, height)
+        _close_border(walls, width, height)
+
+    regions = find_regions(walls.translate(_INVERT), width)
+    if regions:
+        cave = max(regions, key=lambda spans: sum(e - s for s, e in spans))
+        walls = bytearray(b'\x01' * (width * height))
+        for start, end in cave:
+            walls[start:end] = bytearray(end - start)
+    return walls
@@ -0,0 +1,128 @@
+"""
+On-disk cache of generated dungeon levels.
+
+Generating a level is deterministic: the same seed, level number and
+generator settings always give the same tiles, rooms and spawns. The cache
+stores each generated level as a compressed pickle under the hash of those
+inputs, so a level that was built before (by another run, a save being
+loaded or a worker that got there first) is read back instead of generated
+again.
+
+The cache keeps its total size under a limit by dropping the files that
+were used the longest time ago.
+
+"""
+from __future__ import print_function
+
+import hashlib
+import os
+import tempfile
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+SUFFIX = '.level'
+
+
+class LevelCache(object):
+    """ A directory of cached levels, at most `max_size` bytes big.
+
+    Keys are any picklable, repr-stable value, usually a tuple of the seed,
+    level number and generator settings. Errors reading or writing the cache
+    are never fatal, the level is just generated again.
+
+    """
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        """ Return the file the given key is stored in.
+
+        """
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + SUFFIX)
+
+    def get(self, key):
+        """ Return the value stored for key, or None.
+
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        try:
+            # Anything can go wrong loading a stale entry: classes and
+            # functions it refers to may have been renamed or removed, or it
+            # may have been written with a newer pickle protocol.
+            value = pickle.loads(zlib.decompress(data))
+        except Exception:
+            self.remove(path)
+            return None
+        try:
+            os.utime(path, None)  # mark it as recently used
+        except OSError:
+            pass
+        return value
+
+    def remove(self, path):
+        """ Delete an entry's file, if it is still there.
+
+        """
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # another process got to it first
+
+    def put(self, key, value):
+        """ Store value under key, then evict old entries if over the limit.
+
+        """
+        data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        temp = None
+        try:
+            # Write to a temporary file first so readers in other processes
+            # never see a half written level.
+            fd, temp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            path = self.path(key)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp, path)
+        except (IOError, OSError):
+            # evict only counts entries, don't leave the temporary file.
+            if temp is not None:
+                self.remove(temp)
+            return
+        self.evict()
+
+    def evict(self):
+        """ Delete the least recently used entries until the cache fits.
+
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        while total > self.max_size and entries:
+            mtime, size, path = entries.pop(0)
+            self.remove(path)
+            total -= size
@@ -26,8 +26,9 @@
 #
 
 import sys
+import binascii
 import ctypes
-import struct
+from array import array
 from ctypes import *
 
 if not hasattr(ctypes, "c_bool"):   # for Python < 2.6
@@ -398,40 +399,44 @@ class Key(Structure):
 class ConsoleBuffer:
     # simple console that allows direct (fast) access to cells. simplifies
     # use of the "fill" functions.
+    #
+    # each of back_r, back_g, back_b, fore_r, fore_g, fore_b and char is a
+    # plane of C ints, one per cell in row order (x + y * width): a NumPy
+    # array if NumPy is available, an array('i') otherwise. ctypes views of
+    # the planes are made once, so blit hands their memory to libtcod without
+    # copying anything. planes are only ever changed in place.
+    PLANES = ('back_r', 'back_g', 'back_b', 'fore_r', 'fore_g', 'fore_b',
+              'char')
+
     def __init__(self, width, height, back_r=0, back_g=0, back_b=0, fore_r=0, fore_g=0, fore_b=0, char=' '):
         # initialize with given width and height. values to fill the buffer
         # are optional, defaults to black with no characters.
         n = width * height
         self.width = width
         self.height = height
+        self._views = {}
+        for name in self.PLANES:
+            if numpy_available:
+                plane = numpy.zeros(n, numpy.intc)
+            else:
+                plane = array('i', [0]) * n
+            setattr(self, name, plane)
+            self._views[name] = (c_int * n).from_buffer(plane)
         self.clear(back_r, back_g, back_b, fore_r, fore_g, fore_b, char)
 
     def clear(self, back_r=0, back_g=0, back_b=0, fore_r=0, fore_g=0, fore_b=0, char=' '):
         # clears the console. values to fill it with are optional, defaults
         # to black with no characters.
-        n = self.width * self.height
-        self.back_r = [back_r] * n
-        self.back_g = [back_g] * n
-        self.back_b = [back_b] * n
-        self.fore_r = [fore_r] * n
-        self.fore_g = [fore_g] * n
-        self.fore_b = [fore_b] * n
-        self.char = [ord(char)] * n
-    
+        self.fill(0, 0, self.width, self.height, (back_r, back_g, back_b),
+                  (fore_r, fore_g, fore_b), char)
+
     def copy(self):
         # returns a copy of this ConsoleBuffer.
-        other = ConsoleBuffer(0, 0)
-        other.width = self.width
-        other.height = self.height
-        other.back_r = list(self.back_r)  # make explicit copies of all lists
-        other.back_g = list(self.back_g)
-        other.back_b = list(self.back_b)
-        other.fore_r = list(self.fore_r)
-        other.fore_g = list(self.fore_g)
-        other.fore_b = list(self.fore_b)
-        other.char = list(self.char)
+        other = ConsoleBuffer(self.width, self.height)
+        for name in self.PLANES:
+            getattr(other, name)[:] = getattr(self, name)
         return other
-    
+
     def set_fore(self, x, y, r, g, b, char):
         # set the character and foreground color of one cell.
         i = self.width * y + x
@@ -439,14 +444,14 @@ class ConsoleBuffer:
         self.fore_g[i] = g
         self.fore_b[i] = b
         self.char[i] = ord(char)
-    
+
     def set_back(self, x, y, r, g, b):
         # set the background color of one cell.
         i = self.width * y + x
         self.back_r[i] = r
         self.back_g[i] = g
         self.back_b[i] = b
-    
+
     def set(self, x, y, back_r, back_g, back_b, fore_r, fore_g, fore_b, char):
         # set the background color, foreground color and character of one cell.
         i = self.width * y + x
@@ -457,21 +462,104 @@ class ConsoleBuffer:
         self.fore_g[i] = fore_g
         self.fore_b[i] = fore_b
         self.char[i] = ord(char)
-    
+
+    def set_plane(self, name, values):
+        # replace a whole plane, e.g. 'back_r', with one value per cell: a
+        # NumPy array, a byte plane (bytes/bytearray) or a sequence of ints.
+        plane = getattr(self, name)
+        if numpy_available and isinstance(values, numpy.ndarray):
+            count = values.size
+        else:
+            count = len(values)
+        if count != len(plane):
+            raise ValueError('ConsoleBuffer.set_plane: values must have one value per cell.')
+        if numpy_available:
+            if isinstance(values, (bytes, bytearray)):
+                values = numpy.frombuffer(bytes(values), numpy.uint8)
+            plane[:] = numpy.ravel(values)
+        else:
+            if isinstance(values, (bytes, bytearray)):
+                # iterated, array() would take the raw bytes for the values.
+                values = iter(bytearray(values))
+            plane[:] = array('i', values)
+
+    def _rows(self, x, y, w, h):
+        # yield the slice of every row of a w x h rectangle at x, y, clipped
+        # to the buffer.
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        for row in range(y1, y2):
+            yield slice(row * self.width + x1, row * self.width + x2)
+
+    def fill(self, x, y, w, h, back=None, fore=None, char=None):
+        # fill a w x h rectangle at x, y in one go per plane: the background
+        # and foreground with (r, g, b) colors (or Colors), and the character.
+        # whatever is None is left as is.
+        values = []
+        if back is not None:
+            values.extend(zip(('back_r', 'back_g', 'back_b'), back))
+        if fore is not None:
+            values.extend(zip(('fore_r', 'fore_g', 'fore_b'), fore))
+        if char is not None:
+            values.append(('char', ord(char) if isinstance(char, str) else char))
+
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        if x2 <= x1 or y2 <= y1:
+            return
+        for name, value in values:
+            plane = getattr(self, name)
+            if numpy_available:
+                plane.reshape(self.height, self.width)[y1:y2, x1:x2] = value
+            else:
+                run = array('i', [value]) * (x2 - x1)
+                for row in self._rows(x1, y1, x2 - x1, y2 - y1):
+                    plane[row] = run
+
+    def copy_rect(self, src, x, y, w, h, xdst=0, ydst=0):
+        # copy a w x h rectangle at x, y of the ConsoleBuffer src (which can
+        # be this one) to xdst, ydst, all planes, like console_blit does for
+        # consoles. the rectangle is clipped to both buffers.
+        if x < 0:
+            w, xdst, x = w + x, xdst - x, 0
+        if y < 0:
+            h, ydst, y = h + y, ydst - y, 0
+        if xdst < 0:
+            w, x, xdst = w + xdst, x - xdst, 0
+        if ydst < 0:
+            h, y, ydst = h + ydst, y - ydst, 0
+        w = min(w, src.width - x, self.width - xdst)
+        h = min(h, src.height - y, self.height - ydst)
+        if w <= 0 or h <= 0:
+            return
+        for name in self.PLANES:
+            source = getattr(src, name)
+            plane = getattr(self, name)
+            if numpy_available:
+                plane.reshape(self.height, self.width)[ydst:ydst + h, xdst:xdst + w] = \
+                    source.reshape(src.height, src.width)[y:y + h, x:x + w]
+            else:
+                rows = list(zip(src._rows(x, y, w, h), self._rows(xdst, ydst, w, h)))
+                if src is self and ydst > y:
+                    # copying down within one buffer, don't overwrite rows
+                    # before they are copied.
+                    rows.reverse()
+                for source_row, row in rows:
+                    plane[row] = source[source_row]
+
     def blit(self, dest, fill_fore=True, fill_back=True):
         # use libtcod's "fill" functions to write the buffer to a console.
         if (console_get_width(dest) != self.width or
             console_get_height(dest) != self.height):
             raise ValueError('ConsoleBuffer.blit: Destination console has an incorrect size.')
 
-        s = struct.Struct('%di' % len(self.back_r))
-
+        views = self._views
         if fill_back:
-            _lib.TCOD_console_fill_background(dest, (c_int * len(self.back_r))(*self.back_r), (c_int * len(self.back_g))(*self.back_g), (c_int * len(self.back_b))(*self.back_b))
+            _lib.TCOD_console_fill_background(dest, views['back_r'], views['back_g'], views['back_b'])
 
         if fill_fore:
-            _lib.TCOD_console_fill_foreground(dest, (c_int * len(self.fore_r))(*self.fore_r), (c_int * len(self.fore_g))(*self.fore_g), (c_int * len(self.fore_b))(*self.fore_b))
-            _lib.TCOD_console_fill_char(dest, (c_int * len(self.char))(*self.char))
+            _lib.TCOD_console_fill_foreground(dest, views['fore_r'], views['fore_g'], views['fore_b'])
+            _lib.TCOD_console_fill_char(dest, views['char'])
 
 _lib.TCOD_console_credits_render.restype = c_bool
 _lib.TCOD_console_is_fullscreen.restype = c_bool
@@ -907,58 +995,40 @@ def console_delete(con):
     _lib.TCOD_console_delete(con)
 
 # fast color filling
+# converts one color channel for the console_fill_* functions. channels can
+# be NumPy arrays, byte planes (bytes/bytearray, one value per cell) or any
+# sequence of ints. C ints are 32 bits wide, unlike NumPy's default int.
+def _fill_channel(values):
+    if numpy_available:
+        if isinstance(values, (bytes, bytearray)):
+            values = numpy.frombuffer(bytes(values), numpy.uint8)
+        if isinstance(values, numpy.ndarray):
+            values = numpy.array(values, dtype=numpy.intc).ravel()
+            return (c_int * values.size).from_buffer(values)
+    if isinstance(values, (bytes, bytearray)):
+        # iterated, array() would take the raw bytes for the values.
+        values = iter(bytearray(values))
+    values = array('i', values)
+    channel = (c_int * len(values))()
+    memmove(channel, values.buffer_info()[0], len(values) * sizeof(c_int))
+    return channel
+
 def console_fill_foreground(con,r,g,b) :
     if len(r) != len(g) or len(r) != len(b):
         raise TypeError('R, G and B must all have the same size.')
 
-    if (numpy_available and isinstance(r, numpy.ndarray) and
-        isinstance(g, numpy.ndarray) and isinstance(b, numpy.ndarray)):
-        #numpy arrays, use numpy's ctypes functions
-        r = numpy.ascontiguousarray(r, dtype=numpy.int_)
-        g = numpy.ascontiguousarray(g, dtype=numpy.int_)
-        b = numpy.ascontiguousarray(b, dtype=numpy.int_)
-        cr = r.ctypes.data_as(POINTER(c_int))
-        cg = g.ctypes.data_as(POINTER(c_int))
-        cb = b.ctypes.data_as(POINTER(c_int))
-    else:
-        # otherwise convert using ctypes arrays
-        cr = (c_int * len(r))(*r)
-        cg = (c_int * len(g))(*g)
-        cb = (c_int * len(b))(*b)
-
-    _lib.TCOD_console_fill_foreground(con, cr, cg, cb)
+    _lib.TCOD_console_fill_foreground(con, _fill_channel(r), _fill_channel(g),
+                                      _fill_channel(b))
 
 def console_fill_background(con,r,g,b) :
     if len(r) != len(g) or len(r) != len(b):
         raise TypeError('R, G and B must all have the same size.')
 
-    if (numpy_available and isinstance(r, numpy.ndarray) and
-        isinstance(g, numpy.ndarray) and isinstance(b, numpy.ndarray)):
-        #numpy arrays, use numpy's ctypes functions
-        r = numpy.ascontiguousarray(r, dtype=numpy.int_)
-        g = numpy.ascontiguousarray(g, dtype=numpy.int_)
-        b = numpy.ascontiguousarray(b, dtype=numpy.int_)
-        cr = r.ctypes.data_as(POINTER(c_int))
-        cg = g.ctypes.data_as(POINTER(c_int))
-        cb = b.ctypes.data_as(POINTER(c_int))
-    else:
-        # otherwise convert using ctypes arrays
-        cr = (c_int * len(r))(*r)
-        cg = (c_int * len(g))(*g)
-        cb = (c_int * len(b))(*b)
-
-    _lib.TCOD_console_fill_background(con, cr, cg, cb)
+    _lib.TCOD_console_fill_background(con, _fill_channel(r), _fill_channel(g),
+                                      _fill_channel(b))
 
 def console_fill_char(con,arr) :
-    if (numpy_available and isinstance(arr, numpy.ndarray) ):
-        #numpy arrays, use numpy's ctypes functions
-        arr = numpy.ascontiguousarray(arr, dtype=numpy.int_)
-        carr = arr.ctypes.data_as(POINTER(c_int))
-    else:
-        #otherwise convert using the struct module
-        carr = struct.pack('%di' % len(arr), *arr)
-
-    _lib.TCOD_console_fill_char(con, carr)
+    _lib.TCOD_console_fill_char(con, _fill_channel(arr))
         
 def console_load_asc(con, filename) :
     _lib.TCOD_console_load_asc(con,filename)
@@ -1510,6 +1580,19 @@ NB_FOV_ALGORITHMS = 13
 def FOV_PERMISSIVE(p) :
     return FOV_PERMISSIVE_0+p
 
+# internal layout of a TCOD_map_t. each cell is a one byte bitfield holding
+# the transparent, walkable and fov flags, in that bit order.
+class _CMap(Structure):
+    _fields_=[('width', c_int),
+              ('height', c_int),
+              ('nbcells', c_int),
+              ('cells', POINTER(c_uint8)),
+              ]
+
+_MAP_TRANSPARENT_BIT = bytes(bytearray([0] + [1] * 255))
+_MAP_WALKABLE_BIT = bytes(bytearray([0] + [2] * 255))
+_MAP_FOV = bytes(bytearray(1 if i & 4 else 0 for i in range(256)))
+
 def map_new(w, h):
     return _lib.TCOD_map_new(w, h)
 
@@ -1519,6 +1602,56 @@ def map_copy(source, dest):
 def map_set_properties(m, x, y, isTrans, isWalk):
     _lib.TCOD_map_set_properties(m, x, y, c_int(isTrans), c_int(isWalk))
 
+# fast bulk upload of the map properties. transparent and walkable hold one
+# truthy value per cell, in row order (x + y * width). fov flags are reset
+# like map_clear does.
+def map_fill_properties(m, transparent, walkable):
+    if not _cmap_layout_ok():
+        _map_fill_properties_per_cell(m, transparent, walkable)
+        return
+    cmap = cast(c_void_p(m), POINTER(_CMap)).contents
+    n = cmap.nbcells
+
+    if (numpy_available and isinstance(transparent, numpy.ndarray) and
+        isinstance(walkable, numpy.ndarray)):
+        if transparent.size != n or walkable.size != n:
+            raise TypeError('transparent and walkable must have one value per map cell.')
+        cells = ((numpy.ravel(transparent) != 0).astype(numpy.uint8) |
+                 ((numpy.ravel(walkable) != 0).astype(numpy.uint8) << 1))
+        cells = numpy.ascontiguousarray(cells)
+        memmove(cmap.cells, cells.ctypes.data, n)
+    else:
+        if len(transparent) != n or len(walkable) != n:
+            raise TypeError('transparent and walkable must have one value per map cell.')
+        if n == 0:
+            return
+        # translate() turns each plane into its flag bit in one pass, then
+        # both planes are read as big integers, one byte per cell, and
+        # combined with a single OR.
+        transparent = bytearray(transparent).translate(_MAP_TRANSPARENT_BIT)
+        walkable = bytearray(walkable).translate(_MAP_WALKABLE_BIT)
+        cells = (int(binascii.hexlify(transparent), 16) |
+                 int(binascii.hexlify(walkable), 16))
+        cells = bytearray(binascii.unhexlify('%0*x' % (2 * n, cells)))
+        memmove(cmap.cells, (c_uint8 * n).from_buffer(cells), n)
+
+# the same as map_fill_properties, one cell at a time through the library.
+def _map_fill_properties_per_cell(m, transparent, walkable):
+    w = map_get_width(m)
+    n = w * map_get_height(m)
+    if numpy_available:
+        if isinstance(transparent, numpy.ndarray):
+            transparent = numpy.ravel(transparent)
+        if isinstance(walkable, numpy.ndarray):
+            walkable = numpy.ravel(walkable)
+    if len(transparent) != n or len(walkable) != n:
+        raise TypeError('transparent and walkable must have one value per map cell.')
+    map_clear(m)
+    for i in range(n):
+        if transparent[i] or walkable[i]:
+            map_set_properties(m, i % w, i // w, bool(transparent[i]),
+                               bool(walkable[i]))
+
 def map_clear(m,walkable=False,transparent=False):
     _lib.TCOD_map_clear(m,c_int(walkable),c_int(transparent))
 
@@ -1528,6 +1661,68 @@ def map_compute_fov(m, x, y, radius=0, light_walls=True, algo=FOV_RESTRICTIVE ):
 def map_is_in_fov(m, x, y):
     return _lib.TCOD_map_is_in_fov(m, x, y)
 
+# fast bulk readback of the last computed fov, as a bytearray holding 1 for
+# every cell in fov, in row order (x + y * width). with as_numpy, as a
+# (height, width) NumPy boolean array instead.
+def map_get_fov(m, as_numpy=False):
+    if not _cmap_layout_ok():
+        w = map_get_width(m)
+        h = map_get_height(m)
+        fov = bytearray(1 if map_is_in_fov(m, x, y) else 0
+                        for y in range(h) for x in range(w))
+        if as_numpy:
+            return numpy.frombuffer(bytes(fov), numpy.uint8).astype(
+                bool).reshape(h, w)
+        return fov
+    cmap = cast(c_void_p(m), POINTER(_CMap)).contents
+    cells = string_at(cmap.cells, cmap.nbcells)
+    if as_numpy:
+        fov = (numpy.frombuffer(cells, numpy.uint8) & 4) != 0
+        return fov.reshape(cmap.height, cmap.width)
+    return bytearray(cells).translate(_MAP_FOV)
+
+# _CMap and the cell bits above match the bundled libtcod 1.5.1. the first
+# bulk call checks them once against the library on a small map, so that a
+# different libtcod falls back to the per cell calls instead of reading and
+# writing the wrong memory.
+_cmap_layout_checked = []
+
+def _cmap_layout_ok():
+    if not _cmap_layout_checked:
+        _cmap_layout_checked.append(_check_cmap_layout())
+    return _cmap_layout_checked[0]
+
+def _check_cmap_layout():
+    w, h = 5, 1
+    m = map_new(w, h)
+    try:
+        cmap = cast(c_void_p(m), POINTER(_CMap)).contents
+        if (cmap.width, cmap.height, cmap.nbcells) != (
+                map_get_width(m), map_get_height(m), w * h):
+            return False
+        # reading: cells set through the library, with a wall at x=2.
+        transparent = (1, 1, 0, 1, 1)
+        walkable = (1, 0, 0, 1, 0)
+        for x in range(w):
+            map_set_properties(m, x, 0, transparent[x], walkable[x])
+        map_compute_fov(m, 0, 0, 0, True, FOV_BASIC)
+        cells = bytearray(string_at(cmap.cells, w * h))
+        for x in range(w):
+            expected = (transparent[x] | walkable[x] << 1 |
+                        (4 if map_is_in_fov(m, x, 0) else 0))
+            if cells[x] != expected:
+                return False
+        # writing: cells stored directly, read through the library.
+        cells = bytearray([2, 1, 3, 0, 1])
+        memmove(cmap.cells, (c_uint8 * (w * h)).from_buffer(cells), w * h)
+        for x in range(w):
+            if (bool(map_is_transparent(m, x, 0)) != bool(cells[x] & 1) or
+                    bool(map_is_walkable(m, x, 0)) != bool(cells[x] & 2)):
+                return False
+        return True
+    finally:
+        map_delete(m)
+
 def map_is_transparent(m, x, y):
     return _lib.TCOD_map_is_transparent(m, x, y)
 
@@ -1779,6 +1974,33 @@ def bsp_traverse_inverted_level_order(node, callback, userData=0):
     _bsp_traverse(node, callback, userData,
                   _lib.TCOD_bsp_traverse_inverted_level_order)
 
+# pull the whole tree out in a single walk over the C nodes, without a python
+# callback or a Bsp wrapper per node. Nodes come out in pre-order as parallel
+# int arrays (x, y, w, h, level, leaf, father), father being the index of the
+# parent node (-1 for the root).
+def bsp_flatten(node):
+    columns = tuple(array('i') for i in range(7))
+    x, y, w, h, level, leaf, father = columns
+    stack = [(cast(node.p, c_void_p).value, -1)]
+    while stack:
+        addr, parent = stack.pop()
+        cnode = _CBsp.from_address(addr)
+        index = len(x)
+        x.append(cnode.x)
+        y.append(cnode.y)
+        w.append(cnode.w)
+        h.append(cnode.h)
+        level.append(cnode.level)
+        leaf.append(0 if cnode.son else 1)
+        father.append(parent)
+        sons = []
+        son = cnode.son
+        while son:
+            sons.append(son)
+            son = _CBsp.from_address(son).next
+        stack.extend((son, index) for son in reversed(sons))
+    return columns
+
 def bsp_remove_sons(node):
     _lib.TCOD_bsp_remove_sons(node.p)
 
@@ -5,10 +5,26 @@ PyRogueCOD - A python roguelike experiment using libtcod.
 from __future__ import print_function
 
 import math
+import multiprocessing
+import multiprocessing.pool
 import textwrap
 import shelve
+import time
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 import libtcodpy as libtcod
+from analysis import analyze
+from caves import cave_walls
+from levelcache import LevelCache
+from prefabs import load_library
+import tilemap
+from tilemap import TileMap, ChunkedTileMap, RoomIndex, add_planes,\
+    changed_cells
 
 
 # Global constants
@@ -16,9 +32,17 @@ SCREEN_WIDTH = 80
 SCREEN_HEIGHT = 50
 
 LIMIT_FPS = 20
-
+# Sleep between checks for input instead of going round the game loop
+# LIMIT_FPS times a second, and only render when a key press or mouse event
+# arrived. Nothing happens between two inputs in a turn-based game, so an
+# idle game uses next to no CPU. IDLE_SLEEP is the pause in seconds.
+IDLE_WAIT = True
+IDLE_SLEEP = 0.01
+
+# Maps larger than the camera are stored in lazily created chunks.
 MAP_WIDTH = 80
 MAP_HEIGHT = 43
+MAP_CHUNK_SIZE = 64
 LEVEL_SCREEN_WIDTH = 40
 CHARACTER_SCREEN_WIDTH = 30
 
@@ -26,6 +50,20 @@ ROOM_MAX_SIZE = 10
 ROOM_MIN_SIZE = 6
 MAX_ROOMS = 30
 
+# 'rooms' scatters rooms at random, 'bsp' splits the map up with a BSP tree
+# and 'caves' grows caverns with a cellular automaton.
+MAP_GENERATOR = 'rooms'
+BSP_DEPTH = 16
+BSP_MIN_SIZE = ROOM_MIN_SIZE + 1
+CAVE_WALL_CHANCE = 45
+CAVE_STEPS = 4
+CAVE_SECTOR_SIZE = 16
+
+# Hand-made room prefabs, see prefabs.txt. Every room of the 'rooms' and
+# 'bsp' generators has a PREFAB_CHANCE percent chance of being one.
+PREFAB_FILE = 'prefabs.txt'
+PREFAB_CHANCE = 10
+
 FOV_ALGO = 4  # Default FOV algorithm
 FOV_LIGHT_WALLS = True
 TORCH_RADIUS = 10
@@ -38,6 +76,10 @@ MSG_X = BAR_WIDTH + 2
 MSG_WIDTH = SCREEN_WIDTH - BAR_WIDTH - 2
 MSG_HEIGHT = PANEL_HEIGHT - 1
 
+# The part of the map shown on the screen, above the panel.
+CAMERA_WIDTH = SCREEN_WIDTH
+CAMERA_HEIGHT = SCREEN_HEIGHT - PANEL_HEIGHT
+
 LEVEL_UP_BASE = 200
 LEVEL_UP_FACTOR = 150
 
@@ -50,22 +92,135 @@ CONFUSE_RANGE = 10
 FIREBALL_RADIUS = 3
 FIREBALL_DAMAGE = 25
 
+# Build the next dungeon level in a worker process while the current one is
+# played, so taking the stairs doesn't stall the game.
+PREGENERATE_LEVELS = True
+
+# Every level is generated this many times from different seeds, in
+# parallel when the level workers run, and the best scoring one is kept.
+# Candidates that fail validate_level are never kept, more are generated if
+# none is valid, up to MAX_LEVEL_CANDIDATES.
+LEVEL_CANDIDATES = 4
+MAX_LEVEL_CANDIDATES = 32
+# None starts one level worker per CPU. With 0 workers the next level is
+# built on the main thread instead, a slice of about LEVEL_SLICE_BUDGET
+# seconds per frame.
+LEVEL_WORKERS = None
+LEVEL_SLICE_BUDGET = 0.005
+ROOMS_PER_STAGE = 50  # long room stages yield every so many rooms
+
+# Generated levels are cached on disk, keyed by everything that goes into
+# generating them. Set the directory to None to turn the cache off, and bump
+# the version whenever a change to the generators gives different levels.
+LEVEL_CACHE_DIR = 'levelcache'
+LEVEL_CACHE_SIZE = 64 * 1024 * 1024
+LEVEL_CACHE_VERSION = 11
+
+# Levels are generated from a per-game seed. Set this to replay the same
+# dungeon every game, or leave it as None for a random one.
+GAME_SEED = None
+
 color_dark_wall = libtcod.Color(0, 0, 100)
 color_light_wall = libtcod.Color(130, 110, 50)
 color_dark_ground = libtcod.Color(50, 50, 150)
 color_light_ground = libtcod.Color(200, 180, 50)
-
-
-class Tile(object):
-    """ A tile on the map and its properties
+color_dark_door = libtcod.Color(50, 30, 60)
+color_light_door = libtcod.Color(150, 90, 30)
+color_dark_water = libtcod.Color(10, 30, 120)
+color_light_water = libtcod.Color(40, 110, 200)
+color_dark_rubble = libtcod.Color(40, 40, 110)
+color_light_rubble = libtcod.Color(160, 140, 60)
+
+# Background colors by tile type (see tilemap.TILE_TYPES) of explored tiles
+# out of sight, and of tiles in sight.
+tile_colors_dark = [None] * len(tilemap.TILE_TYPES)
+tile_colors_lit = [None] * len(tilemap.TILE_TYPES)
+for tile, dark, lit in (
+        (tilemap.FLOOR, color_dark_ground, color_light_ground),
+        (tilemap.WALL, color_dark_wall, color_light_wall),
+        (tilemap.DOOR, color_dark_door, color_light_door),
+        (tilemap.WATER, color_dark_water, color_light_water),
+        (tilemap.RUBBLE, color_dark_rubble, color_light_rubble)):
+    tile_colors_dark[tile] = dark
+    tile_colors_lit[tile] = lit
+
+
+def background_tables():
+    """ Return translate() tables from tile keys to background colors.
+
+    A tile's key is its type, plus 8 once it is explored and 16 while it is
+    in sight, so render_all can look the whole view up at once. Returns the
+    tables of the red, green and blue channels. Unexplored tiles out of
+    sight stay black.
 
     """
-    def __init__(self, blocked, block_sight=None):
-        self.explored = False
-        self.blocked = blocked
-
-        # By default, if a tile is blocked, it also blocks sight.
-        self.block_sight = blocked if block_sight is None else block_sight
+    tables = [bytearray(256), bytearray(256), bytearray(256)]
+    for tile in range(len(tilemap.TILE_TYPES)):
+        for key, color in ((tile + 8, tile_colors_dark[tile]),
+                           (tile + 16, tile_colors_lit[tile]),
+                           (tile + 24, tile_colors_lit[tile])):
+            tables[0][key] = color.r
+            tables[1][key] = color.g
+            tables[2][key] = color.b
+    return [bytes(table) for table in tables]
+
+
+background_red, background_green, background_blue = background_tables()
+background_colors = [libtcod.Color(r, g, b) for r, g, b in zip(
+    bytearray(background_red), bytearray(background_green),
+    bytearray(background_blue))]
+# The key part of the explored and in sight planes, and which keys stand for
+# explored tiles and for tiles seen for the first time.
+_EXPLORED_KEY = bytes(bytearray([0, 8] + [0] * 254))
+_VISIBLE_KEY = bytes(bytearray([0, 16] + [0] * 254))
+_KEY_EXPLORED = bytes(bytearray(1 if key & 24 else 0 for key in range(256)))
+_KEY_FIRST_SEEN = bytes(bytearray(1 if key & 24 == 16 else 0
+                                  for key in range(256)))
+
+# The level workers and the level they are building, see
+# pregenerate_next_level.
+level_pool = None
+pending_level = None
+level_candidate = 0
+level_cache = None
+
+# The spawn seeds of the current level's rooms and which have been used.
+# Prefab rooms spawn their own monsters and items instead, by room id.
+spawn_seeds = []
+populated_rooms = bytearray()
+prefab_spawns = {}
+
+# The cells, as (x, y), that render_all found explored for the first time
+# and the turn logic hasn't looked at yet, see populate_seen_rooms.
+newly_explored = []
+
+# The player's changes to the current level's terrain, tile type by map
+# index. Saving collects them from the map's journal.
+terrain_changes = {}
+
+# The compiled room prefabs, see prefab_library.
+room_prefabs = None
+
+# The current level's analysis layers (see analysis.analyze).
+analysis = None
+
+# The cells of the camera's view in the player's sight: a snapshot of the FOV
+# map, 1 per visible cell, taken whenever the FOV is recomputed.
+visible = bytearray()
+
+# What is on the screen, so render_all only repaints what changed: the tile
+# keys of the camera's view (see background_tables), the objects drawn, as
+# (char, color) by console cell, and the state of each HUD region. Set
+# `redraw` to have everything repainted, e.g. after a menu covered the map.
+shown_keys = bytearray()
+shown_glyphs = {}
+shown_hud = {}
+redraw = True
+
+# The off-screen console's cells as a libtcod.ConsoleBuffer, see
+# frame_buffer. The map background is built in its back planes and the
+# objects in its foreground and character planes, each blitted in one go.
+frame = None
 
 
 class Object(object):
@@ -161,27 +316,6 @@ class Object(object):
         objects.remove(self)
         objects.insert(0, self)
 
-    def draw(self):
-        """ Set the color then draw the character that represents this object
-            at its position only when its within the FOV.
-
-        """
-        global con, map
-
-        if ((in_fov(self.x, self.y)) or (self.always_visible and
-                                         map[self.x][self.y].explored)):
-            libtcod.console_set_default_foreground(con, self.color)
-            libtcod.console_put_char(con, self.x, self.y, self.char,
-                                     libtcod.BKGND_NONE)
-
-    def clear(self):
-        """ Erase the character that represents this object.
-
-        """
-        global con
-
-        libtcod.console_put_char(con, self.x, self.y, ' ', libtcod.BKGND_NONE)
-
 
 class Fighter(object):
     """ Combat-type Object component.
@@ -417,6 +551,12 @@ class Rect(object):
         center_y = (self.y1 + self.y2) / 2
         return (center_x, center_y)
 
+    def inner(self):
+        """ Return the inclusive (x1, y1, x2, y2) floor area inside the walls.
+
+        """
+        return (self.x1 + 1, self.y1 + 1, self.x2 - 1, self.y2 - 1)
+
     def intersect(self, other):
         """ Return True if this object intersects with the `other` room.
 
@@ -425,50 +565,131 @@ class Rect(object):
                 self.y1 <= other.y2 and self.y2 >= other.y1)
 
 
-def create_room(room):
-    """ Go through the tiles in the rectangle and make them passable.
+class Camera(object):
+    """ The window of the map that is shown on the screen.
+
+    Maps larger than the screen scroll by moving the camera so it stays
+    centered on the player, without ever showing past the map edges.
 
     """
-    global map
+    def __init__(self, width, height):
+        self.x = 0
+        self.y = 0
+        self.width = width
+        self.height = height
 
-    for x in range(room.x1 + 1, room.x2):
-        for y in range(room.y1 + 1, room.y2):
-            map[x][y].blocked = False
-            map[x][y].block_sight = False
+    def follow(self, x, y, map_width, map_height):
+        """ Center the camera on the given coordinates.
 
+        Returns True if the camera moved.
 
-def create_h_tunnel(x1, x2, y):
-    """ Carve a horizontal tunnel.
+        """
+        new_x = max(0, min(x - self.width // 2, map_width - self.width))
+        new_y = max(0, min(y - self.height // 2, map_height - self.height))
+        moved = (new_x, new_y) != (self.x, self.y)
+        self.x, self.y = new_x, new_y
+        return moved
 
-    """
-    global map
+    def contains(self, x, y):
+        """ Return True if the map coordinates are within the camera's view.
+
+        """
+        return (self.x <= x < self.x + self.width and
+                self.y <= y < self.y + self.height)
 
-    # Using the min and max creatively here, otherwise we'll have to determine
-    # which one is larger or smaller to place on the appropriate range args.
-    for x in range(min(x1, x2), max(x1, x2) + 1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+    def to_screen(self, x, y):
+        """ Convert map coordinates to console coordinates.
 
+        """
+        return (x - self.x, y - self.y)
 
-def create_v_tunnel(y1, y2, x):
-    """ Carve a vertical tunnel.
+    def to_map(self, x, y):
+        """ Convert console coordinates (e.g. the mouse's) to map coordinates.
+
+        """
+        return (x + self.x, y + self.y)
+
+
+class Level(object):
+    """ A generated dungeon level.
+
+    Holds everything make_map produces apart from the player, so a level can
+    be pickled, built in another process and handed over when the player
+    takes the stairs.
 
     """
-    global map
+    def __init__(self, map, rooms, room_index, objects, stairs, start,
+                 corridor_length=0, spawn_seeds=(), prefab_spawns=None):
+        self.map = map
+        self.rooms = rooms
+        self.room_index = room_index
+        self.objects = objects
+        self.stairs = stairs
+        self.start = start
+        self.corridor_length = corridor_length
+        self.candidate = 0
+
+        # Per-tile room/corridor ids, distances to walls and chokepoints, see
+        # analysis.analyze, and what validate_level found wrong with the
+        # level.
+        self.analysis = None
+        self.problems = []
+
+        # Rooms are populated when the player first sees them, each from its
+        # own seed. `populated` flags the rooms that have been.
+        self.spawn_seeds = list(spawn_seeds)
+        self.populated = bytearray(len(self.spawn_seeds))
+
+        # The (x, y, kind, name) spawns of prefab rooms, by room id.
+        self.prefab_spawns = prefab_spawns or {}
+
+
+class LevelBuilder(object):
+    """ Runs the stages of a level generator a time slice at a time.
+
+    `stages` is a generator such as level_stages: it yields the name of
+    every stage it finishes and the Level last.
 
-    # Using the min and max creatively here, otherwise we'll have to determine
-    # which one is larger or smaller to place on the appropriate range args.
-    for y in range(min(y1, y2), max(y1, y2) + 1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+    """
+    def __init__(self, stages):
+        self.stages = stages
+        self.stage = None
+        self.level = None
 
+    def step(self, budget):
+        """ Run stages until about `budget` seconds are used up.
 
-def random_choice_index(chances):
+        At least one stage runs per call. Returns True once the level is
+        done.
+
+        """
+        deadline = time.time() + budget
+        while self.level is None:
+            result = next(self.stages)
+            if isinstance(result, Level):
+                self.level = result
+            else:
+                self.stage = result
+            if time.time() >= deadline:
+                break
+        return self.level is not None
+
+    def finish(self):
+        """ Run all remaining stages and return the Level.
+
+        """
+        for result in self.stages:
+            if isinstance(result, Level):
+                self.level = result
+        return self.level
+
+
+def random_choice_index(chances, rng=0):
     """ Determine where in the list the random choice lands and return the
         corresponding index.
 
     """
-    dice = libtcod.random_get_int(0, 1, sum(chances))
+    dice = libtcod.random_get_int(rng, 1, sum(chances))
 
     running_sum = 0
     choice = 0
@@ -478,29 +699,34 @@ def random_choice_index(chances):
             return idx
 
 
-def random_choice(chances_dict):
+def random_choice(chances_dict, rng=0):
     """ Pick a random item in the dictionary and return the key.
 
     """
-    chances = chances_dict.values()
-    keys = chances_dict.keys()
-    return keys[random_choice_index(chances)]
+    chances = list(chances_dict.values())
+    keys = list(chances_dict.keys())
+    return keys[random_choice_index(chances, rng)]
 
 
-def from_dungeon_level(table):
+def from_dungeon_level(table, current_level=None):
     """ Return a value depending on the dungeon level.
 
     The table specifies what value occurs after each level, default is 0.
     The table is a list of tuples where: (value, dungeon_level)
 
+    The current dungeon level is used unless another one is given.
+
     """
     global dungeon_level
 
+    if current_level is None:
+        current_level = dungeon_level
+
     def key(val):
         return val[-1]
 
     for value, level in sorted(table, key=key):
-        if dungeon_level >= level:
+        if current_level >= level:
             return value
 
     return 0
@@ -533,18 +759,21 @@ def get_all_equipped(obj):
     return equipped_list
 
 
-def place_objects(room):
+def place_objects(room, tiles, objects, rng=0, level=None, reserved=()):
     """ Place objects in a room.
 
+    New objects are added to the `objects` list of the level being built on
+    `tiles`, using the given RNG and dungeon level. Coordinates in `reserved`
+    (such as the player's starting spot) are kept free.
+
     """
-    global objects
 
     # max monsters per room
     max_monsters = from_dungeon_level([
         (2, 1),
         (3, 4),
         (5, 6),
-    ])
+    ], level)
 
     # chance of each monster
     monster_chances = {
@@ -553,37 +782,37 @@ def place_objects(room):
             (15, 3),
             (30, 5),
             (60, 7),
-        ]),
+        ], level),
     }
 
     # max items per room
     max_items = from_dungeon_level([
         (1, 1),
         (2, 4),
-    ])
+    ], level)
 
     # chance of each item
     item_chances = {
         'healing': 35,
         'sword': from_dungeon_level([
             (5, 4),
-        ]),
+        ], level),
         'shield': from_dungeon_level([
             (15, 8),
-        ]),
+        ], level),
         'lightning': from_dungeon_level([
             (25, 4),
-        ]),
+        ], level),
         'fireball': from_dungeon_level([
             (25, 6),
-        ]),
+        ], level),
         'fireball': from_dungeon_level([
             (25, 2),
-        ]),
+        ], level),
     }
 
-    num_monsters = libtcod.random_get_int(0, 0, max_monsters)
-    num_items = libtcod.random_get_int(0, 0, max_items)
+    num_monsters = libtcod.random_get_int(rng, 0, max_monsters)
+    num_items = libtcod.random_get_int(rng, 0, max_items)
 
     # Place the monsters.
     for i in range(num_monsters):
@@ -591,86 +820,106 @@ def place_objects(room):
         # monsters or groups of monsters. We'll settle with this for now.
 
         # Choose a random a place for this monster in the room.
-        x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
-
-        if not is_blocked(x, y):
-            monster = None
-            choice = random_choice(monster_chances)
-            if choice == 'orc':
-                fighter_component = Fighter(hp=20, defense=0, power=4, xp=35,
-                                            death_function=monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'o', 'orc', libtcod.desaturated_green,
-                                 blocks=True, fighter=fighter_component,
-                                 ai=ai_component)
-            elif choice == 'troll':
-                fighter_component = Fighter(hp=30, defense=2, power=8, xp=100,
-                                            death_function=monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'T', 'troll', libtcod.darker_green,
-                                 blocks=True, fighter=fighter_component,
-                                 ai=ai_component)
+        x = libtcod.random_get_int(rng, room.x1 + 1, room.x2 - 1)
+        y = libtcod.random_get_int(rng, room.y1 + 1, room.y2 - 1)
 
+        if not blocked_at(tiles, objects, x, y) and (x, y) not in reserved:
+            monster = create_monster(random_choice(monster_chances, rng),
+                                     x, y)
             if monster:
                 objects.append(monster)
 
     # Place the items
     for i in range(num_items):
         # Choose a random a place for this item in the room.
-        x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
-
-        if not is_blocked(x, y):
-            item = None
-            choice = random_choice(item_chances)
-            if choice == 'healing':
-                name = 'healing potion'
-                item_component = Item(use_function=cast_heal)
-                item = Object(x, y, '!', name, libtcod.violet,
-                              always_visible=True, item=item_component)
-            elif choice == 'sword':
-                name = 'sword'
-                equipment_component = Equipment(slot='right hand',
-                                                power_bonus=3)
-                item = Object(x, y, '/', name, libtcod.sky,
-                              always_visible=True,
-                              equipment=equipment_component)
-            elif choice == 'shield':
-                name = 'shield'
-                equipment_component = Equipment(slot='left hand',
-                                                defense_bonus=1)
-                item = Object(x, y, '[', name, libtcod.darker_orange,
-                              always_visible=True,
-                              equipment=equipment_component)
-            elif choice == 'lightning':
-                name = 'scroll of lightning bolt'
-                item_component = Item(use_function=cast_lightning)
-                item = Object(x, y, '#', name, libtcod.light_yellow,
-                              always_visible=True, item=item_component)
-            elif choice == 'fireball':
-                name = 'scroll of fireball'
-                item_component = Item(use_function=cast_fireball)
-                item = Object(x, y, '#', name, libtcod.light_yellow,
-                              always_visible=True, item=item_component)
-            elif choice == 'confusion':
-                name = 'scroll of confusion'
-                item_component = Item(use_function=cast_confuse)
-                item = Object(x, y, '#', name, libtcod.light_yellow,
-                              always_visible=True, item=item_component)
+        x = libtcod.random_get_int(rng, room.x1 + 1, room.x2 - 1)
+        y = libtcod.random_get_int(rng, room.y1 + 1, room.y2 - 1)
 
+        if not blocked_at(tiles, objects, x, y) and (x, y) not in reserved:
+            item = create_item(random_choice(item_chances, rng), x, y)
             if item:
-                objects.append(item)
-                item.send_to_back()
+                # Items go first so they are drawn below everything else.
+                objects.insert(0, item)
+
+
+def create_monster(choice, x, y):
+    """ Create a monster of the given kind ('orc', 'troll') at (x, y).
+
+    """
+    monster = None
+    if choice == 'orc':
+        fighter_component = Fighter(hp=20, defense=0, power=4, xp=35,
+                                    death_function=monster_death)
+        ai_component = BasicMonster()
+        monster = Object(x, y, 'o', 'orc', libtcod.desaturated_green,
+                         blocks=True, fighter=fighter_component,
+                         ai=ai_component)
+    elif choice == 'troll':
+        fighter_component = Fighter(hp=30, defense=2, power=8, xp=100,
+                                    death_function=monster_death)
+        ai_component = BasicMonster()
+        monster = Object(x, y, 'T', 'troll', libtcod.darker_green,
+                         blocks=True, fighter=fighter_component,
+                         ai=ai_component)
+    return monster
+
+
+def create_item(choice, x, y):
+    """ Create an item of the given kind ('healing', 'sword', ...) at (x, y).
+
+    """
+    item = None
+    if choice == 'healing':
+        name = 'healing potion'
+        item_component = Item(use_function=cast_heal)
+        item = Object(x, y, '!', name, libtcod.violet,
+                      always_visible=True, item=item_component)
+    elif choice == 'sword':
+        name = 'sword'
+        equipment_component = Equipment(slot='right hand',
+                                        power_bonus=3)
+        item = Object(x, y, '/', name, libtcod.sky,
+                      always_visible=True,
+                      equipment=equipment_component)
+    elif choice == 'shield':
+        name = 'shield'
+        equipment_component = Equipment(slot='left hand',
+                                        defense_bonus=1)
+        item = Object(x, y, '[', name, libtcod.darker_orange,
+                      always_visible=True,
+                      equipment=equipment_component)
+    elif choice == 'lightning':
+        name = 'scroll of lightning bolt'
+        item_component = Item(use_function=cast_lightning)
+        item = Object(x, y, '#', name, libtcod.light_yellow,
+                      always_visible=True, item=item_component)
+    elif choice == 'fireball':
+        name = 'scroll of fireball'
+        item_component = Item(use_function=cast_fireball)
+        item = Object(x, y, '#', name, libtcod.light_yellow,
+                      always_visible=True, item=item_component)
+    elif choice == 'confusion':
+        name = 'scroll of confusion'
+        item_component = Item(use_function=cast_confuse)
+        item = Object(x, y, '#', name, libtcod.light_yellow,
+                      always_visible=True, item=item_component)
+    return item
 
 
 def is_blocked(x, y):
     """ Check whether a location on the map has a tile or a blocking object.
 
     """
-    global map
+    global map, objects
+
+    return blocked_at(map, objects, x, y)
+
 
-    if map[x][y].blocked:
+def blocked_at(tiles, objects, x, y):
+    """ Check a location against the given map and objects.
+
+    """
+    if tiles.is_blocked(x, y):
         return True
 
     for obj in objects:
@@ -680,13 +929,30 @@ def is_blocked(x, y):
     return False
 
 
+def room_at(x, y):
+    """ Return the room whose bounds contain the given coordinates, or None.
+
+    """
+    global rooms, room_index
+
+    room_id = room_index.room_at(x, y)
+    return None if room_id is None else rooms[room_id]
+
+
 def in_fov(x, y):
     """ Check if given coordinates is within the fov.
 
+    The FOV map only covers what the camera sees, anything outside of it is
+    out of sight. Answered from the `visible` snapshot of the FOV map.
+
     """
-    global player
-    global fov_map
-    return True if libtcod.map_is_in_fov(fov_map, x, y) else False
+    global camera
+    global visible
+
+    if not camera.contains(x, y):
+        return False
+    x, y = camera.to_screen(x, y)
+    return visible[y * camera.width + x] == 1
 
 
 def check_level_up():
@@ -751,7 +1017,7 @@ def target_tile(max_range=None):
     NOTE: Challenge yourself by creating a keyboard targeting interface.
 
     """
-    global key, mouse, player
+    global key, mouse, player, camera
     while True:
         # Render the screen, erase the inventory, show object names under the
         # mouse.
@@ -760,7 +1026,7 @@ def target_tile(max_range=None):
                                     libtcod.EVENT_MOUSE, key, mouse)
         render_all()
 
-        x, y = (mouse.cx, mouse.cy)
+        x, y = camera.to_map(mouse.cx, mouse.cy)
 
         if (
             mouse.lbutton_pressed and in_fov(x, y) and max_range is None or
@@ -919,6 +1185,7 @@ def menu(header, options, width):
     """
     global con
     global key
+    global redraw
 
     if len(options) > 26:
         # Make sure we don't get carried away with the menu.
@@ -958,8 +1225,10 @@ def menu(header, options, width):
     # Present the mains screen to the player and wait for a key-press
     libtcod.console_flush()
 
-    # Watch out for key presses and return the options index.
+    # Watch out for key presses and return the options index. The menu
+    # covered part of the screen, so it all has to be repainted.
     key = libtcod.console_wait_for_keypress(True)
+    redraw = True
 
     if key.vk == libtcod.KEY_ENTER and key.lalt:
         libtcod.console_set_fullscreen(not libtcod.console_is_fullscreen())
@@ -1075,9 +1344,9 @@ def get_names_under_mouse():
         FOV.
 
     """
-    global mouse
+    global mouse, camera
 
-    x, y = (mouse.cx, mouse.cy)
+    x, y = camera.to_map(mouse.cx, mouse.cy)
     names = [o.name for o in objects
              if o.x == x and o.y == y and in_fov(o.x, o.y)]
     names = ', '.join(names)
@@ -1101,59 +1370,190 @@ def message(new_msg, color=libtcod.white):
 def render_all():
     """ Draw the game objects and the map.
 
+    Only what changed since the last call is repainted and blitted: the
+    tiles whose color changed, the cells objects left or moved to, and the
+    HUD regions showing something new. Tiles coming into sight are marked
+    explored, those seen for the first time are added to `newly_explored`.
+
     """
     global con, map, fov_recompute, fov_map, objects, player, panel,\
-        dungeon_level
+        dungeon_level, camera, visible, shown_keys, shown_glyphs, redraw,\
+        newly_explored
+
+    # Scroll the camera along with the player. The FOV map covers what the
+    # camera sees, so it has to be reloaded, and the old tiles wiped.
+    if camera.follow(player.x, player.y, map.width, map.height):
+        refresh_fov_map()
+        fov_recompute = True
+        redraw = True
+
+    # Terrain that changed since the last frame also changes what's visible.
+    if update_fov_map():
+        fov_recompute = True
 
     # Recompute the FOV and reset the flag when the player moves.
+    recomputed = fov_recompute
     if fov_recompute:
         fov_recompute = False
-        libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS,
+        player_x, player_y = camera.to_screen(player.x, player.y)
+        libtcod.map_compute_fov(fov_map, player_x, player_y, TORCH_RADIUS,
                                 FOV_LIGHT_WALLS, FOV_ALGO)
+        visible = libtcod.map_get_fov(fov_map)
+
+    if redraw:
+        redraw = False
+        recomputed = True
+        libtcod.console_clear(con)
+        layer = frame_buffer()
+        layer.fill(0, 0, layer.width, layer.height, fore=libtcod.white,
+                   char=' ')
+        shown_keys = bytearray()
+        shown_glyphs = {}
+        shown_hud.clear()
+
+    # The cells of the off-screen console that changed, to be blitted.
+    dirty = []
+
+    # Tiles only change color along with the FOV. Every tile's key (see
+    # background_tables) is looked up in the color tables, dark or lit
+    # depending on the visibility of the tile. We also hide it until the
+    # player has explored it.
+    if recomputed:
+        view = map.window(camera.x, camera.y, camera.width, camera.height)
+        keys = add_planes(view.terrain,
+                          view.explored.translate(_EXPLORED_KEY),
+                          visible.translate(_VISIBLE_KEY))
+
+        # Paint just the tiles that changed, unless so many did that one
+        # fill of the whole console is cheaper.
+        changed = None
+        if len(shown_keys) == len(keys):
+            changed = changed_cells(shown_keys, keys, view.width)
+        if changed is None or len(changed) > len(keys) // 8:
+            fill_background(keys, view.width, view.height)
+            dirty.extend([(0, 0), (view.width - 1, view.height - 1)])
+        else:
+            for i in changed:
+                x, y = i % view.width, i // view.width
+                libtcod.console_set_char_background(
+                    con, x, y, background_colors[keys[i]], libtcod.BKGND_SET)
+                dirty.append((x, y))
+        shown_keys = keys
+
+        # Tell the turn logic which cells were seen for the first time.
+        first_seen = keys.translate(_KEY_FIRST_SEEN)
+        i = first_seen.find(b'\x01')
+        while i >= 0:
+            newly_explored.append(camera.to_map(i % view.width,
+                                                i // view.width))
+            i = first_seen.find(b'\x01', i + 1)
+        view.explored[:] = keys.translate(_KEY_EXPLORED)
+        map.paste(camera.x, camera.y, view, planes=('explored',))
+
+    # Work out what each cell shows of the game objects, drawing the player
+    # last. The cells that differ from before are erased or drawn in the
+    # foreground and character planes of the frame buffer, which then go to
+    # the console in one fill, however many objects there are.
+    glyphs = object_glyphs([obj for obj in objects if obj is not player] +
+                           [player])
+    layer = frame_buffer()
+    drawn = len(dirty)
+    for (x, y) in shown_glyphs:
+        if (x, y) not in glyphs:
+            layer.set_fore(x, y, 255, 255, 255, ' ')
+            dirty.append((x, y))
+    for (x, y), (char, color) in glyphs.items():
+        if shown_glyphs.get((x, y)) != (char, color):
+            layer.set_fore(x, y, color.r, color.g, color.b, char)
+            dirty.append((x, y))
+    if len(dirty) > drawn:
+        layer.blit(con, fill_back=False)
+    shown_glyphs = glyphs
+
+    # Blit the part of the off-screen console that changed to the main
+    # screen.
+    if dirty:
+        x1 = min(x for x, y in dirty)
+        y1 = min(y for x, y in dirty)
+        x2 = max(x for x, y in dirty)
+        y2 = max(y for x, y in dirty)
+        libtcod.console_blit(con, x1, y1, x2 - x1 + 1, y2 - y1 + 1, 0, x1, y1)
+
+    # The GUI panel: the stats, the game messages and the names of the
+    # objects under the mouse.
+    render_hud_region('stats', (player.fighter.hp, player.fighter.max_hp,
+                                dungeon_level),
+                      0, 1, MSG_X, PANEL_HEIGHT - 1, render_stats)
+    render_hud_region('messages', tuple(game_msgs),
+                      MSG_X, 1, SCREEN_WIDTH - MSG_X, PANEL_HEIGHT - 1,
+                      render_messages)
+    names = get_names_under_mouse()
+    render_hud_region('names', names, 0, 0, SCREEN_WIDTH, 1,
+                      lambda: render_names(names))
+
+
+def object_glyphs(drawn):
+    """ Return what the objects show on the off-screen console.
+
+    A dict of (char, color) by console cell, of the objects within the
+    camera's view and in sight, or explored for those always visible. Where
+    objects share a cell the later one in `drawn` shows.
 
-    # Go through all the tiles and set their color
-    for y in range(MAP_HEIGHT):
-        for x in range(MAP_WIDTH):
-            visible = in_fov(x, y)
-            wall = map[x][y].block_sight
-
-            # Use the global dark or light colors depending on the visibility
-            # of the tile. We also hide it until the player has explored it.
-            if not visible:
-                if map[x][y].explored:
-                    if wall:
-                        libtcod.console_set_char_background(con, x, y,
-                                                            color_dark_wall,
-                                                            libtcod.BKGND_SET)
-                    else:
-                        libtcod.console_set_char_background(con, x, y,
-                                                            color_dark_ground,
-                                                            libtcod.BKGND_SET)
-            else:
-                if wall:
-                    libtcod.console_set_char_background(con, x, y,
-                                                        color_light_wall,
-                                                        libtcod.BKGND_SET)
-                else:
-                    libtcod.console_set_char_background(con, x, y,
-                                                        color_light_ground,
-                                                        libtcod.BKGND_SET)
-                map[x][y].explored = True
+    """
+    global map, camera, visible
 
-    # Place the game objects on the off-screen and draw the player last.
-    for obj in objects:
-        if obj != player:
-            obj.draw()
-    player.draw()
+    left, top = camera.x, camera.y
+    width, height = camera.width, camera.height
+    glyphs = {}
+    for obj in drawn:
+        x, y = obj.x - left, obj.y - top
+        if not (0 <= x < width and 0 <= y < height):
+            continue
+        if (visible[y * width + x] or
+                (obj.always_visible and map.is_explored(obj.x, obj.y))):
+            glyphs[(x, y)] = (obj.char, obj.color)
+    return glyphs
 
-    # Blit the contents of the off-screen to the main screen
-    libtcod.console_blit(con, 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT, 0, 0, 0)
 
-    # Prepare the render the GUI panel
+def render_hud_region(name, state, x, y, width, height, draw):
+    """ Repaint a region of the GUI panel if what it shows changed.
+
+    `state` is everything the region shows, `draw` paints it on the panel.
+    The region is then blitted to the main screen on its own.
+
+    """
+    global panel
+
+    if name in shown_hud and shown_hud[name] == state:
+        return
+    shown_hud[name] = state
+
     libtcod.console_set_default_background(panel, libtcod.black)
-    libtcod.console_clear(panel)
+    libtcod.console_rect(panel, x, y, width, height, True, libtcod.BKGND_SET)
+    draw()
+    libtcod.console_blit(panel, x, y, width, height, 0, x, PANEL_Y + y)
+
+
+def render_stats():
+    """ Show the player's stats and the dungeon level on the panel.
+
+    """
+    global panel
+
+    render_bar(1, 1, BAR_WIDTH, 'HP', player.fighter.hp, player.fighter.max_hp,
+               libtcod.light_red, libtcod.darker_red)
+
+    libtcod.console_set_default_foreground(panel, libtcod.white)
+    libtcod.console_print_ex(panel, 1, 3, libtcod.BKGND_NONE, libtcod.LEFT,
+                             'Dungeon level {}'.format(dungeon_level))
+
+
+def render_messages():
+    """ Print the game messages on the panel, one line at a time.
+
+    """
+    global panel
 
-    # Print the game messages one line at a time.
     y = 1
     for (line, color) in game_msgs:
         libtcod.console_set_default_foreground(panel, color)
@@ -1161,22 +1561,16 @@ def render_all():
                                  libtcod.LEFT, line)
         y += 1
 
-    # Show the player's stats
-    render_bar(1, 1, BAR_WIDTH, 'HP', player.fighter.hp, player.fighter.max_hp,
-               libtcod.light_red, libtcod.darker_red)
 
-    # Show the dungeon level
-    libtcod.console_print_ex(panel, 1, 3, libtcod.BKGND_NONE, libtcod.LEFT,
-                             'Dungeon level {}'.format(dungeon_level))
+def render_names(names):
+    """ Display names of objects under the mouse on the panel.
+
+    """
+    global panel
 
-    # Display names of objects under the mouse.
     libtcod.console_set_default_foreground(panel, libtcod.light_gray)
     libtcod.console_print_ex(panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT,
-                             get_names_under_mouse())
-
-    # Blit the contents of the panel to the main screen
-    libtcod.console_blit(panel, 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT, 0, 0,
-                         PANEL_Y)
+                             names)
 
 
 def render_bar(x, y, total_width, name, value, maximum, bar_color, back_color):
@@ -1264,11 +1658,20 @@ def save_game():
 
     """
     global map, objects, player, inventory, game_msgs, game_state,\
-        dungeon_level, stairs
+        dungeon_level, stairs, game_seed, level_candidate, terrain_changes
 
+    # The level itself can be generated again from the seed, so only store
+    # what the player has explored and changed since.
     file = shelve.open('savegame', 'n')
-    file['map'] = map
+    file['game_seed'] = game_seed
+    file['level_candidate'] = level_candidate
+    file['explored'] = map.explored_state()
+    for turn, i, tile in map.journal.read('save'):
+        terrain_changes[i] = tile
+    file['terrain'] = [(i % map.width, i // map.width, tile)
+                       for i, tile in sorted(terrain_changes.items())]
     file['objects'] = objects
+    file['populated_rooms'] = populated_rooms
     file['player_index'] = objects.index(player)
     file['stairs_index'] = objects.index(stairs)
     file['inventory'] = inventory
@@ -1283,27 +1686,48 @@ def load_game():
 
     """
     global map, objects, player, inventory, game_msgs, game_state,\
-        dungeon_level, stairs
+        dungeon_level, stairs, rooms, room_index, game_seed, level_candidate,\
+        spawn_seeds, populated_rooms, prefab_spawns, analysis,\
+        terrain_changes, newly_explored
 
     file = shelve.open('savegame', 'r')
-    map = file['map']
+    game_seed = file['game_seed']
+    dungeon_level = file['dungeon_level']
+    level_candidate = file['level_candidate']
+
+    # Rebuild the level from its seed, then replay the player's changes.
+    level = generate_level(game_seed, dungeon_level, level_candidate)
+    map = level.map
+    rooms = level.rooms
+    room_index = level.room_index
+    analysis = level.analysis
+    spawn_seeds = level.spawn_seeds
+    prefab_spawns = level.prefab_spawns
+    populated_rooms = file['populated_rooms']
+    newly_explored = []
+    terrain_changes = {}
+    map.journal.subscribe('save')
+    for x, y, tile in file['terrain']:
+        map.set_terrain(x, y, tile)
+    map.restore_explored(file['explored'])
+
     objects = file['objects']
     player = objects[file['player_index']]
     stairs = objects[file['stairs_index']]
     inventory = file['inventory']
     game_msgs = file['game_msgs']
     game_state = file['game_state']
-    dungeon_level = file['dungeon_level']
     file.close()
 
     initialize_fov()
+    pregenerate_next_level()
 
 
 def next_level():
     """ Advance to the next level
 
     """
-    global player, dungeon_level
+    global player, dungeon_level, game_seed
     message('You take a moment to rest, and recover your strength.',
             libtcod.light_violet)
     player.fighter.heal(player.fighter.max_hp / 2)  # heals by 50% of max_hp
@@ -1312,61 +1736,67 @@ def next_level():
             'of the Underdeep...', libtcod.red)
 
     dungeon_level += 1
-    make_map()
+    level = take_pregenerated_level(dungeon_level)
+    if not level:
+        level = build_level(game_seed, dungeon_level)
+    enter_level(level)
     initialize_fov()
+    pregenerate_next_level()
 
 
-def make_map():
-    """ Generates the map coordinates
+def make_map(seed, level, candidate=0):
+    """ Generates the map coordinates, one stage at a time
 
     Room generation logic:
     Pick a random location for the first room and carve it. Then pick another
     location for the second; if it doesn't overlap with the first. Connect the
     two with a tunnel. Repeat.
 
-    """
-    global map, player, objects, stairs
+    All randomness comes from the level's own RNG (see level_seed), so the
+    same seed and level number always give the same Level. This doesn't touch
+    the globals, the caller enters the Level.
+
+    This is a generator: it yields the name of every stage it finishes, and
+    the finished Level last, see LevelBuilder.
 
-    # Init list of game objects.
-    objects = [player]
+    """
+    rng = libtcod.random_new_from_seed(level_seed(seed, level, candidate))
 
-    # Fill map with unblocked tiles
-    # Access the map: map[x][y]
-    map = [[Tile(True) for y in range(MAP_HEIGHT)]
-           for x in range(MAP_WIDTH)]
+    # Fill map with blocked tiles
+    tiles = new_tile_map()
 
+    # Keep the rooms and an index of the area they cover so overlap checks
+    # and "which room is this?" lookups don't have to scan every room.
     rooms = []
+    room_index = RoomIndex(MAP_WIDTH, MAP_HEIGHT)
+    h_tunnels = []
+    v_tunnels = []
+    vaults = {}
     num_rooms = 0
     for r in range(MAX_ROOMS):
-        # Random width and height
-        w = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-        h = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+        # Some rooms are prefabs and take its size, the others get a random
+        # width and height.
+        vault = choose_prefab(rng, level, MAP_WIDTH - 1, MAP_HEIGHT - 1)
+        if vault is not None:
+            w, h = vault.width - 1, vault.height - 1
+        else:
+            w = libtcod.random_get_int(rng, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+            h = libtcod.random_get_int(rng, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
 
         # Random pos without going out of map boundaries
-        x = libtcod.random_get_int(0, 0, MAP_WIDTH - w - 1)
-        y = libtcod.random_get_int(0, 0, MAP_HEIGHT - h - 1)
+        x = libtcod.random_get_int(rng, 0, MAP_WIDTH - w - 1)
+        y = libtcod.random_get_int(rng, 0, MAP_HEIGHT - h - 1)
 
         new_room = Rect(x, y, w, h)
 
         # Check if the other rooms intersect with this room.
-        failed = False
-        for other_room in rooms:
-            if new_room.intersect(other_room):
-                failed = True
-                break
-
-        if not failed:
-            # "paint" it to the map.
-            create_room(new_room)
-
-            # put objects in it such as monsters.
-            place_objects(new_room)
-
+        if not room_index.overlaps(new_room.x1, new_room.y1, new_room.x2,
+                                   new_room.y2):
             new_x, new_y = new_room.center()
 
             if num_rooms == 0:
-                # If this is the first room, put the player in it.
-                player.x, player.y = (new_x, new_y)
+                # If this is the first room, the player starts in it.
+                start = (new_x, new_y)
             else:
                 # All rooms after the first connects to the previous room with
                 # a tunnel.
@@ -1375,50 +1805,730 @@ def make_map():
                 prev_x, prev_y = rooms[num_rooms - 1].center()
 
                 # Draw a coin (random 0 or 1)
-                if libtcod.random_get_int(0, 0, 1) == 1:
+                if libtcod.random_get_int(rng, 0, 1) == 1:
                     # First move horizontally, then vertically.
-                    create_h_tunnel(prev_x, new_x, prev_y)
-                    create_v_tunnel(prev_y, new_y, new_x)
+                    h_tunnels.append((prev_x, new_x, prev_y))
+                    v_tunnels.append((prev_y, new_y, new_x))
                 else:
                     # Do the opposite.
-                    create_v_tunnel(prev_y, new_y, prev_x)
-                    create_h_tunnel(prev_x, new_x, new_y)
+                    v_tunnels.append((prev_y, new_y, prev_x))
+                    h_tunnels.append((prev_x, new_x, new_y))
 
             # Finally append the new room to the list
+            room_index.add(new_room.x1, new_room.y1, new_room.x2, new_room.y2)
+            if vault is not None:
+                vaults[num_rooms] = vault
             rooms.append(new_room)
             num_rooms += 1
+        if (r + 1) % ROOMS_PER_STAGE == 0:
+            yield 'rooms'
+    yield 'rooms'
+
+    # "paint" the whole layout to the map in one go, prefabs are stamped
+    # instead of carved.
+    for stage in carve_stages(tiles, 'carve', rects=[
+            room.inner() for i, room in enumerate(rooms) if i not in vaults]):
+        yield stage
+    vault_spawns = stamp_prefabs(tiles, rooms, vaults)
+    yield 'prefabs'
+    for stage in carve_stages(tiles, 'tunnels', h_tunnels=h_tunnels,
+                              v_tunnels=v_tunnels):
+        yield stage
+
+    spawn_seeds = roll_spawn_seeds(rooms, rng)
+    libtcod.random_delete(rng)
+    yield 'spawns'
+
+    # stairs at the center of the last room
+    yield finish_level(tiles, rooms, room_index, start, (new_x, new_y),
+                       tunnel_length(h_tunnels, v_tunnels), spawn_seeds,
+                       vault_spawns)
+
+
+def make_bsp_map(seed, level, candidate=0):
+    """ Generates the map by splitting it up with a BSP tree
+
+    The split tree is built natively and flattened into arrays in one pass.
+    Every leaf gets a room, and every split connects a room from one half to
+    a room from the other, so the whole level is always connected.
+
+    Like make_map, all randomness comes from the level's own RNG, and the
+    stages are yielded as they finish.
+
+    """
+    rng = libtcod.random_new_from_seed(level_seed(seed, level, candidate))
+
+    bsp = libtcod.bsp_new_with_size(0, 0, MAP_WIDTH, MAP_HEIGHT)
+    libtcod.bsp_split_recursive(bsp, rng, BSP_DEPTH, BSP_MIN_SIZE,
+                                BSP_MIN_SIZE, 1.5, 1.5)
+    node_x, node_y, node_w, node_h, node_level, leaf, father = \
+        libtcod.bsp_flatten(bsp)
+    libtcod.bsp_delete(bsp)
+    yield 'split'
+
+    tiles = new_tile_map()
+    rooms = []
+    room_index = RoomIndex(MAP_WIDTH, MAP_HEIGHT)
+    h_tunnels = []
+    v_tunnels = []
+    vaults = {}
+
+    # A room somewhere inside every leaf, or a prefab that fits the leaf.
+    # Leaves don't overlap, neither will their rooms.
+    sons = [[] for i in range(len(leaf))]
+    room_centers = [None] * len(leaf)
+    for i in range(len(leaf)):
+        if father[i] >= 0:
+            sons[father[i]].append(i)
+        if not leaf[i]:
+            continue
+        vault = choose_prefab(rng, level, node_w[i], node_h[i])
+        if vault is not None:
+            vaults[len(rooms)] = vault
+            w, h = vault.width - 1, vault.height - 1
+        else:
+            w = libtcod.random_get_int(rng, ROOM_MIN_SIZE,
+                                       min(ROOM_MAX_SIZE, node_w[i] - 1))
+            h = libtcod.random_get_int(rng, ROOM_MIN_SIZE,
+                                       min(ROOM_MAX_SIZE, node_h[i] - 1))
+        x = libtcod.random_get_int(rng, node_x[i],
+                                   node_x[i] + node_w[i] - w - 1)
+        y = libtcod.random_get_int(rng, node_y[i],
+                                   node_y[i] + node_h[i] - h - 1)
+
+        new_room = Rect(x, y, w, h)
+        room_index.add(new_room.x1, new_room.y1, new_room.x2, new_room.y2)
+        rooms.append(new_room)
+        room_centers[i] = new_room.center()
+        if len(rooms) % ROOMS_PER_STAGE == 0:
+            yield 'rooms'
+    yield 'rooms'
+
+    # Nodes come out in pre-order, so walking them backwards visits the sons
+    # before their father. Connect the two halves of every split and pass a
+    # room of the left half up as the one to connect to.
+    for i in reversed(range(len(leaf))):
+        if leaf[i]:
+            continue
+        left, right = sons[i]
+        prev_x, prev_y = room_centers[left]
+        new_x, new_y = room_centers[right]
+        if libtcod.random_get_int(rng, 0, 1) == 1:
+            h_tunnels.append((prev_x, new_x, prev_y))
+            v_tunnels.append((prev_y, new_y, new_x))
+        else:
+            v_tunnels.append((prev_y, new_y, prev_x))
+            h_tunnels.append((prev_x, new_x, new_y))
+        room_centers[i] = room_centers[left]
+
+    for stage in carve_stages(tiles, 'carve', rects=[
+            room.inner() for i, room in enumerate(rooms) if i not in vaults]):
+        yield stage
+    vault_spawns = stamp_prefabs(tiles, rooms, vaults)
+    yield 'prefabs'
+    for stage in carve_stages(tiles, 'tunnels', h_tunnels=h_tunnels,
+                              v_tunnels=v_tunnels):
+        yield stage
+
+    spawn_seeds = roll_spawn_seeds(rooms, rng)
+    libtcod.random_delete(rng)
+    yield 'spawns'
+
+    # The player starts in the first room, the stairs are in the last one.
+    yield finish_level(tiles, rooms, room_index, rooms[0].center(),
+                       rooms[-1].center(),
+                       tunnel_length(h_tunnels, v_tunnels), spawn_seeds,
+                       vault_spawns)
+
+
+def make_cave_map(seed, level, candidate=0):
+    """ Generates a cave level with a cellular automaton
+
+    Caves have no rooms, so the map is cut up into sectors of
+    CAVE_SECTOR_SIZE tiles instead. Every sector with some floor in it is
+    used as a room for spawning monsters and items.
+
+    Like make_map, all randomness comes from the level's own RNG, and the
+    stages are yielded as they finish.
+
+    """
+    rng = libtcod.random_new_from_seed(level_seed(seed, level, candidate))
+
+    walls = cave_walls(MAP_WIDTH, MAP_HEIGHT,
+                       libtcod.random_get_int(rng, 0, 0x7fffffff),
+                       CAVE_WALL_CHANCE, CAVE_STEPS)
+    # The wall plane doubles as terrain: FLOOR is 0 and WALL is 1.
+    tiles = new_tile_map()
+    tiles.load_terrain(walls)
+    yield 'carve'
+
+    rooms = []
+    room_index = RoomIndex(MAP_WIDTH, MAP_HEIGHT)
+    floors = []
+    for y in range(0, MAP_HEIGHT, CAVE_SECTOR_SIZE):
+        for x in range(0, MAP_WIDTH, CAVE_SECTOR_SIZE):
+            sector = Rect(x, y, min(CAVE_SECTOR_SIZE, MAP_WIDTH - x) - 1,
+                          min(CAVE_SECTOR_SIZE, MAP_HEIGHT - y) - 1)
+
+            # The first floor tile where place_objects could put something.
+            floor = None
+            for row in range(sector.y1 + 1, sector.y2):
+                i = walls.find(b'\x00', row * MAP_WIDTH + sector.x1 + 1,
+                               row * MAP_WIDTH + sector.x2)
+                if i != -1:
+                    floor = (i % MAP_WIDTH, row)
+                    break
+            if floor is None:
+                continue
+
+            room_index.add(sector.x1, sector.y1, sector.x2, sector.y2)
+            rooms.append(sector)
+            floors.append(floor)
+    yield 'rooms'
+
+    spawn_seeds = roll_spawn_seeds(rooms, rng)
+    libtcod.random_delete(rng)
+    yield 'spawns'
+
+    # The player starts in the first sector, the stairs are in the last one.
+    # Without two sectors of floor both end up on the same tile, which
+    # validate_level rejects, so that another candidate is generated.
+    start = floors[0] if floors else (0, 0)
+    stairs_at = floors[-1] if len(floors) > 1 else start
+    yield finish_level(tiles, rooms, room_index, start, stairs_at,
+                       spawn_seeds=spawn_seeds)
+
+
+def carve_stages(tiles, stage, rects=(), h_tunnels=(), v_tunnels=()):
+    """ carve_many, ROOMS_PER_STAGE rooms or tunnels at a time.
+
+    Yields `stage` after every batch.
+
+    """
+    for i in range(0, max(len(rects), len(h_tunnels), len(v_tunnels)),
+                   ROOMS_PER_STAGE):
+        j = i + ROOMS_PER_STAGE
+        tiles.carve_many(rects[i:j], h_tunnels[i:j], v_tunnels[i:j])
+        yield stage
+
+
+def prefab_library():
+    """ Return the compiled room prefabs, loading them on first use.
+
+    """
+    global room_prefabs
+
+    if room_prefabs is None:
+        room_prefabs = load_library(PREFAB_FILE, level_cache)
+    return room_prefabs
+
+
+def choose_prefab(rng, level, max_width, max_height):
+    """ Roll whether a room is a prefab and pick one that fits, or None.
+
+    """
+    if libtcod.random_get_int(rng, 1, 100) > PREFAB_CHANCE:
+        return None
+    return prefab_library().choose(rng, level, max_width, max_height)
+
+
+def stamp_prefabs(tiles, rooms, vaults):
+    """ Stamp the prefabs picked for some of the rooms into the map.
+
+    `vaults` maps room ids to prefab variants. Returns the prefab spawns by
+    room id, in map coordinates.
+
+    """
+    return dict((room_id, vault.stamp(tiles, rooms[room_id].x1,
+                                      rooms[room_id].y1))
+                for room_id, vault in vaults.items())
+
+
+def new_tile_map():
+    """ Return a fully blocked map of MAP_WIDTH x MAP_HEIGHT tiles.
+
+    Access the map: map[x][y], or its planes through map.index(x, y)
+
+    """
+    if MAP_WIDTH > CAMERA_WIDTH or MAP_HEIGHT > CAMERA_HEIGHT:
+        return ChunkedTileMap(MAP_WIDTH, MAP_HEIGHT, MAP_CHUNK_SIZE)
+    return TileMap(MAP_WIDTH, MAP_HEIGHT)
+
+
+def roll_spawn_seeds(rooms, rng):
+    """ Draw the seed each room's monsters and items are spawned from.
+
+    Monsters and items are only placed once the player sees a room, see
+    populate_room. Every room gets its seed up front, so what it spawns
+    doesn't depend on the order the rooms are found in.
+
+    """
+    return [libtcod.random_get_int(rng, 0, 0x7fffffff) for room in rooms]
 
-    # create stairs at the center of the last room
-    stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white,
+
+def finish_level(tiles, rooms, room_index, start, stairs_at,
+                 corridor_length=0, spawn_seeds=(), prefab_spawns=None):
+    """ Put the stairs in a carved map and return the finished Level.
+
+    """
+    stairs = Object(stairs_at[0], stairs_at[1], '<', 'stairs', libtcod.white,
                     always_visible=True)
-    objects.append(stairs)
-    stairs.send_to_back()
+
+    return Level(tiles, rooms, room_index, [stairs], stairs, start,
+                 corridor_length, spawn_seeds, prefab_spawns)
+
+
+def populate_room(room_id):
+    """ Spawn the monsters and items of a room the player has just seen.
+
+    Rooms that have been populated already are left alone.
+
+    """
+    global map, rooms, objects, spawn_seeds, populated_rooms, dungeon_level,\
+        prefab_spawns
+
+    if populated_rooms[room_id]:
+        return
+    populated_rooms[room_id] = 1
+
+    # Prefabs come with their own monsters and items.
+    if room_id in prefab_spawns:
+        for x, y, kind, name in prefab_spawns[room_id]:
+            if blocked_at(map, objects, x, y):
+                continue
+            if kind == 'monster':
+                objects.append(create_monster(name, x, y))
+            else:
+                objects.insert(0, create_item(name, x, y))
+        return
+
+    rng = libtcod.random_new_from_seed(spawn_seeds[room_id])
+    place_objects(rooms[room_id], map, objects, rng, dungeon_level)
+    libtcod.random_delete(rng)
+
+
+def populate_seen_rooms():
+    """ Populate the rooms the player has seen since the last call.
+
+    Goes by the cells render_all found explored for the first time. Returns
+    True if a room was populated, its monsters and items still have to be
+    drawn.
+
+    """
+    global room_index, populated_rooms, newly_explored
+
+    seen_rooms = set(room_index.room_at(x, y) for x, y in newly_explored)
+    newly_explored = []
+    seen_rooms.discard(None)
+    new_rooms = sorted(room_id for room_id in seen_rooms
+                       if not populated_rooms[room_id])
+    for room_id in new_rooms:
+        populate_room(room_id)
+    return bool(new_rooms)
+
+
+def tunnel_length(h_tunnels, v_tunnels):
+    """ Return the number of tiles the given tunnels cover, crossings included.
+
+    """
+    return (sum(abs(x2 - x1) + 1 for x1, x2, y in h_tunnels) +
+            sum(abs(y2 - y1) + 1 for y1, y2, x in v_tunnels))
+
+
+def generate_level(seed, level, candidate=0):
+    """ Generate a dungeon level with the generator picked by MAP_GENERATOR.
+
+    Each candidate number gives a different layout for the same level. If
+    the level cache has it already, it is loaded instead of generated.
+
+    """
+    return LevelBuilder(level_stages(seed, level, candidate)).finish()
+
+
+def map_stages(seed, level, candidate=0):
+    """ Return the stages of the generator picked by MAP_GENERATOR.
+
+    Only the map is made, without the analysis and validation that
+    level_stages adds.
+
+    """
+    if MAP_GENERATOR == 'bsp':
+        return make_bsp_map(seed, level, candidate)
+    elif MAP_GENERATOR == 'caves':
+        return make_cave_map(seed, level, candidate)
+    return make_map(seed, level, candidate)
+
+
+def level_stages(seed, level, candidate=0):
+    """ generate_level, one stage at a time.
+
+    Yields the name of every finished stage and the Level last.
+
+    """
+    global level_cache
+
+    key = level_cache_key(seed, level, candidate)
+    if level_cache is not None:
+        result = level_cache.get(key)
+        if result is not None:
+            yield result
+            return
+
+    for result in map_stages(seed, level, candidate):
+        if not isinstance(result, Level):
+            yield result
+
+    result.analysis = analyze(result.map, result.room_index)
+    result.problems = validate_level(result)
+    yield 'analysis'
+
+    result.candidate = candidate
+    if level_cache is not None:
+        level_cache.put(key, result)
+    yield result
+
+
+def validate_level(level):
+    """ Return a list of what's wrong with a generated level, if anything.
+
+    """
+    problems = []
+    analysis = level.analysis
+    if level.start == (level.stairs.x, level.stairs.y):
+        problems.append('the stairs are on the start tile')
+    if not analysis.connected(level.start, (level.stairs.x, level.stairs.y)):
+        problems.append('the stairs are unreachable')
+    cut_off = analysis.unreachable_from(*level.start)
+    if cut_off:
+        problems.append('{} walkable tiles in {} areas are unreachable'.format(
+            sum(analysis.region_sizes[r] for r in cut_off), len(cut_off)))
+    return problems
+
+
+def build_level_stages(seed, level_number, levels=()):
+    """ build_level, one stage at a time, generating candidates in turn.
+
+    `levels` are the candidates generated already, e.g. by the level
+    workers, numbered from 0. Candidates are generated until there are
+    LEVEL_CANDIDATES and one of them is valid; if none is by
+    MAX_LEVEL_CANDIDATES a RuntimeError tells what was wrong with them.
+
+    """
+    levels = list(levels)
+    while len(levels) < LEVEL_CANDIDATES or best_level(levels) is None:
+        if len(levels) >= MAX_LEVEL_CANDIDATES:
+            raise RuntimeError('No valid candidate for level {}: {}'.format(
+                level_number, '; '.join(levels[0].problems)))
+        for result in level_stages(seed, level_number, len(levels)):
+            if isinstance(result, Level):
+                levels.append(result)
+            else:
+                yield result
+    yield best_level(levels)
+
+
+def level_cache_key(seed, level, candidate):
+    """ Return the level cache key: everything a generated level depends on.
+
+    """
+    return (LEVEL_CACHE_VERSION, seed, level, candidate, MAP_GENERATOR,
+            MAP_WIDTH, MAP_HEIGHT, MAP_CHUNK_SIZE, CAMERA_WIDTH,
+            CAMERA_HEIGHT, ROOM_MIN_SIZE, ROOM_MAX_SIZE, MAX_ROOMS,
+            BSP_DEPTH, BSP_MIN_SIZE, CAVE_WALL_CHANCE, CAVE_STEPS,
+            CAVE_SECTOR_SIZE, PREFAB_CHANCE, prefab_library().digest)
+
+
+def score_level(level):
+    """ Rate a generated level, higher is better.
+
+    More rooms, stairs far away from the start and little corridor walking
+    in between make for a better level.
+
+    """
+    (x, y), stairs = level.start, level.stairs
+    stairs_distance = math.sqrt((stairs.x - x) ** 2 + (stairs.y - y) ** 2)
+    return (len(level.rooms) * 10 + stairs_distance -
+            level.corridor_length / 10.0)
+
+
+def best_level(levels):
+    """ Return the best scoring of the given candidate levels.
+
+    Levels with problems are passed over, None is returned if none of them
+    is valid. Ties go to the lowest candidate number, so the pick is
+    reproducible.
+
+    """
+    valid = [level for level in levels if not level.problems]
+    if not valid:
+        return None
+    return max(sorted(valid, key=lambda level: level.candidate),
+               key=score_level)
+
+
+def build_level(seed, level_number):
+    """ Generate all candidates of a level and return the best one.
+
+    The candidates are spread over the level workers if they run.
+
+    """
+    global level_pool
+
+    levels = []
+    if level_pool is not None:
+        levels = [result.get() for result in
+                  start_level_candidates(seed, level_number)]
+    return LevelBuilder(build_level_stages(seed, level_number,
+                                           levels)).finish()
+
+
+def level_seed(seed, level, candidate=0):
+    """ Derive the RNG seed of a dungeon level from the game seed.
+
+    """
+    key = '{}:{}'.format(seed, level)
+    if candidate:
+        key += ':{}'.format(candidate)
+    return zlib.crc32(key.encode('ascii')) & 0xffffffff
+
+
+def enter_level(level):
+    """ Make the given Level the current one and put the player in it.
+
+    """
+    global map, rooms, room_index, objects, stairs, player, level_candidate,\
+        spawn_seeds, populated_rooms, prefab_spawns, analysis,\
+        terrain_changes, newly_explored
+
+    level_candidate = level.candidate
+    map = level.map
+    rooms = level.rooms
+    room_index = level.room_index
+    analysis = level.analysis
+    spawn_seeds = level.spawn_seeds
+    populated_rooms = level.populated
+    newly_explored = []
+    prefab_spawns = level.prefab_spawns
+    objects = [player] + level.objects
+    stairs = level.stairs
+    player.x, player.y = level.start
+    terrain_changes = {}
+    map.journal.subscribe('save')
+
+
+def init_level_worker(cache, prefabs):
+    """ Hand a level worker process the level cache and room prefabs.
+
+    Workers that are spawned rather than forked (on Windows) import this
+    module afresh, without what the main process set up, so the pool passes
+    them in.
+
+    """
+    global level_cache, room_prefabs
+
+    level_cache = cache
+    room_prefabs = prefabs
+
+
+def pregenerate_level(seed, level_number, candidate):
+    """ Generate a dungeon level candidate in a level worker process.
+
+    """
+    return generate_level(seed, level_number, candidate)
+
+
+def start_level_candidates(seed, level_number):
+    """ Queue every candidate of a level on the level workers.
+
+    Returns the list of pending results.
+
+    """
+    global level_pool
+
+    return [level_pool.apply_async(pregenerate_level,
+                                   (seed, level_number, candidate))
+            for candidate in range(LEVEL_CANDIDATES)]
+
+
+def pregenerate_next_level():
+    """ Start generating the level below the current one in the background.
+
+    """
+    global level_pool, pending_level, dungeon_level, game_seed
+
+    pending_level = None
+    if level_pool is not None:
+        pending_level = (dungeon_level + 1,
+                         start_level_candidates(game_seed, dungeon_level + 1))
+    elif PREGENERATE_LEVELS:
+        pending_level = (dungeon_level + 1, LevelBuilder(
+            build_level_stages(game_seed, dungeon_level + 1)))
+
+
+def step_pending_level():
+    """ Give the level being built on the main thread its slice of time.
+
+    Returns True while the level needs more slices.
+
+    """
+    global pending_level
+
+    if pending_level is not None:
+        builder = pending_level[1]
+        if isinstance(builder, LevelBuilder) and builder.level is None:
+            builder.step(LEVEL_SLICE_BUDGET)
+            return builder.level is None
+    return False
+
+
+def wait_for_input(busy=False):
+    """ Wait for the next key press or mouse event, mouse moves included.
+
+    With IDLE_WAIT this checks for one every IDLE_SLEEP seconds until there
+    is one or the window is closed, unless the caller is `busy` with work of
+    its own between inputs. Otherwise it only checks once, and the game loop
+    goes on LIMIT_FPS times a second.
+
+    libtcod's own sys_wait_for_event isn't used, it only returns on a key
+    event, so it would hold back mouse targeting and the names under the
+    mouse.
+
+    """
+    global key, mouse
+
+    mask = libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE
+    while True:
+        event = libtcod.sys_check_for_event(mask, key, mouse)
+        if (event or busy or not IDLE_WAIT or
+                libtcod.console_is_window_closed()):
+            return event
+        time.sleep(IDLE_SLEEP)
+
+
+def take_pregenerated_level(level_number):
+    """ Return the best pre-generated Level for the given level number.
+
+    Returns None if there is none, or if the level workers failed to hand
+    it over, in which case the caller generates it on the spot. This only
+    waits if the worker hasn't finished yet, and generates more candidates
+    if none of the workers' is valid.
+
+    """
+    global pending_level, game_seed
+
+    if pending_level is None or pending_level[0] != level_number:
+        return None
+
+    results = pending_level[1]
+    pending_level = None
+    if isinstance(results, LevelBuilder):
+        return results.finish()
+    try:
+        levels = [result.get() for result in results]
+    except (multiprocessing.ProcessError,
+            multiprocessing.pool.MaybeEncodingError,
+            pickle.PicklingError, pickle.UnpicklingError):
+        return None
+    return LevelBuilder(build_level_stages(game_seed, level_number,
+                                           levels)).finish()
 
 
 def initialize_fov():
     """ Create the FOV map according to the generated map.
 
     """
-    global fov_recompute, fov_map, con
+    global fov_recompute, fov_map, con, camera, visible, redraw
 
+    # The next render_all repaints the whole screen.
     fov_recompute = True
+    redraw = True
+
+    # Point the camera at the player.
+    camera = Camera(min(CAMERA_WIDTH, map.width),
+                    min(CAMERA_HEIGHT, map.height))
+    camera.follow(player.x, player.y, map.width, map.height)
+
+    # Initalize the FOV map for the camera's view, uploading it in one go.
+    # From then on it follows the terrain changes in the map's journal.
+    fov_map = libtcod.map_new(camera.width, camera.height)
+    visible = bytearray(camera.width * camera.height)
+    map.journal.subscribe('fov')
+    refresh_fov_map()
+
 
-    libtcod.console_clear(con)
+def frame_buffer():
+    """ Return the ConsoleBuffer of the off-screen console.
+
+    It is made anew, blank, whenever the console's size changed.
+
+    """
+    global con, frame
+
+    width = libtcod.console_get_width(con)
+    height = libtcod.console_get_height(con)
+    if frame is None or (frame.width, frame.height) != (width, height):
+        frame = libtcod.ConsoleBuffer(width, height, fore_r=255, fore_g=255,
+                                      fore_b=255)
+    return frame
+
+
+def fill_background(keys, width, height):
+    """ Set the background of the whole off-screen console from tile keys.
+
+    `keys` covers the top left width x height cells, the rest of the console
+    is painted as unexplored.
+
+    """
+    global con
 
-    # Initalize the FOV map.
-    fov_map = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-    for y in range(MAP_HEIGHT):
-        for x in range(MAP_WIDTH):
-            libtcod.map_set_properties(fov_map, x, y,
-                                       not map[x][y].block_sight,
-                                       not map[x][y].blocked)
+    frame = frame_buffer()
+    con_width, con_height = frame.width, frame.height
+    if width < con_width:
+        padding = bytearray(con_width - width)
+        keys = bytearray().join(keys[row:row + width] + padding
+                                for row in range(0, width * height, width))
+    keys = keys + bytearray(con_width * con_height - len(keys))
+    frame.set_plane('back_r', keys.translate(background_red))
+    frame.set_plane('back_g', keys.translate(background_green))
+    frame.set_plane('back_b', keys.translate(background_blue))
+    frame.blit(con, fill_fore=False)
+
+
+def refresh_fov_map():
+    """ Load the part of the map the camera sees into the FOV map.
+
+    """
+    global fov_map, map, camera
+
+    view = map.window(camera.x, camera.y, camera.width, camera.height)
+    libtcod.map_fill_properties(fov_map, view.transparency(),
+                                view.walkability())
+
+
+def update_fov_map():
+    """ Patch the FOV map with the tiles that changed since the last update.
+
+    Returns whether any did.
+
+    """
+    global fov_map, map, camera
+
+    changes = map.journal.read('fov')
+    for turn, i, tile in changes:
+        x, y = i % map.width, i // map.width
+        if camera.contains(x, y):
+            screen_x, screen_y = camera.to_screen(x, y)
+            libtcod.map_set_properties(fov_map, screen_x, screen_y,
+                                       not map.blocks_sight(x, y),
+                                       not map.is_blocked(x, y))
+    return bool(changes)
 
 
 def new_game():
     """ Initalize variables on a new game
 
     """
-    global player, inventory, game_msgs, game_state, dungeon_level
+    global player, inventory, game_msgs, game_state, dungeon_level, game_seed
 
     game_state = 'playing'
     inventory = []
@@ -1431,9 +2541,14 @@ def new_game():
                     fighter=fighter_component)
     player.level = 1
 
+    # Every level of this game derives from the game seed.
+    game_seed = GAME_SEED
+    if game_seed is None:
+        game_seed = libtcod.random_get_int(0, 0, 0x7fffffff)
+
     # Generate map coordinates.
     dungeon_level = 1
-    make_map()
+    enter_level(build_level(game_seed, dungeon_level))
 
     # Initial equipment: a dagger
     equipment_component = Equipment(slot='right hand', power_bonus=2)
@@ -1449,6 +2564,9 @@ def new_game():
     # Initialize the FOV
     initialize_fov()
 
+    # Get the next level going.
+    pregenerate_next_level()
+
 
 def play_game():
     global key, mouse, player_action
@@ -1458,20 +2576,25 @@ def play_game():
     mouse = libtcod.Mouse()
 
     while not libtcod.console_is_window_closed():
-        # Check for mouse of key press events
-        libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS |
-                                    libtcod.EVENT_MOUSE, key, mouse)
         # Render the screen.
         render_all()
 
+        # Rooms the player saw for the first time get their monsters and
+        # items now, drawn right away.
+        if populate_seen_rooms():
+            render_all()
+
         libtcod.console_flush()
 
+        # Keep building the next level if that happens on this thread.
+        building = step_pending_level()
+
         # Check for player level up
         check_level_up()
 
-        # Clear characters on the off-screen
-        for obj in objects:
-            obj.clear()
+        # Wait for mouse or key press events, but keep the level coming
+        # along if it is built here.
+        wait_for_input(busy=building)
 
         # handle keys and exit the game if needed
         player_action = handle_keys()
@@ -1488,6 +2611,7 @@ def play_game():
             for obj in objects:
                 if obj.ai:
                     obj.ai.take_turn()
+            map.journal.end_turn()
 
 
 if __name__ == '__main__':
@@ -1497,6 +2621,18 @@ if __name__ == '__main__':
     global con
     global panel
 
+    # Open the level cache, load the prefabs and start the level workers
+    # before opening the window, so the workers share the cache and prefabs
+    # but don't get a copy of the window.
+    if LEVEL_CACHE_DIR:
+        level_cache = LevelCache(LEVEL_CACHE_DIR, LEVEL_CACHE_SIZE)
+    prefab_library()
+    if PREGENERATE_LEVELS and LEVEL_WORKERS != 0:
+        level_pool = multiprocessing.Pool(processes=LEVEL_WORKERS,
+                                          initializer=init_level_worker,
+                                          initargs=(level_cache,
+                                                    room_prefabs))
+
     # Set the font.
     libtcod.console_set_custom_font('terminal10x10.png',
                                     libtcod.FONT_TYPE_GREYSCALE |
@@ -1509,10 +2645,14 @@ if __name__ == '__main__':
     # Init an off-screen console to be used as a buffer.
     con = libtcod.console_new(SCREEN_WIDTH, SCREEN_HEIGHT)
 
-    # Set FPS. This does not have an effect for turn-based games.
+    # Set FPS. This only limits the game loop while it doesn't wait for
+    # input, see IDLE_WAIT.
     libtcod.sys_set_fps(LIMIT_FPS)
 
     # Init the status bar console panel.
     panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
 
     main_menu()
+
+    if level_pool is not None:
+        level_pool.terminate()
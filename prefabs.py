@@ -0,0 +1,244 @@
+"""
+Hand-made room prefabs: vaults, shrines, lairs.
+
+Prefabs are drawn in a text file (see prefabs.txt for the format). Parsing
+that text, or loading .asc/.apf consoles, for every level would slow down
+generation, so the file is compiled once into a PrefabLibrary: each prefab
+in all of its orientations, as ready made tile planes and spawn lists. The
+compiled library is kept in the level cache under the hash of its source,
+later runs load it without parsing anything.
+
+Stamping a prefab into a level is then a plain copy of its planes.
+
+"""
+from __future__ import print_function
+
+import hashlib
+import io
+
+import libtcodpy as libtcod
+import tilemap
+from tilemap import _INVERT, TileMap, flood_fill
+
+# Bump whenever the compiled form changes, so stale libraries are rebuilt.
+FORMAT_VERSION = 2
+
+WALL = '#'
+FLOOR = '.'
+
+# The tile type of each map character. Spawns stand on floor.
+TERRAIN = {
+    WALL: tilemap.WALL,
+    FLOOR: tilemap.FLOOR,
+    '+': tilemap.DOOR,
+    '~': tilemap.WATER,
+    ':': tilemap.RUBBLE,
+}
+
+# Characters standing for something spawned on a floor tile, and what.
+SPAWNS = {
+    'o': ('monster', 'orc'),
+    'T': ('monster', 'troll'),
+    '!': ('item', 'healing'),
+    '/': ('item', 'sword'),
+    '[': ('item', 'shield'),
+    'L': ('item', 'lightning'),
+    'F': ('item', 'fireball'),
+    'C': ('item', 'confusion'),
+}
+
+# Translation table from map characters to tile types.
+_TERRAIN = bytes(bytearray(TERRAIN.get(chr(i), tilemap.FLOOR)
+                           for i in range(256)))
+
+
+def _rotate(rows):
+    """ Turn a list of text rows a quarter clockwise.
+
+    """
+    return [''.join(row[i] for row in reversed(rows))
+            for i in range(len(rows[0]))]
+
+
+def _orientations(rows):
+    """ Return the rows in all four rotations, then all four mirrored.
+
+    """
+    turns = [rows]
+    for i in range(3):
+        turns.append(_rotate(turns[-1]))
+    return turns + [[row[::-1] for row in turn] for turn in turns]
+
+
+class PrefabVariant(object):
+    """ One orientation of a prefab, ready to be stamped.
+
+        tiles   - a TileMap of the prefab's terrain
+        spawns  - (x, y, kind, name) tuples relative to the top left corner,
+                  kind being 'monster' or 'item'
+
+    """
+    def __init__(self, name, rows):
+        self.name = name
+        self.width = len(rows[0])
+        self.height = len(rows)
+        self.tiles = TileMap(self.width, self.height)
+        self.tiles.load_terrain(bytearray(''.join(rows).encode('ascii'))
+                                .translate(_TERRAIN))
+        self.spawns = tuple((x, y) + SPAWNS[c]
+                            for y, row in enumerate(rows)
+                            for x, c in enumerate(row) if c in SPAWNS)
+
+    def stamp(self, tiles, x, y):
+        """ Copy the prefab onto a TileMap or ChunkedTileMap at (x, y).
+
+        Returns its spawns moved to map coordinates.
+
+        """
+        tiles.paste(x, y, self.tiles,
+                    planes=('terrain', 'blocked', 'block_sight'))
+        return [(x + dx, y + dy, kind, name)
+                for dx, dy, kind, name in self.spawns]
+
+
+class Prefab(object):
+    """ A prefab and its orientations.
+
+    `min_level` is the first dungeon level it shows up on, `weight` how
+    often it is picked compared to the others.
+
+    """
+    def __init__(self, name, rows, min_level=1, weight=10, rotate=True):
+        self.name = name
+        self.min_level = min_level
+        self.weight = weight
+        shapes = _orientations(rows) if rotate else [rows]
+        self.variants = [PrefabVariant(name, shape) for shape in shapes]
+
+
+class PrefabLibrary(object):
+    """ All prefabs compiled from one source file.
+
+    `digest` identifies the source, levels built with the library depend on
+    it.
+
+    """
+    def __init__(self, prefabs, digest):
+        self.prefabs = prefabs
+        self.digest = digest
+        # What choose() picks from, by dungeon level and size.
+        self.fitting = {}
+
+    def __len__(self):
+        return len(self.prefabs)
+
+    def choose(self, rng, level, max_width, max_height):
+        """ Pick a prefab variant no bigger than max_width x max_height.
+
+        Only prefabs allowed on the dungeon level are considered. Draws from
+        the given libtcod RNG; returns None if nothing fits.
+
+        """
+        key = (level, max_width, max_height)
+        choices = self.fitting.get(key)
+        if choices is None:
+            choices = self.fitting[key] = []
+            for prefab in self.prefabs:
+                if prefab.min_level > level:
+                    continue
+                fits = [variant for variant in prefab.variants
+                        if variant.width <= max_width and
+                        variant.height <= max_height]
+                if fits:
+                    choices.append((prefab.weight, fits))
+        if not choices:
+            return None
+
+        dice = libtcod.random_get_int(rng, 1, sum(w for w, f in choices))
+        for weight, fits in choices:
+            dice -= weight
+            if dice <= 0:
+                break
+        return fits[libtcod.random_get_int(rng, 0, len(fits) - 1)]
+
+
+def parse_prefabs(text, path='<prefabs>'):
+    """ Parse prefab source text into a list of Prefabs.
+
+    Raises ValueError, naming the line, for anything malformed.
+
+    """
+    prefabs = []
+    name, settings, rows = None, {}, []
+
+    def finish(lineno):
+        if name is None:
+            return
+        if not rows:
+            raise ValueError('{}:{}: prefab {} has no rows'.format(
+                path, lineno, name))
+        prefab = Prefab(name, rows, int(settings.get('min_level', 1)),
+                        int(settings.get('weight', 10)),
+                        settings.get('rotate', 'yes') != 'no')
+        for variant in prefab.variants:
+            # Tunnels and the stairs aim for a room's center, everything
+            # walkable has to be reached from there.
+            x, y = (variant.width - 1) // 2, (variant.height - 1) // 2
+            if variant.tiles.is_blocked(x, y):
+                raise ValueError('{}:{}: the center of prefab {} is '
+                                 'blocked'.format(path, lineno, name))
+            walkable = variant.tiles.blocked.translate(_INVERT)
+            reached = sum(end - start for start, end in
+                          flood_fill(walkable, variant.width, x, y))
+            if reached != walkable.count(b'\x01'):
+                raise ValueError('{}:{}: prefab {} has walkable tiles that '
+                                 "can't be reached from its center".format(
+                                     path, lineno, name))
+        prefabs.append(prefab)
+
+    lines = text.splitlines()
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip()
+        if not line or line.startswith(';'):
+            continue
+        if line.startswith('['):
+            finish(lineno)
+            name, settings, rows = line.strip('[]'), {}, []
+        elif name is None:
+            raise ValueError('{}:{}: expected a [name] line'.format(
+                path, lineno))
+        elif '=' in line and not rows:
+            key, value = line.split('=', 1)
+            settings[key.strip()] = value.strip()
+        else:
+            unknown = set(line) - set(TERRAIN) - set(SPAWNS)
+            if unknown:
+                raise ValueError('{}:{}: unknown tiles {}'.format(
+                    path, lineno, ''.join(sorted(unknown))))
+            if rows and len(line) != len(rows[0]):
+                raise ValueError('{}:{}: rows of prefab {} differ in '
+                                 'length'.format(path, lineno, name))
+            rows.append(line)
+    finish(len(lines))
+    return prefabs
+
+
+def load_library(path, cache=None):
+    """ Return the compiled PrefabLibrary of a prefab file.
+
+    With a LevelCache, a library compiled before from the same source is
+    loaded from it instead of compiled again.
+
+    """
+    with io.open(path, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha1(source).hexdigest()
+    key = ('prefabs', FORMAT_VERSION, digest)
+
+    library = cache.get(key) if cache is not None else None
+    if library is None:
+        library = PrefabLibrary(
+            parse_prefabs(source.decode('utf-8'), path), digest)
+        if cache is not None:
+            cache.put(key, library)
+    return library
@@ -0,0 +1,243 @@
+"""
+Tests of the level analysis layers: the distance to a wall, chokepoints and
+connectivity of small hand-drawn maps, and ChunkLabels joining regions
+across chunk borders.
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import analysis  # noqa: E402
+import tilemap  # noqa: E402
+from analysis import ChunkLabels, analyze  # noqa: E402
+
+# '#' is wall, everything else floor. A hall, a corridor leading out of it
+# to a closet, and a pocket on the right that nothing leads to.
+LEVEL = [
+    '################',
+    '#.......#####..#',
+    '#.......#####..#',
+    '#............###',
+    '#.......####.###',
+    '#.......####..##',
+    '################',
+]
+
+
+def make_tiles(rows, chunk_size=None):
+    """ Return a TileMap, or a ChunkedTileMap, of the text rows.
+
+    """
+    width, height = len(rows[0]), len(rows)
+    if chunk_size:
+        tiles = tilemap.ChunkedTileMap(width, height, chunk_size)
+    else:
+        tiles = tilemap.TileMap(width, height)
+    for y, row in enumerate(rows):
+        for x, c in enumerate(row):
+            if c != '#':
+                tiles.carve_rect(x, y, x, y)
+    return tiles
+
+
+def wall_distance(rows, x, y):
+    """ The steps, diagonals included, from (x, y) to the nearest wall, the
+        slow way. Outside of the map is wall.
+
+    """
+    width, height = len(rows[0]), len(rows)
+    if rows[y][x] == '#':
+        return 0
+    best = min(x + 1, y + 1, width - x, height - y)
+    for wy, row in enumerate(rows):
+        for wx, c in enumerate(row):
+            if c == '#':
+                best = min(best, max(abs(wx - x), abs(wy - y)))
+    return min(best, analysis.MAX_DISTANCE)
+
+
+def is_wall(rows, x, y):
+    return not (0 <= y < len(rows) and 0 <= x < len(rows[0])) or \
+        rows[y][x] == '#'
+
+
+class MapAnalysisTest(unittest.TestCase):
+
+    chunk_size = None
+
+    def analyze(self, rows=LEVEL):
+        tiles = make_tiles(rows, self.chunk_size)
+        return analyze(tiles, tilemap.RoomIndex(tiles.width, tiles.height))
+
+    def test_distance_to_wall(self):
+        layers = self.analyze()
+        for y, row in enumerate(LEVEL):
+            for x in range(len(row)):
+                self.assertEqual(layers.distance_to_wall(x, y),
+                                 wall_distance(LEVEL, x, y), (x, y))
+        # The middle of the hall is three steps from the walls.
+        self.assertEqual(layers.distance_to_wall(4, 3), 3)
+
+    def test_distance_is_capped(self):
+        size = 2 * analysis.MAX_DISTANCE + 5
+        rows = ['.' * size] * size
+        layers = self.analyze(rows)
+        self.assertEqual(layers.distance_to_wall(size // 2, size // 2),
+                         analysis.MAX_DISTANCE)
+        self.assertEqual(layers.distance_to_wall(0, size // 2), 1)
+
+    def test_chokepoints(self):
+        layers = self.analyze()
+        for y, row in enumerate(LEVEL):
+            for x in range(len(row)):
+                expected = not is_wall(LEVEL, x, y) and (
+                    is_wall(LEVEL, x - 1, y) and is_wall(LEVEL, x + 1, y) or
+                    is_wall(LEVEL, x, y - 1) and is_wall(LEVEL, x, y + 1))
+                self.assertEqual(bool(layers.is_chokepoint(x, y)), expected,
+                                 (x, y))
+        # The corridor, not the hall.
+        self.assertTrue(layers.is_chokepoint(10, 3))
+        self.assertFalse(layers.is_chokepoint(4, 3))
+
+    def test_connected(self):
+        layers = self.analyze()
+        self.assertTrue(layers.connected((1, 1), (13, 5)))
+        self.assertTrue(layers.connected((12, 4), (7, 5)))
+        self.assertFalse(layers.connected((1, 1), (14, 1)))
+        # Walls are connected to nothing, not even themselves.
+        self.assertFalse(layers.connected((0, 0), (0, 0)))
+        self.assertFalse(layers.connected((0, 0), (1, 1)))
+
+    def test_unreachable_from(self):
+        layers = self.analyze()
+        cut_off = layers.unreachable_from(1, 1)
+        self.assertEqual(len(cut_off), 1)
+        self.assertEqual(layers.region_sizes[cut_off[0]], 4)
+        self.assertEqual(cut_off, [layers.region_at(13, 2)])
+        self.assertEqual(layers.unreachable_from(13, 1),
+                         [layers.region_at(1, 1)])
+        # From a wall, every region is out of reach.
+        self.assertEqual(sorted(layers.unreachable_from(0, 0)), [0, 1])
+
+
+class ChunkedMapAnalysisTest(MapAnalysisTest):
+    """ The same tests on a ChunkedTileMap, with chunks small enough to cut
+        every region and the distance margin into pieces.
+
+    """
+    chunk_size = 3
+
+
+class ChunkLabelsTest(unittest.TestCase):
+
+    def labels(self, rows, size):
+        """ Return ChunkLabels of the '.' cells of rows cut into size x size
+            chunks.
+
+        """
+        planes = {}
+        for cy in range(0, len(rows), size):
+            for cx in range(0, len(rows[0]), size):
+                planes[(cx // size, cy // size)] = bytearray(
+                    1 if rows[y][x] == '.' else 0
+                    for y in range(cy, cy + size)
+                    for x in range(cx, cx + size))
+        return ChunkLabels(size, size, planes)
+
+    def region(self, labels, x, y):
+        size = labels.chunk_width
+        return labels.at((x // size, y // size), (y % size) * size + x % size)
+
+    def test_joined_across_borders(self):
+        # A ring through all four chunks, whose pieces only meet across the
+        # chunk borders.
+        rows = ['....',
+                '.##.',
+                '.##.',
+                '....']
+        labels = self.labels(rows, 2)
+        self.assertEqual(labels.sizes, [12])
+        regions = set(self.region(labels, x, y)
+                      for y in range(4) for x in range(4)
+                      if rows[y][x] == '.')
+        self.assertEqual(regions, set([0]))
+        self.assertIsNone(self.region(labels, 1, 1))
+
+    def test_diagonal_corners_stay_apart(self):
+        # The two halves only touch diagonally at the middle of the map,
+        # where four chunks meet.
+        rows = ['..##',
+                '..##',
+                '##..',
+                '##..']
+        labels = self.labels(rows, 2)
+        self.assertEqual(labels.sizes, [4, 4])
+        self.assertNotEqual(self.region(labels, 1, 1),
+                            self.region(labels, 2, 2))
+        # Chunks without open cells are left out.
+        self.assertEqual(sorted(labels.labels), [(0, 0), (1, 1)])
+
+    def test_regions_joined_through_other_chunks(self):
+        # Two pieces of the top left chunk only connect through the chunks
+        # around it.
+        rows = ['.#....',
+                '.#.##.',
+                '.#.##.',
+                '.....#',
+                '######',
+                '.....#']
+        labels = self.labels(rows, 3)
+        self.assertEqual(sorted(labels.sizes), [5, 16])
+        self.assertEqual(self.region(labels, 0, 0),
+                         self.region(labels, 2, 0))
+        self.assertEqual(self.region(labels, 0, 0),
+                         self.region(labels, 5, 2))
+        self.assertNotEqual(self.region(labels, 0, 0),
+                            self.region(labels, 0, 5))
+
+    def test_pickle(self):
+        import pickle
+        labels = self.labels(['....', '.##.', '.##.', '.#..'], 2)
+        loaded = pickle.loads(pickle.dumps(labels, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(loaded.sizes, labels.sizes)
+        for key in labels.labels:
+            self.assertEqual(list(loaded.labels[key]),
+                             list(labels.labels[key]))
+
+
+class AnalysisTestWithoutNumPy(MapAnalysisTest):
+    """ The map analysis tests on the pure Python fallbacks.
+
+    """
+    def setUp(self):
+        self.numpy_available = (tilemap.numpy_available,
+                                analysis.numpy_available)
+        tilemap.numpy_available = analysis.numpy_available = False
+
+    def tearDown(self):
+        tilemap.numpy_available, analysis.numpy_available = \
+            self.numpy_available
+
+
+class ChunkLabelsTestWithoutNumPy(ChunkLabelsTest):
+    """ The ChunkLabels tests on the pure Python fallbacks.
+
+    """
+    def setUp(self):
+        self.numpy_available = (tilemap.numpy_available,
+                                analysis.numpy_available)
+        tilemap.numpy_available = analysis.numpy_available = False
+
+    def tearDown(self):
+        tilemap.numpy_available, analysis.numpy_available = \
+            self.numpy_available
+
+
+if __name__ == '__main__':
+    unittest.main()
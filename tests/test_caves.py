@@ -0,0 +1,104 @@
+"""
+Tests of the cellular-automata caves: the NumPy and big integer smoothing
+steps against a cell by cell reference, and the caves they grow.
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import caves  # noqa: E402
+import tilemap  # noqa: E402
+
+
+def reference_step(walls, width, height):
+    """ One smoothing step the slow way, outside of the grid is wall, with
+        the border walled up again.
+
+    """
+    result = bytearray(width * height)
+    for y in range(height):
+        for x in range(width):
+            count = 0
+            for ny in range(y - 1, y + 2):
+                for nx in range(x - 1, x + 2):
+                    if not (0 <= nx < width and 0 <= ny < height):
+                        count += 1
+                    else:
+                        count += walls[ny * width + nx]
+            result[y * width + x] = count >= caves.WALL_THRESHOLD
+    caves._close_border(result, width, height)
+    return result
+
+
+class CaveTest(unittest.TestCase):
+
+    sizes = ((12, 9), (31, 17), (64, 40))
+
+    def step_functions(self):
+        steps = [caves._step_bigint]
+        if caves.numpy_available:
+            steps.append(caves._step_numpy)
+        return steps
+
+    def test_steps_match_the_reference(self):
+        for width, height in self.sizes:
+            for seed in range(3):
+                walls = caves.noise(width, height, seed, 45)
+                caves._close_border(walls, width, height)
+                expected = reference_step(walls, width, height)
+                for step in self.step_functions():
+                    result = step(walls, width, height)
+                    caves._close_border(result, width, height)
+                    self.assertEqual(result, expected,
+                                     (step.__name__, width, height, seed))
+
+    def test_numpy_and_bigint_caves_match(self):
+        if not caves.numpy_available:
+            self.skipTest('NumPy is not available')
+        for width, height in self.sizes:
+            for seed in range(3):
+                with_numpy = caves.cave_walls(width, height, seed)
+                caves.numpy_available = False
+                try:
+                    without = caves.cave_walls(width, height, seed)
+                finally:
+                    caves.numpy_available = True
+                self.assertEqual(with_numpy, without, (width, height, seed))
+
+    def test_same_seed_same_cave(self):
+        self.assertEqual(caves.cave_walls(40, 30, 5),
+                         caves.cave_walls(40, 30, 5))
+        self.assertNotEqual(caves.cave_walls(40, 30, 5),
+                            caves.cave_walls(40, 30, 6))
+
+    def test_noise(self):
+        self.assertEqual(caves.noise(20, 10, 1, 0), bytearray(200))
+        self.assertEqual(caves.noise(20, 10, 1, 100),
+                         bytearray(b'\x01' * 200))
+        walls = sum(caves.noise(100, 100, 1, 45))
+        self.assertTrue(4000 < walls < 5000, walls)
+
+    def test_walled_in_and_connected(self):
+        width, height = 50, 30
+        walls = caves.cave_walls(width, height, 2)
+        self.assertEqual(walls[:width], bytearray(b'\x01' * width))
+        self.assertEqual(walls[-width:], bytearray(b'\x01' * width))
+        self.assertEqual(walls[::width], bytearray(b'\x01' * height))
+        self.assertEqual(walls[width - 1::width], bytearray(b'\x01' * height))
+        floor = walls.translate(tilemap._INVERT)
+        self.assertTrue(sum(floor))
+        self.assertEqual(len(tilemap.find_regions(floor, width)), 1)
+
+    def test_all_wall(self):
+        self.assertEqual(caves.cave_walls(20, 10, 1, wall_chance=100),
+                         bytearray(b'\x01' * 200))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Tests of the on-disk level cache: storing and loading entries, dropping
+entries that can't be loaded any more and evicting the least recently used
+ones.
+
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import levelcache  # noqa: E402
+from levelcache import LevelCache  # noqa: E402
+
+
+class LevelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = LevelCache(os.path.join(self.directory, 'levels'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self):
+        return sorted(os.listdir(self.cache.directory))
+
+    def age(self, key, seconds):
+        """ Make an entry look last used the given seconds ago.
+
+        """
+        when = time.time() - seconds
+        os.utime(self.cache.path(key), (when, when))
+
+    def test_put_and_get(self):
+        value = {'tiles': bytearray(b'\x01\x00' * 50), 'rooms': [(1, 2)]}
+        self.cache.put(('level', 1), value)
+        self.assertEqual(self.cache.get(('level', 1)), value)
+        self.assertEqual(self.files(),
+                         [os.path.basename(self.cache.path(('level', 1)))])
+
+    def test_missing(self):
+        self.assertIsNone(self.cache.get(('level', 1)))
+
+    def test_put_replaces(self):
+        self.cache.put(('level', 1), 'old')
+        self.cache.put(('level', 1), 'new')
+        self.assertEqual(self.cache.get(('level', 1)), 'new')
+        self.assertEqual(len(self.files()), 1)
+
+    def test_keys_stay_apart(self):
+        # The cache version is part of the key, entries of another version
+        # are never loaded.
+        self.cache.put((1, 'seed', 1), 'version 1')
+        self.cache.put((2, 'seed', 1), 'version 2')
+        self.assertEqual(self.cache.get((1, 'seed', 1)), 'version 1')
+        self.assertEqual(self.cache.get((2, 'seed', 1)), 'version 2')
+        self.assertIsNone(self.cache.get((3, 'seed', 1)))
+
+    def test_stale_entry_is_removed(self):
+        # An entry that can't be loaded any more, here not even a pickle,
+        # reads as missing and is deleted.
+        path = self.cache.path(('level', 1))
+        with open(path, 'wb') as f:
+            f.write(b'not a level')
+        self.assertIsNone(self.cache.get(('level', 1)))
+        self.assertFalse(os.path.exists(path))
+
+    def test_remove(self):
+        self.cache.put(('level', 1), 'value')
+        path = self.cache.path(('level', 1))
+        self.cache.remove(path)
+        self.assertFalse(os.path.exists(path))
+        # Gone already, another process got to it first.
+        self.cache.remove(path)
+        self.assertIsNone(self.cache.get(('level', 1)))
+
+    def test_evict_least_recently_used(self):
+        value = os.urandom(1000)  # doesn't compress
+        for key in 'abcd':
+            self.cache.put(key, value)
+        self.age('a', 40)
+        self.age('b', 30)
+        self.age('c', 20)
+        self.age('d', 10)
+        # Using an entry makes it the most recently used.
+        self.assertEqual(self.cache.get('a'), value)
+        size = os.path.getsize(self.cache.path('a'))
+        self.cache.max_size = 2 * size
+        self.cache.evict()
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNone(self.cache.get('c'))
+        self.assertEqual(self.cache.get('a'), value)
+        self.assertEqual(self.cache.get('d'), value)
+
+    def test_put_evicts(self):
+        value = os.urandom(1000)
+        self.cache.put('a', value)
+        self.cache.max_size = os.path.getsize(self.cache.path('a')) + 10
+        self.age('a', 10)
+        self.cache.put('b', value)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), value)
+
+    def test_evict_ignores_other_files(self):
+        with open(os.path.join(self.cache.directory, 'notes.txt'), 'w') as f:
+            f.write('x' * 1000)
+        self.cache.max_size = 0
+        self.cache.evict()
+        self.assertEqual(self.files(), ['notes.txt'])
+
+    def test_failed_put_leaves_no_temporary_file(self):
+        def rename(src, dst):
+            raise OSError('rename failed')
+        saved = levelcache.os.rename
+        levelcache.os.rename = rename
+        try:
+            self.cache.put(('level', 1), 'value')
+        finally:
+            levelcache.os.rename = saved
+        self.assertEqual(self.files(), [])
+        self.assertIsNone(self.cache.get(('level', 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
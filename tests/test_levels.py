@@ -0,0 +1,182 @@
+"""
+Tests of level validation: validate_level on small hand-drawn levels, and
+how best_level and the prefab parser treat what it finds.
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # libtcodpy loads ./libtcod.so
+
+import libtcodpy as libtcod  # noqa: E402
+import main as game  # noqa: E402
+import prefabs  # noqa: E402
+import tilemap  # noqa: E402
+from analysis import analyze  # noqa: E402
+
+# '#' is wall, everything else floor. '@' is the start, '>' the stairs,
+# which are on the start tile if there is no '>'.
+CONNECTED = [
+    '##########',
+    '#@...#...#',
+    '#....+...#',
+    '#....#..>#',
+    '##########',
+]
+STAIRS_CUT_OFF = [
+    '##########',
+    '#@...#...#',
+    '#....#...#',
+    '#....#..>#',
+    '##########',
+]
+POCKET = [
+    '##########',
+    '#@.....#.#',
+    '#......#.#',
+    '#.....>###',
+    '##########',
+]
+NO_STAIRS = [
+    '#####',
+    '#@..#',
+    '#####',
+]
+
+
+def make_level(rows, candidate=0, chunk_size=None):
+    """ Build an analyzed Level from text rows, on a ChunkedTileMap if
+        chunk_size is given.
+
+    """
+    width, height = len(rows[0]), len(rows)
+    if chunk_size:
+        tiles = tilemap.ChunkedTileMap(width, height, chunk_size)
+    else:
+        tiles = tilemap.TileMap(width, height)
+    start = stairs = None
+    for y, row in enumerate(rows):
+        for x, c in enumerate(row):
+            if c != '#':
+                tiles.carve_rect(x, y, x, y)
+            if c == '@':
+                start = (x, y)
+            elif c == '>':
+                stairs = game.Object(x, y, '<', 'stairs', libtcod.white)
+    if stairs is None:
+        stairs = game.Object(start[0], start[1], '<', 'stairs', libtcod.white)
+    level = game.Level(tiles, [], tilemap.RoomIndex(width, height), [],
+                       stairs, start)
+    level.candidate = candidate
+    level.analysis = analyze(tiles, level.room_index)
+    level.problems = game.validate_level(level)
+    return level
+
+
+class ValidateLevelTest(unittest.TestCase):
+
+    def test_connected(self):
+        self.assertEqual(game.validate_level(make_level(CONNECTED)), [])
+
+    def test_stairs_cut_off(self):
+        problems = game.validate_level(make_level(STAIRS_CUT_OFF))
+        self.assertEqual(problems, [
+            'the stairs are unreachable',
+            '9 walkable tiles in 1 areas are unreachable'])
+
+    def test_unreachable_pocket(self):
+        problems = game.validate_level(make_level(POCKET))
+        self.assertEqual(problems,
+                         ['2 walkable tiles in 1 areas are unreachable'])
+
+    def test_stairs_on_the_start(self):
+        problems = game.validate_level(make_level(NO_STAIRS))
+        self.assertEqual(problems, ['the stairs are on the start tile'])
+
+    def test_chunked_map(self):
+        # Chunks of 3 cut every region into several pieces, which have to be
+        # joined again across the chunk borders.
+        for rows in (CONNECTED, STAIRS_CUT_OFF, POCKET):
+            self.assertEqual(
+                game.validate_level(make_level(rows, chunk_size=3)),
+                game.validate_level(make_level(rows)))
+
+
+class BestLevelTest(unittest.TestCase):
+
+    def test_invalid_candidates_are_passed_over(self):
+        levels = [make_level(STAIRS_CUT_OFF, 0), make_level(CONNECTED, 1),
+                  make_level(POCKET, 2)]
+        self.assertIs(game.best_level(levels), levels[1])
+
+    def test_no_valid_candidate(self):
+        levels = [make_level(STAIRS_CUT_OFF, 0), make_level(POCKET, 1)]
+        self.assertIsNone(game.best_level(levels))
+
+    def test_ties_go_to_the_lowest_candidate(self):
+        levels = [make_level(CONNECTED, 1), make_level(CONNECTED, 0)]
+        self.assertIs(game.best_level(levels), levels[1])
+
+
+class CaveMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (game.MAP_WIDTH, game.MAP_HEIGHT, game.CAVE_WALL_CHANCE)
+
+    def tearDown(self):
+        game.MAP_WIDTH, game.MAP_HEIGHT, game.CAVE_WALL_CHANCE = self.saved
+
+    def generate(self):
+        game.MAP_GENERATOR, saved = 'caves', game.MAP_GENERATOR
+        try:
+            return game.generate_level(1, 1)
+        finally:
+            game.MAP_GENERATOR = saved
+
+    def test_no_floor(self):
+        game.CAVE_WALL_CHANCE = 100
+        level = self.generate()
+        self.assertEqual(level.rooms, [])
+        self.assertIn('the stairs are on the start tile', level.problems)
+
+    def test_single_sector(self):
+        # A map of one sector can't keep the start and the stairs apart.
+        game.MAP_WIDTH = game.MAP_HEIGHT = game.CAVE_SECTOR_SIZE
+        game.CAVE_WALL_CHANCE = 30
+        level = self.generate()
+        self.assertEqual(len(level.rooms), 1)
+        self.assertIn('the stairs are on the start tile', level.problems)
+
+
+class PrefabReachabilityTest(unittest.TestCase):
+
+    def test_unreachable_floor(self):
+        with self.assertRaises(ValueError):
+            prefabs.parse_prefabs('[pocket]\n'
+                                  '#######\n'
+                                  '#...#.#\n'
+                                  '#...#.#\n'
+                                  '#...#.#\n'
+                                  '#######\n')
+
+    def test_reachable_through_a_door(self):
+        library = prefabs.parse_prefabs('[closet]\n'
+                                        '#######\n'
+                                        '#...+.#\n'
+                                        '#...#.#\n'
+                                        '#...#.#\n'
+                                        '#######\n')
+        self.assertEqual(len(library), 1)
+
+    def test_shipped_prefabs(self):
+        with open(os.path.join(ROOT, 'prefabs.txt')) as f:
+            self.assertTrue(prefabs.parse_prefabs(f.read()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,408 @@
+"""
+Tests of the bulk paths added to libtcodpy: the ConsoleBuffer planes, the
+console fill channels, the FOV map upload and readback, with and without
+NumPy, and the flattened BSP tree, against the per cell or per node
+functions they replace.
+
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import unittest
+from array import array
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # libtcodpy loads ./libtcod.so
+
+import libtcodpy as libtcod  # noqa: E402
+
+WIDTH = 7
+HEIGHT = 5
+
+
+def cell_color(x, y):
+    """ A color and character that differ from cell to cell.
+
+    """
+    return (x * 30, y * 40, x + y, 255 - x, 255 - y, x * y,
+            chr(ord('a') + (x + y) % 26))
+
+
+def painted():
+    """ Return a ConsoleBuffer holding cell_color in every cell, set one
+        cell at a time.
+
+    """
+    buf = libtcod.ConsoleBuffer(WIDTH, HEIGHT)
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            buf.set(x, y, *cell_color(x, y))
+    return buf
+
+
+def planes(buf):
+    return dict((name, [int(v) for v in getattr(buf, name)])
+                for name in buf.PLANES)
+
+
+class ConsoleBufferTest(unittest.TestCase):
+
+    numpy_available = libtcod.numpy_available
+
+    def setUp(self):
+        self.saved = libtcod.numpy_available
+        libtcod.numpy_available = self.numpy_available
+
+    def tearDown(self):
+        libtcod.numpy_available = self.saved
+
+    def test_planes(self):
+        buf = libtcod.ConsoleBuffer(WIDTH, HEIGHT)
+        for name in buf.PLANES:
+            plane = getattr(buf, name)
+            self.assertEqual(len(plane), WIDTH * HEIGHT)
+            if not self.numpy_available:
+                self.assertIsInstance(plane, array)
+
+    def test_clear(self):
+        buf = painted()
+        buf.clear(1, 2, 3, 4, 5, 6, 'x')
+        expected = libtcod.ConsoleBuffer(WIDTH, HEIGHT)
+        for y in range(HEIGHT):
+            for x in range(WIDTH):
+                expected.set(x, y, 1, 2, 3, 4, 5, 6, 'x')
+        self.assertEqual(planes(buf), planes(expected))
+
+    def test_fill(self):
+        # Clipped at the top left, and at the right and bottom.
+        for x, y, w, h in ((2, 1, 3, 2), (-2, -1, 4, 3), (5, 3, 9, 9),
+                           (0, 0, WIDTH, HEIGHT), (8, 0, 2, 2)):
+            buf = painted()
+            buf.fill(x, y, w, h, (10, 20, 30), (40, 50, 60), '#')
+            expected = painted()
+            for cy in range(max(y, 0), min(y + h, HEIGHT)):
+                for cx in range(max(x, 0), min(x + w, WIDTH)):
+                    expected.set(cx, cy, 10, 20, 30, 40, 50, 60, '#')
+            self.assertEqual(planes(buf), planes(expected), (x, y, w, h))
+
+    def test_fill_leaves_none_alone(self):
+        buf = painted()
+        buf.fill(1, 1, 2, 2, back=libtcod.Color(7, 8, 9))
+        expected = painted()
+        for cy in (1, 2):
+            for cx in (1, 2):
+                expected.set_back(cx, cy, 7, 8, 9)
+        self.assertEqual(planes(buf), planes(expected))
+
+    def check_copy_rect(self, src, x, y, w, h, xdst, ydst):
+        """ Copy the rectangle into a painted buffer, or within src if it
+            is None, and compare with copying cell by cell.
+
+        """
+        buf = painted()
+        source = src or buf
+        expected = painted()
+        before = planes(source)
+        for cy in range(h):
+            for cx in range(w):
+                sx, sy, dx, dy = x + cx, y + cy, xdst + cx, ydst + cy
+                if (0 <= sx < source.width and 0 <= sy < source.height and
+                        0 <= dx < WIDTH and 0 <= dy < HEIGHT):
+                    i = sy * source.width + sx
+                    expected.set(dx, dy, *[before[name][i]
+                                           for name in buf.PLANES[:-1]] +
+                                 [chr(before['char'][i])])
+        buf.copy_rect(source, x, y, w, h, xdst, ydst)
+        self.assertEqual(planes(buf), planes(expected),
+                         (x, y, w, h, xdst, ydst))
+
+    def test_copy_rect(self):
+        src = libtcod.ConsoleBuffer(3, 4, 1, 2, 3, 4, 5, 6, '*')
+        for y in range(4):
+            for x in range(3):
+                src.set_fore(x, y, x, y, 9, chr(ord('A') + x + 3 * y))
+        for args in ((0, 0, 3, 4, 1, 1), (1, 1, 2, 2, 0, 0),
+                     (-1, 0, 3, 3, 2, 0), (0, 0, 3, 4, 5, 3),
+                     (0, 0, 3, 4, -2, -1), (2, 3, 5, 5, 0, 0)):
+            self.check_copy_rect(src, *args)
+
+    def test_copy_rect_within_buffer(self):
+        # Overlapping copies, down and up, right and left.
+        for args in ((0, 0, 5, 3, 1, 1), (1, 1, 5, 3, 0, 0),
+                     (0, 0, WIDTH, 4, 0, 1), (0, 1, WIDTH, 4, 0, 0)):
+            self.check_copy_rect(None, *args)
+
+    def test_set_plane(self):
+        values = [(i * 7) % 256 for i in range(WIDTH * HEIGHT)]
+        inputs = [values, bytearray(values), bytes(bytearray(values)),
+                  array('i', values)]
+        if self.numpy_available:
+            import numpy
+            inputs.append(numpy.array(values, numpy.uint8).reshape(
+                HEIGHT, WIDTH))
+        for value in inputs:
+            buf = painted()
+            buf.set_plane('back_g', value)
+            expected = painted()
+            for i, v in enumerate(values):
+                color = cell_color(i % WIDTH, i // WIDTH)
+                expected.set_back(i % WIDTH, i // WIDTH, color[0], v,
+                                  color[2])
+            self.assertEqual(planes(buf), planes(expected), type(value))
+
+    def test_set_plane_size(self):
+        buf = libtcod.ConsoleBuffer(WIDTH, HEIGHT)
+        with self.assertRaises(ValueError):
+            buf.set_plane('char', [0] * (WIDTH * HEIGHT - 1))
+
+    def test_copy(self):
+        buf = painted()
+        other = buf.copy()
+        self.assertEqual(planes(other), planes(buf))
+        other.set(0, 0, 0, 0, 0, 0, 0, 0, ' ')
+        self.assertEqual(planes(buf), planes(painted()))
+
+    def test_fill_channel(self):
+        values = [0, 1, 127, 128, 255, 3]
+        inputs = [values, bytearray(values), bytes(bytearray(values)),
+                  array('i', values), array('B', values)]
+        if self.numpy_available:
+            import numpy
+            inputs.extend([numpy.array(values, numpy.uint8),
+                           numpy.array(values, numpy.int64),
+                           numpy.array(values).reshape(2, 3)])
+        for value in inputs:
+            self.assertEqual(list(libtcod._fill_channel(value)), values,
+                             type(value))
+
+
+class ConsoleBufferTestWithoutNumPy(ConsoleBufferTest):
+    """ The same tests on the array('i') planes.
+
+    """
+    numpy_available = False
+
+
+class FovMapTest(unittest.TestCase):
+
+    width = 13
+    height = 9
+
+    def setUp(self):
+        libtcod._cmap_layout_ok()
+        self.saved = (libtcod.numpy_available,
+                      list(libtcod._cmap_layout_checked))
+        rng = random.Random(7)
+        size = self.width * self.height
+        self.transparent = bytearray(rng.random() < 0.7 for i in range(size))
+        self.walkable = bytearray(rng.random() < 0.6 for i in range(size))
+        self.maps = []
+
+    def tearDown(self):
+        libtcod.numpy_available, libtcod._cmap_layout_checked[:] = self.saved
+        for m in self.maps:
+            libtcod.map_delete(m)
+
+    def new_map(self):
+        m = libtcod.map_new(self.width, self.height)
+        self.maps.append(m)
+        return m
+
+    def cells(self):
+        return [(x, y) for y in range(self.height) for x in range(self.width)]
+
+    def per_cell_map(self):
+        """ Return a map set up one cell at a time with map_set_properties.
+
+        """
+        m = self.new_map()
+        for x, y in self.cells():
+            i = x + y * self.width
+            libtcod.map_set_properties(m, x, y, self.transparent[i],
+                                       self.walkable[i])
+        return m
+
+    def check_fill(self, transparent, walkable):
+        """ Fill a map in bulk and compare it with per_cell_map, its
+            properties and the FOV computed on both.
+
+        """
+        m = self.new_map()
+        # Stale FOV flags are cleared by the upload.
+        libtcod.map_clear(m, True, True)
+        libtcod.map_compute_fov(m, 0, 0)
+        libtcod.map_fill_properties(m, transparent, walkable)
+        expected = self.per_cell_map()
+        for x, y in self.cells():
+            self.assertEqual(libtcod.map_is_transparent(m, x, y),
+                             libtcod.map_is_transparent(expected, x, y))
+            self.assertEqual(libtcod.map_is_walkable(m, x, y),
+                             libtcod.map_is_walkable(expected, x, y))
+            self.assertFalse(libtcod.map_is_in_fov(m, x, y))
+        libtcod.map_compute_fov(m, 6, 4, 0, True)
+        libtcod.map_compute_fov(expected, 6, 4, 0, True)
+        for x, y in self.cells():
+            self.assertEqual(libtcod.map_is_in_fov(m, x, y),
+                             libtcod.map_is_in_fov(expected, x, y))
+        return expected
+
+    def check_fov(self, m):
+        """ Compare map_get_fov with asking map_is_in_fov cell by cell.
+
+        """
+        in_fov = [1 if libtcod.map_is_in_fov(m, x, y) else 0
+                  for x, y in self.cells()]
+        self.assertIn(0, in_fov)
+        self.assertIn(1, in_fov)
+        self.assertEqual(list(libtcod.map_get_fov(m)), in_fov)
+        if libtcod.numpy_available:
+            fov = libtcod.map_get_fov(m, as_numpy=True)
+            self.assertEqual(fov.shape, (self.height, self.width))
+            self.assertEqual([int(v) for v in fov.ravel()], in_fov)
+
+    def test_layout_matches_the_library(self):
+        self.assertTrue(libtcod._cmap_layout_ok())
+
+    def test_fill_properties(self):
+        self.check_fov(self.check_fill(self.transparent, self.walkable))
+
+    def test_fill_properties_sequences(self):
+        self.check_fill([bool(v) for v in self.transparent],
+                        list(self.walkable))
+
+    def test_fill_properties_numpy(self):
+        if not libtcod.numpy_available:
+            self.skipTest('NumPy is not available')
+        import numpy
+        shape = (self.height, self.width)
+        self.check_fill(
+            numpy.frombuffer(bytes(self.transparent),
+                             numpy.uint8).reshape(shape),
+            numpy.frombuffer(bytes(self.walkable), numpy.uint8) != 0)
+
+    def test_fill_properties_size(self):
+        m = self.new_map()
+        with self.assertRaises(TypeError):
+            libtcod.map_fill_properties(m, self.transparent[1:],
+                                        self.walkable[1:])
+
+    def test_layout_mismatch(self):
+        # A layout with width and height swapped doesn't pass the check.
+        class SwappedMap(libtcod.Structure):
+            _fields_ = [('height', libtcod.c_int),
+                        ('width', libtcod.c_int),
+                        ('nbcells', libtcod.c_int),
+                        ('cells', libtcod.POINTER(libtcod.c_uint8))]
+        saved = libtcod._CMap
+        libtcod._CMap = SwappedMap
+        try:
+            self.assertFalse(libtcod._check_cmap_layout())
+        finally:
+            libtcod._CMap = saved
+
+    def test_per_cell_fallback(self):
+        # Without a matching layout, the cells are only touched through the
+        # library, with the same results.
+        libtcod._cmap_layout_checked[:] = [False]
+        calls = []
+        per_cell = libtcod._map_fill_properties_per_cell
+
+        def counted(*args):
+            calls.append(args)
+            per_cell(*args)
+        libtcod._map_fill_properties_per_cell = counted
+        try:
+            m = self.check_fill(self.transparent, self.walkable)
+        finally:
+            libtcod._map_fill_properties_per_cell = per_cell
+        self.assertEqual(len(calls), 1)
+
+        in_fov = libtcod.map_is_in_fov
+        fov_calls = []
+
+        def counted_in_fov(*args):
+            fov_calls.append(args)
+            return in_fov(*args)
+        self.check_fov(m)
+        libtcod.map_is_in_fov = counted_in_fov
+        try:
+            libtcod.map_get_fov(m)
+        finally:
+            libtcod.map_is_in_fov = in_fov
+        self.assertEqual(len(fov_calls), self.width * self.height)
+
+
+class FovMapTestWithoutNumPy(FovMapTest):
+    """ The same tests on the pure Python paths.
+
+    """
+    def setUp(self):
+        FovMapTest.setUp(self)
+        libtcod.numpy_available = False
+
+
+class BspFlattenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bsp = libtcod.bsp_new_with_size(0, 0, 60, 40)
+
+    def tearDown(self):
+        libtcod.bsp_delete(self.bsp)
+
+    def walk(self, node, father=-1, nodes=None):
+        """ Return the nodes as (x, y, w, h, level, leaf, father) in pre-order,
+            walking the tree through bsp_left and bsp_right.
+
+        """
+        if nodes is None:
+            nodes = []
+        index = len(nodes)
+        leaf = libtcod.bsp_is_leaf(node)
+        nodes.append((node.x, node.y, node.w, node.h, node.level,
+                      1 if leaf else 0, father))
+        if not leaf:
+            self.walk(libtcod.bsp_left(node), index, nodes)
+            self.walk(libtcod.bsp_right(node), index, nodes)
+        return nodes
+
+    def flattened(self):
+        columns = libtcod.bsp_flatten(self.bsp)
+        for column in columns:
+            self.assertEqual(len(column), len(columns[0]))
+        return list(zip(*columns))
+
+    def test_single_node(self):
+        self.assertEqual(self.flattened(), [(0, 0, 60, 40, 0, 1, -1)])
+
+    def test_pre_order(self):
+        libtcod.bsp_split_once(self.bsp, False, 20)
+        left = libtcod.bsp_left(self.bsp)
+        libtcod.bsp_split_once(left, True, 15)
+        libtcod.bsp_split_once(libtcod.bsp_right(left), False, 10)
+        self.assertEqual(self.flattened(), [
+            (0, 0, 60, 40, 0, 0, -1),
+            (0, 0, 20, 40, 1, 0, 0),
+            (0, 0, 20, 15, 2, 1, 1),
+            (0, 15, 20, 25, 2, 0, 1),
+            (0, 15, 10, 25, 3, 1, 3),
+            (10, 15, 10, 25, 3, 1, 3),
+            (20, 0, 40, 40, 1, 1, 0),
+        ])
+        self.assertEqual(self.flattened(), self.walk(self.bsp))
+
+    def test_recursive_split(self):
+        # The default random generator, the tree only has to match itself.
+        libtcod.bsp_split_recursive(self.bsp, 0, 6, 4, 4, 1.5, 1.5)
+        nodes = self.flattened()
+        self.assertGreater(len(nodes), 8)
+        self.assertEqual(nodes, self.walk(self.bsp))
+        # The leaves tile the whole area.
+        self.assertEqual(sum(w * h for x, y, w, h, level, leaf, father
+                             in nodes if leaf), 60 * 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,412 @@
+"""
+Tests of tilemap: the region labeling (find_regions, label_regions and
+flood_fill) on small hand-drawn grids, the carving primitives, with and
+without NumPy, the RoomIndex queries and the change journal of maps in
+play.
+
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import tilemap  # noqa: E402
+
+# '.' is open, anything else closed. Two regions: the left and right rooms,
+# which join through the open third row, and the single cell at the bottom
+# right, which only touches the right room diagonally.
+GRID = [
+    '..#.....',
+    '..#.....',
+    '........',
+    '####....',
+    '.......#',
+    '#######.',
+]
+
+
+def plane(rows):
+    return bytearray(1 if c == '.' else 0 for c in ''.join(rows))
+
+
+def cells(spans):
+    return set(i for start, end in spans for i in range(start, end))
+
+
+class RegionTest(unittest.TestCase):
+
+    def test_find_regions(self):
+        width = len(GRID[0])
+        regions = [cells(spans)
+                   for spans in tilemap.find_regions(plane(GRID), width)]
+        self.assertEqual(len(regions), 2)
+        self.assertEqual(sorted(len(region) for region in regions), [1, 33])
+        self.assertIn(set([5 * width + 7]), regions)
+
+    def test_label_regions(self):
+        width = len(GRID[0])
+        open_cells = plane(GRID)
+        labels, sizes = tilemap.label_regions(open_cells, width)
+        self.assertEqual(len(labels), len(open_cells))
+        self.assertEqual(sorted(sizes), [1, 33])
+        for i, is_open in enumerate(open_cells):
+            self.assertEqual(labels[i] >= 0, bool(is_open))
+        # Connected through the corridor on the third row.
+        self.assertEqual(labels[0], labels[7])
+        self.assertEqual(labels[0], labels[4 * width])
+        # Diagonal neighbours don't connect.
+        self.assertNotEqual(labels[4 * width + 6], labels[5 * width + 7])
+        self.assertEqual(sizes[labels[5 * width + 7]], 1)
+
+    def test_label_regions_matches_find_regions(self):
+        width = len(GRID[0])
+        labels, sizes = tilemap.label_regions(plane(GRID), width)
+        for region, spans in enumerate(tilemap.find_regions(plane(GRID),
+                                                            width)):
+            self.assertEqual(set(labels[i] for i in cells(spans)),
+                             set([region]))
+            self.assertEqual(sizes[region], len(cells(spans)))
+
+    def test_label_regions_empty(self):
+        labels, sizes = tilemap.label_regions(bytearray(12), 4)
+        self.assertEqual(list(labels), [-1] * 12)
+        self.assertEqual(sizes, [])
+
+    def test_flood_fill(self):
+        width = len(GRID[0])
+        open_cells = plane(GRID)
+        region = cells(tilemap.flood_fill(open_cells, width, 0, 4))
+        self.assertEqual(len(region), 33)
+        self.assertIn(7, region)
+        self.assertNotIn(5 * width + 7, region)
+        self.assertEqual(cells(tilemap.flood_fill(open_cells, width, 7, 5)),
+                         set([5 * width + 7]))
+        # The plane passed in is left alone.
+        self.assertEqual(open_cells, plane(GRID))
+
+    def test_flood_fill_closed_cell(self):
+        self.assertEqual(tilemap.flood_fill(plane(GRID), len(GRID[0]), 2, 0),
+                         [])
+
+    def test_flood_fill_spans_rows(self):
+        # Spans never run from the end of one row into the next.
+        rows = ['...', '...', '...']
+        spans = tilemap.flood_fill(plane(rows), 3, 1, 1)
+        self.assertEqual(sorted(spans), [(0, 3), (3, 6), (6, 9)])
+
+
+class RegionTestWithoutNumPy(RegionTest):
+    """ The same tests on the pure Python fallbacks.
+
+    """
+    def setUp(self):
+        self.numpy_available = tilemap.numpy_available
+        tilemap.numpy_available = False
+
+    def tearDown(self):
+        tilemap.numpy_available = self.numpy_available
+
+
+def carved(width, height, cells):
+    """ Return the terrain, blocked and block_sight planes of an all wall
+        map with the given (x, y) cells made floor.
+
+    """
+    terrain = bytearray(b'\x01' * (width * height))
+    for x, y in cells:
+        terrain[y * width + x] = tilemap.FLOOR
+    return terrain, terrain.translate(tilemap.BLOCKS_MOVEMENT), \
+        terrain.translate(tilemap.BLOCKS_SIGHT)
+
+
+def map_planes(tiles):
+    """ Return the terrain, blocked and block_sight planes of any map.
+
+    """
+    window = tiles.window(0, 0, tiles.width, tiles.height)
+    return window.terrain, window.blocked, window.block_sight
+
+
+class CarveTest(unittest.TestCase):
+
+    width = 9
+    height = 7
+
+    def new_map(self):
+        return tilemap.TileMap(self.width, self.height)
+
+    def check(self, tiles, cells):
+        self.assertEqual(map_planes(tiles),
+                         carved(self.width, self.height, cells))
+
+    def test_carve_rect(self):
+        tiles = self.new_map()
+        tiles.carve_rect(2, 1, 5, 3)
+        self.check(tiles, [(x, y) for y in range(1, 4) for x in range(2, 6)])
+
+    def test_carve_rect_edges(self):
+        tiles = self.new_map()
+        tiles.carve_rect(0, 0, 0, 0)
+        tiles.carve_rect(self.width - 1, 0, self.width - 1,
+                         self.height - 1)
+        self.check(tiles, [(0, 0)] + [(self.width - 1, y)
+                                      for y in range(self.height)])
+
+    def test_carve_empty_rect(self):
+        tiles = self.new_map()
+        tiles.carve_rect(4, 2, 3, 5)
+        tiles.carve_rect(2, 4, 5, 3)
+        self.check(tiles, [])
+
+    def test_carve_h(self):
+        # Both directions carve the same span.
+        for x1, x2 in ((1, 6), (6, 1), (3, 3)):
+            tiles = self.new_map()
+            tiles.carve_h(x1, x2, 4)
+            self.check(tiles, [(x, 4) for x in range(min(x1, x2),
+                                                     max(x1, x2) + 1)])
+
+    def test_carve_v(self):
+        for y1, y2 in ((0, 5), (5, 0), (2, 2)):
+            tiles = self.new_map()
+            tiles.carve_v(y1, y2, 7)
+            self.check(tiles, [(7, y) for y in range(min(y1, y2),
+                                                     max(y1, y2) + 1)])
+
+    def test_carve_many(self):
+        rects = [(1, 1, 3, 2), (5, 4, 7, 5)]
+        h_tunnels = [(3, 6, 2), (8, 0, 6)]
+        v_tunnels = [(2, 5, 6), (0, 1, 0)]
+        tiles = self.new_map()
+        tiles.carve_many(rects, h_tunnels, v_tunnels)
+        one_by_one = self.new_map()
+        for rect in rects:
+            one_by_one.carve_rect(*rect)
+        for tunnel in h_tunnels:
+            one_by_one.carve_h(*tunnel)
+        for tunnel in v_tunnels:
+            one_by_one.carve_v(*tunnel)
+        self.assertEqual(map_planes(tiles), map_planes(one_by_one))
+        self.assertEqual(tiles.tile_type(6, 4), tilemap.FLOOR)
+        self.assertEqual(tiles.tile_type(0, 6), tilemap.FLOOR)
+        self.assertEqual(tiles.tile_type(4, 4), tilemap.WALL)
+
+
+class ChunkedCarveTest(CarveTest):
+    """ The same tests on a ChunkedTileMap, with every carve crossing chunk
+        borders.
+
+    """
+    def new_map(self):
+        return tilemap.ChunkedTileMap(self.width, self.height, 2)
+
+
+class CarveTestWithoutNumPy(CarveTest):
+    """ The same tests on the pure Python fallbacks.
+
+    """
+    def setUp(self):
+        self.numpy_available = tilemap.numpy_available
+        tilemap.numpy_available = False
+
+    def tearDown(self):
+        tilemap.numpy_available = self.numpy_available
+
+
+def touches(a, b):
+    """ Whether two inclusive (x1, y1, x2, y2) rectangles share a cell.
+
+    """
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+class RoomIndexTest(unittest.TestCase):
+
+    width = 40
+    height = 30
+
+    def setUp(self):
+        # Small buckets, so that rooms span several of them.
+        self.index = tilemap.RoomIndex(self.width, self.height, 8)
+        rng = random.Random(3)
+        self.rooms = []
+        for i in range(25):
+            x, y = rng.randint(-3, self.width), rng.randint(-3, self.height)
+            room = (x, y, x + rng.randint(0, 12), y + rng.randint(0, 9))
+            self.assertEqual(self.index.add(*room), len(self.rooms))
+            self.rooms.append(room)
+
+    def clip(self, rect):
+        """ Return the part of a rectangle on the map, or None.
+
+        """
+        x1, y1 = max(rect[0], 0), max(rect[1], 0)
+        x2, y2 = min(rect[2], self.width - 1), min(rect[3], self.height - 1)
+        return (x1, y1, x2, y2) if x1 <= x2 and y1 <= y2 else None
+
+    def test_count(self):
+        self.assertEqual(self.index.count, len(self.rooms))
+
+    def test_overlaps(self):
+        rng = random.Random(4)
+        for i in range(300):
+            x, y = rng.randint(-5, self.width), rng.randint(-5, self.height)
+            rect = (x, y, x + rng.randint(0, 8), y + rng.randint(0, 8))
+            # Only the parts on the map count.
+            on_map = self.clip(rect)
+            expected = on_map is not None and any(
+                touches(on_map, self.clip(room)) for room in self.rooms
+                if self.clip(room) is not None)
+            self.assertEqual(self.index.overlaps(*rect), expected, rect)
+
+    def test_sharing_a_wall_overlaps(self):
+        index = tilemap.RoomIndex(20, 20, 4)
+        index.add(2, 2, 6, 6)
+        self.assertTrue(index.overlaps(6, 6, 9, 9))
+        self.assertTrue(index.overlaps(0, 0, 2, 2))
+        self.assertFalse(index.overlaps(7, 2, 9, 6))
+        self.assertFalse(index.overlaps(2, 7, 6, 9))
+
+    def test_room_at(self):
+        for y in range(self.height):
+            for x in range(self.width):
+                # Where rooms overlap, the one added last.
+                expected = None
+                for room_id, room in enumerate(self.rooms):
+                    if touches((x, y, x, y), room):
+                        expected = room_id
+                self.assertEqual(self.index.room_at(x, y), expected, (x, y))
+
+    def test_room_off_the_map(self):
+        index = tilemap.RoomIndex(10, 10, 4)
+        self.assertEqual(index.add(12, 12, 15, 15), 0)
+        self.assertEqual(index.add(-5, -5, 1, 1), 1)
+        self.assertEqual(index.count, 2)
+        self.assertFalse(index.overlaps(2, 2, 9, 9))
+        self.assertTrue(index.overlaps(1, 1, 3, 3))
+        self.assertEqual(index.room_at(0, 0), 1)
+        self.assertIsNone(index.room_at(9, 9))
+
+    def test_window(self):
+        for x, y, w, h in ((0, 0, self.width, self.height), (5, 7, 11, 6),
+                           (-4, -2, 9, 8), (35, 25, 10, 10)):
+            occupied = self.index.window(x, y, w, h)
+            self.assertEqual(len(occupied), w * h)
+            for wy in range(h):
+                for wx in range(w):
+                    cell = (x + wx, y + wy) * 2
+                    expected = (0 <= cell[0] < self.width and
+                                0 <= cell[1] < self.height and
+                                any(touches(cell, room)
+                                    for room in self.rooms))
+                    self.assertEqual(occupied[wy * w + wx], int(expected),
+                                     cell)
+
+
+class ChangeJournalTest(unittest.TestCase):
+
+    def test_nothing_recorded_without_subscribers(self):
+        tiles = tilemap.TileMap(4, 3)
+        tiles.set_terrain(1, 1, tilemap.FLOOR)
+        self.assertEqual(tiles.journal.entries, [])
+        tiles.journal.subscribe('fov')
+        self.assertEqual(tiles.journal.read('fov'), [])
+
+    def test_subscribers_read_on_their_own(self):
+        tiles = tilemap.TileMap(4, 3)
+        journal = tiles.journal
+        journal.subscribe('fov')
+        journal.subscribe('save')
+        tiles.set_terrain(1, 1, tilemap.FLOOR)
+        journal.end_turn()
+        tiles.set_tile(2, 1, False)
+        tiles[3][2].terrain = tilemap.DOOR
+        changes = [(0, 5, tilemap.FLOOR), (1, 6, tilemap.FLOOR),
+                   (1, 11, tilemap.DOOR)]
+        self.assertEqual(journal.read('fov'), changes)
+        # Reading drains the reader's own entries only.
+        self.assertEqual(journal.read('fov'), [])
+        tiles.set_terrain(0, 0, tilemap.WATER)
+        self.assertEqual(journal.read('fov'), [(1, 0, tilemap.WATER)])
+        self.assertEqual(journal.read('save'),
+                         changes + [(1, 0, tilemap.WATER)])
+        self.assertEqual(journal.read('save'), [])
+        # Entries everyone has read are dropped.
+        self.assertEqual(journal.entries, [])
+
+    def test_entries_kept_until_everyone_read_them(self):
+        journal = tilemap.TileMap(4, 3).journal
+        journal.subscribe('fov')
+        journal.subscribe('save')
+        journal.record(1, tilemap.FLOOR)
+        journal.record(2, tilemap.FLOOR)
+        journal.read('fov')
+        self.assertEqual(len(journal.entries), 2)
+        journal.record(3, tilemap.FLOOR)
+        self.assertEqual([i for turn, i, tile in journal.read('save')],
+                         [1, 2, 3])
+        self.assertEqual(len(journal.entries), 1)
+        self.assertEqual([i for turn, i, tile in journal.read('fov')], [3])
+        self.assertEqual(journal.entries, [])
+
+    def test_subscribe_starts_with_the_next_change(self):
+        journal = tilemap.TileMap(4, 3).journal
+        journal.subscribe('save')
+        journal.record(1, tilemap.FLOOR)
+        journal.subscribe('fov')
+        journal.record(2, tilemap.FLOOR)
+        self.assertEqual(journal.read('fov'), [(0, 2, tilemap.FLOOR)])
+        # Subscribing again skips what wasn't read yet.
+        journal.subscribe('save')
+        self.assertEqual(journal.read('save'), [])
+
+    def test_unsubscribe(self):
+        journal = tilemap.TileMap(4, 3).journal
+        journal.subscribe('fov')
+        journal.subscribe('save')
+        journal.record(1, tilemap.FLOOR)
+        journal.unsubscribe('save')
+        journal.read('fov')
+        self.assertEqual(journal.entries, [])
+        journal.unsubscribe('fov')
+        journal.record(2, tilemap.FLOOR)
+        self.assertEqual(journal.entries, [])
+        with self.assertRaises(KeyError):
+            journal.read('save')
+
+    def test_chunked_map_journals_map_indices(self):
+        tiles = tilemap.ChunkedTileMap(10, 10, 4)
+        tiles.journal.subscribe('fov')
+        tiles.set_terrain(5, 6, tilemap.FLOOR)
+        tiles[9][9].set(tilemap.DOOR)
+        self.assertEqual(tiles.journal.read('fov'),
+                         [(0, 65, tilemap.FLOOR), (0, 99, tilemap.DOOR)])
+        self.assertEqual(tiles.tile_type(5, 6), tilemap.FLOOR)
+        self.assertEqual(tiles.tile_type(9, 9), tilemap.DOOR)
+
+    def test_changed_cells(self):
+        old = bytearray(b'\x00\x01\x00\x00\x01\x01\x00\x00\x00')
+        new = bytearray(b'\x00\x01\x01\x00\x01\x01\x00\x02\x01')
+        self.assertEqual(tilemap.changed_cells(old, new, 3), [2, 7, 8])
+        self.assertEqual(tilemap.changed_cells(old, old, 3), [])
+
+
+class ChangeJournalTestWithoutNumPy(ChangeJournalTest):
+    """ The same tests on the pure Python fallbacks.
+
+    """
+    def setUp(self):
+        self.numpy_available = tilemap.numpy_available
+        tilemap.numpy_available = False
+
+    def tearDown(self):
+        tilemap.numpy_available = self.numpy_available
+
+
+if __name__ == '__main__':
+    unittest.main()
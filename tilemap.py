@@ -0,0 +1,1050 @@
+"""
+Array-backed tile storage for the dungeon map.
+
+The map used to be a list of lists of `Tile` objects. A `TileMap` keeps the
+same information in flat bytearray planes, one byte per cell, laid out in
+row-major order (index = y * width + x). That is the layout libtcod uses for
+its own maps and consoles, so whole planes can be handed over without
+reshuffling.
+
+"""
+from __future__ import print_function
+
+import binascii
+import zlib
+from array import array
+
+# Translation table flipping 0/1 planes, e.g. `blocked` into walkable.
+_INVERT = bytes(bytearray([1, 0] + [0] * 254))
+
+# Tile types. Every cell of a map's `terrain` plane holds one of these ids,
+# they index the property tables below and the renderer's color tables.
+FLOOR, WALL, DOOR, WATER, RUBBLE = range(5)
+TILE_TYPES = ('floor', 'wall', 'door', 'water', 'rubble')
+
+
+def _property_table(types):
+    """ Return a translate() table mapping the given tile types to 1.
+
+    """
+    return bytes(bytearray(1 if i in types else 0 for i in range(256)))
+
+
+# Tile properties by type. terrain.translate(BLOCKS_MOVEMENT) gives the
+# blocked plane of a whole map in one pass.
+BLOCKS_MOVEMENT = _property_table((WALL, WATER))
+BLOCKS_SIGHT = _property_table((WALL, DOOR))
+WALKABLE = bytes(BLOCKS_MOVEMENT).translate(_INVERT)
+TRANSPARENT = bytes(BLOCKS_SIGHT).translate(_INVERT)
+
+# The tile type with the given (blocked << 1 | block_sight) flags.
+_FLAG_TYPES = (FLOOR, DOOR, WATER, WALL)
+
+
+def tile_type(blocked, block_sight):
+    """ Return the tile type that blocks movement and sight as given.
+
+    """
+    return _FLAG_TYPES[(2 if blocked else 0) + (1 if block_sight else 0)]
+
+
+try:  # NumPy is optional, the planes are plain bytearrays without it.
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+
+def _copy_rows(src, src_width, sx, sy, dst, dst_width, dx, dy, w, h):
+    """ Copy a w x h block between two row-major planes, one slice per row.
+
+    """
+    for row in range(h):
+        s = (sy + row) * src_width + sx
+        d = (dy + row) * dst_width + dx
+        dst[d:d + w] = src[s:s + w]
+
+
+def array_to_bytes(values):
+    """ Return the raw bytes of an array.array.
+
+    """
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
+def array_from_bytes(typecode, data):
+    """ Build an array.array of the given type from raw bytes.
+
+    """
+    values = array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    return values
+
+
+def add_planes(*planes):
+    """ Return the cell by cell sum of byte planes of the same size.
+
+    Every sum must fit a byte. Without NumPy the planes are added as big
+    integers, one byte per cell, which can't carry over from one cell into
+    the next as long as the sums fit.
+
+    """
+    size = len(planes[0])
+    if numpy_available:
+        total = numpy.zeros(size, numpy.uint8)
+        for plane in planes:
+            total += numpy.frombuffer(bytes(plane), numpy.uint8)
+        return bytearray(total.tobytes())
+    total = sum(int(binascii.hexlify(bytes(plane)) or b'0', 16)
+                for plane in planes)
+    return bytearray(binascii.unhexlify('{:0{}x}'.format(total, 2 * size)))
+
+
+def changed_cells(old, new, width):
+    """ Return the indices of the cells that differ between two planes.
+
+    Both planes have the same size. Without NumPy, rows of `width` cells
+    that didn't change are skipped with one comparison each.
+
+    """
+    if numpy_available:
+        return numpy.flatnonzero(numpy.frombuffer(bytes(old), numpy.uint8) !=
+                                 numpy.frombuffer(bytes(new), numpy.uint8)
+                                 ).tolist()
+    changed = []
+    for start in range(0, len(new), width):
+        stop = start + width
+        if old[start:stop] != new[start:stop]:
+            changed.extend(i for i in range(start, stop) if old[i] != new[i])
+    return changed
+
+
+def _fill_region(todo, width, start):
+    """ Clear the region of open cells around `start` from the `todo` plane.
+
+    Returns the (start, end) index spans of the region, one per row run.
+    The fill works a whole span at a time through bytearray.find, so the
+    cost grows with the number of spans rather than cells.
+
+    """
+    size = len(todo)
+    spans = []
+    stack = [start]
+    while stack:
+        i = stack.pop()
+        if not todo[i]:
+            continue
+        row = i - i % width
+        row_end = row + width
+        left = max(todo.rfind(b'\x00', row, i) + 1, row)
+        right = todo.find(b'\x00', i, row_end)
+        if right == -1:
+            right = row_end
+        todo[left:right] = bytearray(right - left)
+        spans.append((left, right))
+
+        # Seed every run of open cells touching the span above and below.
+        for offset in (-width, width):
+            lo, hi = left + offset, right + offset
+            if lo < 0 or hi > size:
+                continue
+            j = todo.find(b'\x01', lo, hi)
+            while j != -1:
+                stack.append(j)
+                k = todo.find(b'\x00', j, hi)
+                if k == -1:
+                    break
+                j = todo.find(b'\x01', k, hi)
+    return spans
+
+
+def find_regions(open_cells, width):
+    """ Split the open cells of a row-major 0/1 plane into connected regions.
+
+    Cells connect to their four direct neighbours. Returns one list per
+    region, holding the (start, end) index spans it covers on each row.
+
+    """
+    todo = bytearray(open_cells)
+    regions = []
+    start = todo.find(b'\x01')
+    while start != -1:
+        regions.append(_fill_region(todo, width, start))
+        start = todo.find(b'\x01', start)
+    return regions
+
+
+def flood_fill(open_cells, width, x, y):
+    """ Return the spans of the region of open cells connected to (x, y).
+
+    The list is empty if the cell itself is closed.
+
+    """
+    todo = bytearray(open_cells)
+    return _fill_region(todo, width, y * width + x)
+
+
+def _label_regions_numpy(open_cells, width):
+    # Connected-component labeling over row runs: number the runs of open
+    # cells in index order, link the runs that touch vertically, then merge
+    # linked runs with min-label hooking and pointer jumping, all vectorized.
+    size = len(open_cells)
+    cells = numpy.frombuffer(bytes(open_cells), numpy.uint8) != 0
+    starts = cells.copy()
+    starts[1:] &= ~cells[:-1]
+    starts[::width] = cells[::width]
+    run = numpy.cumsum(starts, dtype=numpy.int32) - 1
+    count = int(run[-1]) + 1 if size else 0
+
+    touching = numpy.flatnonzero(cells[:-width] & cells[width:])
+    upper = run[touching]
+    lower = run[touching + width]
+    if len(upper):  # one link per pair of runs is enough
+        new = numpy.ones(len(upper), bool)
+        new[1:] = (upper[1:] != upper[:-1]) | (lower[1:] != lower[:-1])
+        upper, lower = upper[new], lower[new]
+
+    # Every label is at most its run's own number, so hooking a root to a
+    # smaller root can never make a cycle. A region ends up labeled with its
+    # first run.
+    label = numpy.arange(count, dtype=numpy.int32)
+    while True:
+        jumped = label[label]
+        while (jumped != label).any():
+            label = jumped
+            jumped = label[label]
+        top, bottom = label[upper], label[lower]
+        if (top == bottom).all():
+            break
+        low = numpy.minimum(top, bottom)
+        label[top[top > low]] = low[top > low]
+        label[bottom[bottom > low]] = low[bottom > low]
+
+    roots, region = numpy.unique(label, return_inverse=True)
+    open_at = numpy.flatnonzero(cells)
+    region = region.astype(numpy.int32)[run[open_at]]
+    labels = numpy.full(size, -1, numpy.int32)
+    labels[open_at] = region
+    sizes = numpy.bincount(region, minlength=len(roots))
+    return (array_from_bytes('i', labels.tobytes()),
+            [int(n) for n in sizes])
+
+
+def label_regions(open_cells, width):
+    """ Label every cell of a 0/1 plane with the number of its region.
+
+    Returns an array('i') of region numbers, -1 for closed cells, and the
+    size of every region. Regions are numbered like find_regions orders
+    them, so two cells are connected if and only if they have the same
+    label. With NumPy the whole plane is labeled without a per-span loop.
+
+    """
+    if numpy_available:
+        return _label_regions_numpy(open_cells, width)
+    labels = array('i', [-1]) * len(open_cells)
+    sizes = []
+    for region, spans in enumerate(find_regions(open_cells, width)):
+        label = array('i', [region])
+        size = 0
+        for start, end in spans:
+            labels[start:end] = label * (end - start)
+            size += end - start
+        sizes.append(size)
+    return labels, sizes
+
+
+class ChangeJournal(object):
+    """ The terrain changes made to a map in play, turn by turn.
+
+    The mutation API of a map (`set_terrain`, `set_tile` and Tile views)
+    records every change as a (turn, index, tile type) entry, `end_turn`
+    closes the current turn. Whatever mirrors the terrain elsewhere, such as
+    the FOV map or the save game, subscribes under a name and then `read`s
+    the entries recorded since its last read, so it only updates the cells
+    that changed.
+
+    Nothing is recorded while nobody is subscribed, and entries are dropped
+    as soon as every subscriber has read them.
+
+    """
+    def __init__(self):
+        self.turn = 0
+        self.entries = []
+        # The position of entries[0] since the journal was created, and the
+        # position each subscriber reads from next.
+        self.start = 0
+        self.cursors = {}
+
+    def record(self, index, tile):
+        if self.cursors:
+            self.entries.append((self.turn, index, tile))
+
+    def end_turn(self):
+        self.turn += 1
+
+    def subscribe(self, name):
+        """ Read the journal under `name`, starting with the next change.
+
+        Subscribing again under the same name skips what wasn't read yet.
+
+        """
+        self.cursors[name] = self.start + len(self.entries)
+        self._trim()
+
+    def unsubscribe(self, name):
+        self.cursors.pop(name, None)
+        self._trim()
+
+    def read(self, name):
+        """ Return the entries recorded since the last read under `name`.
+
+        """
+        entries = self.entries[self.cursors[name] - self.start:]
+        self.cursors[name] = self.start + len(self.entries)
+        self._trim()
+        return entries
+
+    def _trim(self):
+        end = self.start + len(self.entries)
+        first = min(self.cursors.values()) if self.cursors else end
+        if first > self.start:
+            del self.entries[:first - self.start]
+            self.start = first
+
+
+class Tile(object):
+    """ A tile on the map and its properties
+
+    This is only a view into one cell of a `TileMap` so that the old
+    `map[x][y].blocked` style keeps working. Hot paths should index the planes
+    directly instead of creating one of these per cell.
+
+    Changing `terrain`, `blocked` or `block_sight` through a view goes
+    through the map's mutation API like `TileMap.set_tile` does, so the
+    change is journaled. The flags pick the tile type that has them.
+
+    """
+    __slots__ = ('tiles', 'index')
+
+    def __init__(self, tiles, index):
+        self.tiles = tiles
+        self.index = index
+
+    @property
+    def terrain(self):
+        return self.tiles.terrain[self.index]
+
+    @terrain.setter
+    def terrain(self, value):
+        self.set(value)
+
+    @property
+    def blocked(self):
+        return bool(self.tiles.blocked[self.index])
+
+    @blocked.setter
+    def blocked(self, value):
+        self.set(tile_type(value, self.block_sight))
+
+    @property
+    def block_sight(self):
+        return bool(self.tiles.block_sight[self.index])
+
+    @block_sight.setter
+    def block_sight(self, value):
+        self.set(tile_type(self.blocked, value))
+
+    @property
+    def explored(self):
+        return bool(self.tiles.explored[self.index])
+
+    @explored.setter
+    def explored(self, value):
+        self.tiles.explored[self.index] = 1 if value else 0
+
+    def set(self, tile):
+        """ Change the tile type of the cell.
+
+        """
+        self.tiles.set_cell(self.index, tile)
+
+
+class ChunkTile(Tile):
+    """ A Tile view into a `ChunkedTileMap`.
+
+    Reads go to the chunk holding the cell, changes to the map, which
+    journals them under map-wide indices. A cell whose chunk doesn't exist
+    yet reads as unexplored wall; only changing it creates the chunk.
+
+    """
+    __slots__ = ('map', 'x', 'y')
+
+    def __init__(self, tiles, x, y):
+        self.map = tiles
+        self.x = x
+        self.y = y
+        self._bind(create=False)
+
+    def _bind(self, create):
+        size = self.map.chunk_size
+        chunk = self.map.chunk(self.x // size, self.y // size, create)
+        if chunk is None:
+            Tile.__init__(self, _MISSING_CHUNK, 0)
+        else:
+            Tile.__init__(self, chunk,
+                          (self.y % size) * size + self.x % size)
+
+    def _set_explored(self, value):
+        self._bind(create=True)
+        Tile.explored.fset(self, value)
+
+    explored = property(Tile.explored.fget, _set_explored)
+
+    def set(self, tile):
+        self.map.set_terrain(self.x, self.y, tile)
+        self._bind(create=True)
+
+
+class TileColumn(object):
+    """ The `map[x]` part of a `map[x][y]` lookup.
+
+    """
+    __slots__ = ('tiles', 'x')
+
+    def __init__(self, tiles, x):
+        self.tiles = tiles
+        self.x = x
+
+    def __len__(self):
+        return self.tiles.height
+
+    def __getitem__(self, y):
+        height = self.tiles.height
+        if y < 0:
+            y += height
+        if not 0 <= y < height:
+            raise IndexError('tile row out of range')
+        return Tile(self.tiles, y * self.tiles.width + self.x)
+
+    def __iter__(self):
+        for y in range(self.tiles.height):
+            yield self[y]
+
+
+class TileMap(object):
+    """ A compact grid of tiles.
+
+    Each tile property lives in its own bytearray plane, one byte per cell:
+
+        terrain      - the tile type: FLOOR, WALL, DOOR, WATER or RUBBLE
+        blocked      - 1 if the tile cannot be walked through
+        block_sight  - 1 if the tile blocks the line of sight
+        explored     - 1 if the player has seen the tile at least once
+
+    `blocked` and `block_sight` follow from the terrain through the
+    BLOCKS_MOVEMENT and BLOCKS_SIGHT tables, they are kept as planes of
+    their own because nearly every query needs one of them.
+
+    Index a cell with `index(x, y)`. When NumPy is available, `array(plane)`
+    returns a (height, width) view over a plane that shares its memory, so
+    bulk operations write straight into the map.
+
+    Generation writes the planes directly, keeping the three in step (see
+    `load_terrain`). Terrain that changes once the level is in play (doors,
+    digging) must go through `set_terrain` or `set_tile`, which record the
+    change in `journal` (a ChangeJournal), so the FOV map and the save game
+    can be patched instead of rebuilt.
+
+    """
+    PLANES = ('terrain', 'blocked', 'block_sight', 'explored')
+
+    def __init__(self, width, height, blocked=True):
+        self.width = width
+        self.height = height
+
+        # The map starts out as all wall or all floor. WALL is 1 and FLOOR
+        # is 0, so one fill serves all three planes.
+        fill = b'\x01' if blocked else b'\x00'
+        self.terrain = bytearray(fill * (width * height))
+        self.blocked = bytearray(fill * (width * height))
+        self.block_sight = bytearray(fill * (width * height))
+        self.explored = bytearray(width * height)
+        self.journal = ChangeJournal()
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.width
+        if not 0 <= x < self.width:
+            raise IndexError('tile column out of range')
+        return TileColumn(self, x)
+
+    def __iter__(self):
+        for x in range(self.width):
+            yield TileColumn(self, x)
+
+    def index(self, x, y):
+        """ Return the plane offset of the cell at (x, y).
+
+        """
+        return y * self.width + x
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_blocked(self, x, y):
+        return self.blocked[y * self.width + x]
+
+    def blocks_sight(self, x, y):
+        return self.block_sight[y * self.width + x]
+
+    def is_explored(self, x, y):
+        return self.explored[y * self.width + x]
+
+    def tile_type(self, x, y):
+        return self.terrain[y * self.width + x]
+
+    def window(self, x, y, w, h):
+        """ Return a w x h TileMap copy of the area starting at (x, y).
+
+        Cells outside of the map come back as unexplored walls. A window
+        covering exactly the whole map is the map itself, not a copy.
+
+        """
+        if (x, y, w, h) == (0, 0, self.width, self.height):
+            return self
+
+        view = TileMap(w, h)
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        if x2 > x1 and y2 > y1:
+            for plane in self.PLANES:
+                _copy_rows(getattr(self, plane), self.width, x1, y1,
+                           getattr(view, plane), w, x1 - x, y1 - y,
+                           x2 - x1, y2 - y1)
+        return view
+
+    def paste(self, x, y, tiles, planes=PLANES):
+        """ Copy the planes of another TileMap onto the area at (x, y).
+
+        This is the reverse of `window`. Cells falling outside of the map are
+        dropped.
+
+        """
+        if tiles is self:
+            return
+
+        x1, y1 = max(x, 0), max(y, 0)
+        x2 = min(x + tiles.width, self.width)
+        y2 = min(y + tiles.height, self.height)
+        if x2 > x1 and y2 > y1:
+            for plane in planes:
+                _copy_rows(getattr(tiles, plane), tiles.width, x1 - x, y1 - y,
+                           getattr(self, plane), self.width, x1, y1,
+                           x2 - x1, y2 - y1)
+
+    def explored_state(self):
+        """ Return the explored plane in a compact, picklable form.
+
+        """
+        return zlib.compress(bytes(self.explored))
+
+    def restore_explored(self, state):
+        """ Load an explored plane returned by `explored_state`.
+
+        """
+        self.explored[:] = zlib.decompress(state)
+
+    def set_cell(self, i, tile):
+        """ Change the tile type of the cell at offset i, see set_terrain.
+
+        """
+        self.terrain[i] = tile
+        self.blocked[i] = BLOCKS_MOVEMENT[tile]
+        self.block_sight[i] = BLOCKS_SIGHT[tile]
+        self.journal.record(i, tile)
+
+    def set_terrain(self, x, y, tile):
+        """ Change the tile type of a level in play and journal the change.
+
+        """
+        self.set_cell(self.index(x, y), tile)
+
+    def set_tile(self, x, y, blocked, block_sight=None):
+        """ Change a tile by its flags, see `tile_type`, and journal it.
+
+        By default, a blocked tile also blocks sight.
+
+        """
+        if block_sight is None:
+            block_sight = blocked
+        self.set_terrain(x, y, tile_type(blocked, block_sight))
+
+    def load_terrain(self, terrain):
+        """ Replace the whole terrain plane, updating the flag planes to match.
+
+        The flags come from the property tables in one pass each.
+
+        """
+        self.terrain[:] = terrain
+        self.blocked[:] = self.terrain.translate(BLOCKS_MOVEMENT)
+        self.block_sight[:] = self.terrain.translate(BLOCKS_SIGHT)
+
+    def transparency(self):
+        """ Return a new plane holding 1 where a tile lets light through.
+
+        """
+        return self.terrain.translate(TRANSPARENT)
+
+    def walkability(self):
+        """ Return a new plane holding 1 where a tile can be walked on.
+
+        """
+        return self.terrain.translate(WALKABLE)
+
+    def carve_rect(self, x1, y1, x2, y2):
+        """ Make every cell within the inclusive rectangle floor.
+
+        With NumPy this is a single 2D slice assignment per plane, otherwise
+        one slice assignment per row. FLOOR is 0, like its flags.
+
+        """
+        if x2 < x1 or y2 < y1:
+            return
+
+        if numpy_available:
+            self.array('terrain')[y1:y2 + 1, x1:x2 + 1] = FLOOR
+            self.array('blocked')[y1:y2 + 1, x1:x2 + 1] = 0
+            self.array('block_sight')[y1:y2 + 1, x1:x2 + 1] = 0
+            return
+
+        length = x2 - x1 + 1
+        clear = b'\x00' * length
+        terrain = self.terrain
+        blocked = self.blocked
+        block_sight = self.block_sight
+        for start in range(self.index(x1, y1), self.index(x1, y2) + 1,
+                           self.width):
+            terrain[start:start + length] = clear
+            blocked[start:start + length] = clear
+            block_sight[start:start + length] = clear
+
+    def carve_h(self, x1, x2, y):
+        """ Make a horizontal span floor, in either direction.
+
+        """
+        start = self.index(min(x1, x2), y)
+        stop = self.index(max(x1, x2), y) + 1
+        clear = b'\x00' * (stop - start)
+        self.terrain[start:stop] = clear
+        self.blocked[start:stop] = clear
+        self.block_sight[start:stop] = clear
+
+    def carve_v(self, y1, y2, x):
+        """ Make a vertical span floor, in either direction.
+
+        A column is a strided slice of the row-major planes.
+
+        """
+        start = self.index(x, min(y1, y2))
+        stop = self.index(x, max(y1, y2)) + 1
+        clear = b'\x00' * (abs(y2 - y1) + 1)
+        self.terrain[start:stop:self.width] = clear
+        self.blocked[start:stop:self.width] = clear
+        self.block_sight[start:stop:self.width] = clear
+
+    def carve_many(self, rects=(), h_tunnels=(), v_tunnels=()):
+        """ Carve a whole layout in one call.
+
+        `rects` holds inclusive (x1, y1, x2, y2) rectangles, `h_tunnels` holds
+        (x1, x2, y) spans and `v_tunnels` holds (y1, y2, x) spans, the same
+        arguments `carve_rect`, `carve_h` and `carve_v` take.
+
+        """
+        carve_rect, carve_h, carve_v = (self.carve_rect, self.carve_h,
+                                        self.carve_v)
+        for x1, y1, x2, y2 in rects:
+            carve_rect(x1, y1, x2, y2)
+        for x1, x2, y in h_tunnels:
+            carve_h(x1, x2, y)
+        for y1, y2, x in v_tunnels:
+            carve_v(y1, y2, x)
+
+    def array(self, plane):
+        """ Return a NumPy (height, width) view of the named plane.
+
+        The view is indexed as [y, x] and writes through to the map.
+
+        """
+        if not numpy_available:
+            raise RuntimeError('TileMap.array requires NumPy.')
+        if plane not in self.PLANES:
+            raise ValueError('Unknown tile plane: {}'.format(plane))
+        buf = getattr(self, plane)
+        return numpy.frombuffer(buf, dtype=numpy.uint8).reshape(
+            self.height, self.width)
+
+
+class RoomIndex(object):
+    """ Spatial index of the rooms placed on a map.
+
+    The map is cut into square buckets of `bucket_size` tiles, every bucket
+    listing the ids of the rooms whose bounds, walls included, reach into
+    it. Checking a candidate or looking up a tile only looks at the rooms in
+    the buckets it touches, so the cost does not grow with the number of
+    rooms already placed, and memory follows the number of rooms rather than
+    the map size.
+
+    Room ids are handed out in insertion order, so they double as indices
+    into the caller's list of rooms.
+
+    """
+    def __init__(self, width, height, bucket_size=64):
+        self.width = width
+        self.height = height
+        self.bucket_size = bucket_size
+        # The bounds of every room clipped to the map, by room id, and the
+        # room ids by bucket key. Buckets without rooms are left out.
+        self.bounds = []
+        self.buckets = {}
+
+    @property
+    def count(self):
+        return len(self.bounds)
+
+    def _clip(self, x1, y1, x2, y2):
+        """ Return an inclusive rectangle clipped to the map, or None.
+
+        """
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.width - 1), min(y2, self.height - 1)
+        if x2 < x1 or y2 < y1:
+            return None
+        return x1, y1, x2, y2
+
+    def _keys(self, x1, y1, x2, y2):
+        """ Yield the keys of the buckets a clipped rectangle touches.
+
+        """
+        size = self.bucket_size
+        for by in range(y1 // size, y2 // size + 1):
+            for bx in range(x1 // size, x2 // size + 1):
+                yield bx, by
+
+    def _rooms(self, x1, y1, x2, y2):
+        """ Yield the ids of the rooms whose bounds touch the rectangle.
+
+        """
+        rect = self._clip(x1, y1, x2, y2)
+        if rect is None:
+            return
+        x1, y1, x2, y2 = rect
+        seen = set()
+        for key in self._keys(*rect):
+            for room_id in self.buckets.get(key, ()):
+                if room_id in seen:
+                    continue
+                seen.add(room_id)
+                rx1, ry1, rx2, ry2 = self.bounds[room_id]
+                if rx1 <= x2 and rx2 >= x1 and ry1 <= y2 and ry2 >= y1:
+                    yield room_id
+
+    def overlaps(self, x1, y1, x2, y2):
+        """ Return True if the inclusive rectangle touches any indexed room.
+
+        This matches `Rect.intersect` against every placed room, sharing a
+        wall counts as an overlap.
+
+        """
+        return next(self._rooms(x1, y1, x2, y2), None) is not None
+
+    def add(self, x1, y1, x2, y2):
+        """ Index a room covering the inclusive rectangle and return its id.
+
+        """
+        room_id = len(self.bounds)
+        rect = self._clip(x1, y1, x2, y2)
+        # A room entirely off the map still takes an id, it covers nothing.
+        self.bounds.append(rect or (0, 0, -1, -1))
+        if rect is not None:
+            for key in self._keys(*rect):
+                self.buckets.setdefault(key, []).append(room_id)
+        return room_id
+
+    def room_at(self, x, y):
+        """ Return the id of the room whose bounds contain (x, y), or None.
+
+        Where rooms overlap, the one added last wins.
+
+        """
+        size = self.bucket_size
+        for room_id in reversed(self.buckets.get((x // size, y // size), ())):
+            x1, y1, x2, y2 = self.bounds[room_id]
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                return room_id
+        return None
+
+    def window(self, x, y, w, h):
+        """ Return the occupancy plane of the w x h area starting at (x, y):
+            1 for the cells inside some room's bounds.
+
+        Cells outside of the map are free.
+
+        """
+        occupied = bytearray(w * h)
+        for room_id in self._rooms(x, y, x + w - 1, y + h - 1):
+            x1, y1, x2, y2 = self.bounds[room_id]
+            x1, y1 = max(x1, x) - x, max(y1, y) - y
+            x2, y2 = min(x2, x + w - 1) - x, min(y2, y + h - 1) - y
+            length = x2 - x1 + 1
+            for start in range(y1 * w + x1, y2 * w + x1 + 1, w):
+                occupied[start:start + length] = b'\x01' * length
+        return occupied
+
+
+# What the cells of chunks that don't exist yet read as, see ChunkTile.
+_MISSING_CHUNK = TileMap(1, 1)
+
+
+class ChunkColumn(object):
+    """ The `map[x]` part of a `map[x][y]` lookup on a `ChunkedTileMap`.
+
+    """
+    __slots__ = ('tiles', 'x')
+
+    def __init__(self, tiles, x):
+        self.tiles = tiles
+        self.x = x
+
+    def __len__(self):
+        return self.tiles.height
+
+    def __getitem__(self, y):
+        tiles = self.tiles
+        if y < 0:
+            y += tiles.height
+        if not 0 <= y < tiles.height:
+            raise IndexError('tile row out of range')
+        return ChunkTile(tiles, self.x, y)
+
+    def __iter__(self):
+        for y in range(self.tiles.height):
+            yield self[y]
+
+
+class ChunkedTileMap(object):
+    """ A map too large to keep in memory as a whole.
+
+    The map is split into square `TileMap` chunks that are only created the
+    first time something is written to them. Until then a chunk reads as
+    unexplored wall, which is what most of a freshly generated level is, so
+    memory follows the carved and explored area instead of the level size.
+
+    It answers the same per-cell queries and carving calls as `TileMap`. The
+    raw planes only exist per chunk, bulk work goes through `window`, which
+    copies an area (such as what the camera sees) into a plain `TileMap`,
+    and `paste`, which writes one back.
+
+    `index(x, y)` still numbers cells across the whole map, those are the
+    indices in the map's `journal`. The chunks don't journal anything.
+
+    """
+    PLANES = TileMap.PLANES
+
+    def __init__(self, width, height, chunk_size=64):
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.chunks = {}
+        self.journal = ChangeJournal()
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.width
+        if not 0 <= x < self.width:
+            raise IndexError('tile column out of range')
+        return ChunkColumn(self, x)
+
+    def __iter__(self):
+        for x in range(self.width):
+            yield ChunkColumn(self, x)
+
+    def chunk(self, cx, cy, create=True):
+        """ Return the chunk at chunk coordinates (cx, cy).
+
+        Missing chunks are created, unless `create` is False in which case
+        None is returned.
+
+        """
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None and create:
+            chunk = TileMap(self.chunk_size, self.chunk_size)
+            self.chunks[(cx, cy)] = chunk
+        return chunk
+
+    def _chunk_spans(self, x, y, w, h):
+        """ Yield (cx, cy, x1, y1, x2, y2) for every chunk the area touches.
+
+        (x1, y1)-(x2, y2) is the part of the area, clipped to the map, that
+        lies in that chunk, in map coordinates with exclusive ends.
+
+        """
+        size = self.chunk_size
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        if x2 <= x1 or y2 <= y1:
+            return
+        for cy in range(y1 // size, (y2 - 1) // size + 1):
+            for cx in range(x1 // size, (x2 - 1) // size + 1):
+                yield (cx, cy,
+                       max(x1, cx * size), max(y1, cy * size),
+                       min(x2, (cx + 1) * size), min(y2, (cy + 1) * size))
+
+    def _cell(self, plane, x, y, default):
+        size = self.chunk_size
+        chunk = self.chunks.get((x // size, y // size))
+        if chunk is None:
+            return default
+        return getattr(chunk, plane)[(y % size) * size + x % size]
+
+    def index(self, x, y):
+        """ Return the map-wide number of the cell at (x, y).
+
+        """
+        return y * self.width + x
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_blocked(self, x, y):
+        return self._cell('blocked', x, y, 1)
+
+    def blocks_sight(self, x, y):
+        return self._cell('block_sight', x, y, 1)
+
+    def is_explored(self, x, y):
+        return self._cell('explored', x, y, 0)
+
+    def tile_type(self, x, y):
+        return self._cell('terrain', x, y, WALL)
+
+    def window(self, x, y, w, h):
+        """ Return a w x h TileMap copy of the area starting at (x, y).
+
+        """
+        size = self.chunk_size
+        view = TileMap(w, h)
+        for cx, cy, x1, y1, x2, y2 in self._chunk_spans(x, y, w, h):
+            chunk = self.chunks.get((cx, cy))
+            if chunk is None:
+                continue
+            for plane in self.PLANES:
+                _copy_rows(getattr(chunk, plane), size,
+                           x1 - cx * size, y1 - cy * size,
+                           getattr(view, plane), w, x1 - x, y1 - y,
+                           x2 - x1, y2 - y1)
+        return view
+
+    def paste(self, x, y, tiles, planes=PLANES):
+        """ Copy the planes of a TileMap onto the area at (x, y).
+
+        """
+        size = self.chunk_size
+        for cx, cy, x1, y1, x2, y2 in self._chunk_spans(x, y, tiles.width,
+                                                        tiles.height):
+            chunk = self.chunk(cx, cy)
+            for plane in planes:
+                _copy_rows(getattr(tiles, plane), tiles.width, x1 - x, y1 - y,
+                           getattr(chunk, plane), size,
+                           x1 - cx * size, y1 - cy * size,
+                           x2 - x1, y2 - y1)
+
+    def load_terrain(self, terrain):
+        """ Replace the terrain of the whole map from a row-major plane of
+            width x height cells, as `TileMap.load_terrain` does.
+
+        The plane is cut into chunks as it is loaded. Chunks that would be
+        all wall and don't exist yet are left out, they read as wall anyway.
+
+        """
+        size = self.chunk_size
+        all_wall = bytearray([WALL]) * (size * size)
+        for cx, cy, x1, y1, x2, y2 in self._chunk_spans(0, 0, self.width,
+                                                        self.height):
+            # Cells past the edge of the map stay wall.
+            plane = bytearray(all_wall)
+            _copy_rows(terrain, self.width, x1, y1, plane, size,
+                       x1 - cx * size, y1 - cy * size, x2 - x1, y2 - y1)
+            if plane == all_wall and (cx, cy) not in self.chunks:
+                continue
+            self.chunk(cx, cy).load_terrain(plane)
+
+    def explored_state(self):
+        """ Return the explored planes of the chunks that have been seen.
+
+        """
+        return dict((key, chunk.explored_state())
+                    for key, chunk in self.chunks.items()
+                    if b'\x01' in chunk.explored)
+
+    def restore_explored(self, state):
+        """ Load explored planes returned by `explored_state`.
+
+        """
+        for (cx, cy), chunk_state in state.items():
+            self.chunk(cx, cy).restore_explored(chunk_state)
+
+    def set_terrain(self, x, y, tile):
+        """ Change the tile type of a level in play and journal the change.
+
+        """
+        size = self.chunk_size
+        self.chunk(x // size, y // size).set_cell(
+            (y % size) * size + x % size, tile)
+        self.journal.record(self.index(x, y), tile)
+
+    def set_tile(self, x, y, blocked, block_sight=None):
+        """ Change a tile by its flags, see `TileMap.set_tile`.
+
+        """
+        if block_sight is None:
+            block_sight = blocked
+        self.set_terrain(x, y, tile_type(blocked, block_sight))
+
+    def carve_rect(self, x1, y1, x2, y2):
+        """ Make every cell within the inclusive rectangle floor.
+
+        """
+        size = self.chunk_size
+        for cx, cy, ax, ay, bx, by in self._chunk_spans(x1, y1, x2 - x1 + 1,
+                                                        y2 - y1 + 1):
+            ox, oy = cx * size, cy * size
+            self.chunk(cx, cy).carve_rect(ax - ox, ay - oy,
+                                          bx - 1 - ox, by - 1 - oy)
+
+    def carve_h(self, x1, x2, y):
+        self.carve_rect(min(x1, x2), y, max(x1, x2), y)
+
+    def carve_v(self, y1, y2, x):
+        self.carve_rect(x, min(y1, y2), x, max(y1, y2))
+
+    def carve_many(self, rects=(), h_tunnels=(), v_tunnels=()):
+        """ Carve a whole layout in one call, see `TileMap.carve_many`.
+
+        """
+        for x1, y1, x2, y2 in rects:
+            self.carve_rect(x1, y1, x2, y2)
+        for x1, x2, y in h_tunnels:
+            self.carve_rect(min(x1, x2), y, max(x1, x2), y)
+        for y1, y2, x in v_tunnels:
+            self.carve_rect(x, min(y1, y2), x, max(y1, y2))